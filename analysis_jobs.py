@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+非同期ジョブ管理 - 長時間の演技分析をジョブとして実行する
+
+同じ演技構成（routine_hash が一致）のジョブは重複実行せず、既存ジョブを返す。
+ジョブは上限付きのワーカーで実行し、完了後は TTL の間だけ結果を保持する。
+再接続したクライアントは同じ結果を受け取れるため、有料の生成をやり直さない。
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+
+
+def routine_hash(apparatus: str, routine_data: List[Dict], **extra: Any) -> str:
+    """種目・技の並び・追加条件から決まる正規化ハッシュ"""
+    payload = {
+        "apparatus": apparatus,
+        "skills": [
+            {
+                "name": skill.get("name"),
+                "valueLetter": skill.get("valueLetter"),
+                "group": skill.get("group"),
+                "value": skill.get("value"),
+            }
+            for skill in routine_data
+        ],
+        "extra": extra,
+    }
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class AnalysisJob:
+    id: str
+    key: str
+    status: str = JOB_QUEUED
+    result: Optional[Dict] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    done_event: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == JOB_DONE:
+            data["result"] = self.result
+        elif self.status == JOB_ERROR:
+            data["error"] = self.error
+        return data
+
+
+class AnalysisJobManager:
+    """ルーチンハッシュで重複排除するジョブキュー"""
+
+    def __init__(self, worker_count: int = 4, ttl_seconds: float = 3600.0, max_jobs: int = 1000):
+        self.worker_count = worker_count
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self.jobs: Dict[str, AnalysisJob] = {}
+        self._by_key: Dict[str, str] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._runners: Dict[str, Callable[[], Awaitable[Dict]]] = {}
+        self.deduplicated = 0
+
+    def _ensure_workers(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.ttl_seconds
+        ]
+        for job_id in expired:
+            job = self.jobs.pop(job_id)
+            if self._by_key.get(job.key) == job_id:
+                del self._by_key[job.key]
+
+    def submit(self, key: str, runner: Callable[[], Awaitable[Dict]]) -> Tuple[AnalysisJob, bool]:
+        """ジョブを登録する。同じキーの有効なジョブがあればそれを返す"""
+        self._purge_expired()
+        existing_id = self._by_key.get(key)
+        if existing_id:
+            existing = self.jobs.get(existing_id)
+            if existing and existing.status != JOB_ERROR:
+                self.deduplicated += 1
+                return existing, True
+        if len(self.jobs) >= self.max_jobs:
+            raise RuntimeError("ジョブ数が上限に達しています")
+
+        self._ensure_workers()
+        job = AnalysisJob(id=uuid.uuid4().hex, key=key)
+        self.jobs[job.id] = job
+        self._by_key[key] = job.id
+        self._runners[job.id] = runner
+        self._queue.put_nowait(job.id)
+        return job, False
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        self._purge_expired()
+        return self.jobs.get(job_id)
+
+    async def wait(self, job: AnalysisJob, timeout: float) -> AnalysisJob:
+        """完了まで最大 timeout 秒待つ（ロングポーリング用）"""
+        if timeout > 0 and job.status in (JOB_QUEUED, JOB_RUNNING):
+            try:
+                await asyncio.wait_for(job.done_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "jobs": counts,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "workers": self.worker_count,
+            "deduplicated": self.deduplicated,
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            runner = self._runners.pop(job_id, None)
+            if job is None or runner is None:
+                continue
+            job.status = JOB_RUNNING
+            try:
+                job.result = await runner()
+                job.status = JOB_DONE
+            except Exception as e:
+                job.error = str(e)
+                job.status = JOB_ERROR
+            finally:
+                job.finished_at = time.time()
+                job.done_event.set()
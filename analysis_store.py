@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+演技分析の永続ストア - 同じ演技構成の分析を再起動・スケール後も使い回す
+
+キーは種目・技の並び・モデル・プロンプトのバージョン・知識ベースのバージョン（と分析の種類・条件）の
+正規化ハッシュで、どれかが変われば別のキーになる（古い結果は参照されず、やがて追い出される）。
+SQLite の WAL モードで保存するため、同じホストの複数ワーカーが1つのファイルを共有できる。
+合計サイズが上限を超えたら、最後に参照された時刻の古いものから削除する。
+
+    ANALYSIS_STORE_PATH    保存先（既定 data/analysis_store.sqlite3、空文字で無効）
+    ANALYSIS_STORE_MAX_MB  合計サイズの上限（既定 256）
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from analysis_jobs import routine_hash
+
+DEFAULT_STORE_PATH = os.path.join("data", "analysis_store.sqlite3")
+DEFAULT_MAX_MB = 256.0
+# 上限を超えたら、この割合まで減らす（追加のたびに削除が走らないように）
+EVICT_TARGET_RATIO = 0.9
+# 他のワーカーが書き込み中のときに待つ時間
+BUSY_TIMEOUT_MS = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    result TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS analyses_accessed_at ON analyses (accessed_at);
+"""
+
+
+def analysis_key(
+    kind: str,
+    apparatus: str,
+    routine_data: List[Dict],
+    model: str,
+    prompt_version: str,
+    corpus_version: str,
+    **extra: Any
+) -> str:
+    """分析の種類・種目・技の並び・モデル・プロンプト・知識ベースから決まるキー"""
+    return routine_hash(
+        apparatus,
+        routine_data,
+        kind=kind,
+        model=model,
+        prompt_version=prompt_version,
+        corpus_version=corpus_version,
+        **extra
+    )
+
+
+class AnalysisStore:
+    """キー → 分析結果（JSON）の SQLite ストア"""
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH, max_bytes: int = int(DEFAULT_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+        # 接続はスレッドごと（asyncio.to_thread のスレッドからも使う）
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> "AnalysisStore":
+        return cls(
+            path=os.environ.get("ANALYSIS_STORE_PATH", DEFAULT_STORE_PATH),
+            max_bytes=int(float(os.environ.get("ANALYSIS_STORE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def open(self) -> "AnalysisStore":
+        """保存先のディレクトリとテーブルを用意する（起動時に1回）"""
+        if not self.enabled:
+            return self
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+        return self
+
+    def get(self, key: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        conn = self._connection()
+        row = conn.execute("SELECT result FROM analyses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        conn.execute("UPDATE analyses SET accessed_at = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def contains(self, key: str) -> bool:
+        if not self.enabled:
+            return False
+        return self._connection().execute("SELECT 1 FROM analyses WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, kind: str, result: Dict) -> None:
+        if not self.enabled:
+            return
+        body = json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO analyses (key, kind, result, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, kind, body, len(body.encode("utf-8")), now, now)
+        )
+        self.writes += 1
+        self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """合計サイズが上限を超えていれば、参照の古いものから目標サイズまで削除する"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICT_TARGET_RATIO)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = 0
+            for key, size in conn.execute("SELECT key, size FROM analyses ORDER BY accessed_at").fetchall():
+                if total <= target:
+                    break
+                conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self.evicted += removed
+
+    def stats(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "enabled": self.enabled,
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evicted": self.evicted,
+        }
+        if self.enabled:
+            rows = self._connection().execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM analyses GROUP BY kind"
+            ).fetchall()
+            data["entries"] = {kind: {"count": count, "bytes": size} for kind, count, size in rows}
+            data["total_bytes"] = sum(size for _, _, size in rows)
+        return data
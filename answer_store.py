@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+事前生成回答ストア - よくある質問の回答をバージョン付きで保持する
+
+precompute_answers.py がオフラインで生成した回答を読み込み、
+正規化した質問文が一致し、かつ知識ベースのバージョンが一致する場合のみ返す。
+"""
+
+import hashlib
+import json
+import os
+import unicodedata
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+STORE_FORMAT_VERSION = 1
+DEFAULT_STORE_PATH = os.path.join("data", "precomputed_answers.json")
+
+
+def normalize_question(question: str) -> str:
+    """表記ゆれ（全角半角・大小文字・空白・記号）を吸収した質問キー"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    return "".join(ch for ch in text if ch.isalnum())
+
+
+def corpus_version(knowledge_base: Dict[str, str]) -> str:
+    """知識ベースの内容から決まるバージョン文字列"""
+    digest = hashlib.sha256()
+    for name in sorted(knowledge_base):
+        digest.update(name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(knowledge_base[name].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+class AnswerStore:
+    """正規化質問 → 事前生成回答"""
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        self.hits = 0
+
+    def load(self) -> "AnswerStore":
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("format_version") == STORE_FORMAT_VERSION:
+                    self.entries = data.get("entries", {})
+            except (OSError, ValueError) as e:
+                print(f"❌ 事前生成回答の読み込みエラー: {e}")
+        return self
+
+    def save(self) -> None:
+        data = {
+            "format_version": STORE_FORMAT_VERSION,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "entries": self.entries,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def is_fresh(self, key: str, version: str) -> bool:
+        entry = self.entries.get(key)
+        return bool(entry) and entry.get("corpus_version") == version
+
+    def lookup(self, question: str, version: str) -> Optional[str]:
+        """現在の知識ベースで生成された回答があれば返す"""
+        entry = self.entries.get(normalize_question(question))
+        if entry and entry.get("corpus_version") == version:
+            self.hits += 1
+            return entry["answer"]
+        return None
+
+    def put(self, question: str, answer: str, version: str, model: str, frequency: int) -> None:
+        self.entries[normalize_question(question)] = {
+            "question": question,
+            "answer": answer,
+            "corpus_version": version,
+            "model": model,
+            "frequency": frequency,
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+        }
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+応答エンコードのベンチマーク - JSON / MessagePack と gzip の組み合わせを比較する
+
+世界クラスサーバーの実際の応答（演技分析・シミュレーション・規則チェック・代替技）と、
+技カタログ全体・ジョブ結果のまとめ取得を想定したペイロードについて、
+転送サイズ・サーバー側の直列化時間（圧縮込み）・クライアント側の解析時間（展開込み）を求める。
+直列化は配信側と同じ response_encoding.encode を使う。OpenAI API は使わない。
+
+使い方（リポジトリのルートで実行）:
+    python benchmarks/encoding_benchmark.py
+    python benchmarks/encoding_benchmark.py --no-save --repeat 50
+"""
+
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+# ワーカープロセスを起動せずに計測する
+os.environ.setdefault("TASK_POOL_PROCESSES", "0")
+
+from response_encoding import DEFAULT_GZIP_LEVEL, JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, encode, msgpack  # noqa: E402
+from retrieval_benchmark import git_revision, load_history  # noqa: E402
+
+HISTORY_FILE = os.path.join("benchmarks", "results", "encoding_history.json")
+BATCH_SIZE = 20
+
+FORMATS = ("json", "json+gzip", "msgpack", "msgpack+gzip")
+
+
+def sample_routine(apparatus: str = "HB") -> List[Dict]:
+    """技カタログから各グループの高難度の技を選んだ演技構成"""
+    from skill_catalog import load_skills_ja
+    by_group: Dict[int, List] = {}
+    for skill in load_skills_ja():
+        if skill.apparatus == apparatus and skill.group:
+            by_group.setdefault(skill.group, []).append(skill)
+    routine = []
+    for group in sorted(by_group):
+        best = sorted(by_group[group], key=lambda s: -s.value)[:3 if group < 4 else 1]
+        routine += [{"id": s.id, "name": s.name, "group": s.group, "value": s.value, "valueLetter": s.value_letter} for s in best]
+    return routine
+
+
+def collect_payloads() -> Dict[str, Any]:
+    """配信側のエンドポイントが返す JSON をそのまま取得する"""
+    from fastapi.testclient import TestClient
+    from skill_catalog import load_skills_ja
+    import server_world_class_ai as server
+
+    routine = sample_routine()
+    analysis_request = {
+        "routine_data": routine, "apparatus": "HB", "sectioned": True,
+        "total_score": 0, "difficulty_score": 0, "group_bonus": 0, "connection_bonus": 0,
+    }
+    with TestClient(server.app) as client:
+        def post(path: str, body: Dict) -> Any:
+            response = client.post(path, json=body, headers={"Accept": JSON_MEDIA_TYPE})
+            response.raise_for_status()
+            return response.json()
+
+        analysis = post("/analyze_routine", analysis_request)
+        payloads = {
+            "analyze_routine": analysis,
+            "simulate": post("/simulate", {"routine_data": routine, "apparatus": "HB", "seed": 1}),
+            "diagnostics": post("/routine/diagnostics", {"routine_data": routine, "apparatus": "HB"}),
+            "alternatives": client.get(f"/skills/{routine[0]['id']}/alternatives").json(),
+        }
+    payloads["skills_catalog"] = [asdict(skill) for skill in load_skills_ja()]
+    payloads["batch_results"] = [{"job_id": f"job-{i:03d}", "status": "done", "result": analysis} for i in range(BATCH_SIZE)]
+    return payloads
+
+
+def _median_ms(func: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def measure(content: Any, repeat: int) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    for name in FORMATS:
+        if name.startswith("msgpack") and msgpack is None:
+            continue
+        media_type = MSGPACK_MEDIA_TYPE if name.startswith("msgpack") else JSON_MEDIA_TYPE
+        compressed = name.endswith("+gzip")
+
+        def server_encode() -> bytes:
+            body = encode(content, media_type)
+            return gzip.compress(body, compresslevel=DEFAULT_GZIP_LEVEL) if compressed else body
+
+        wire = server_encode()
+        # クライアント側はアプリと同じく汎用のデコーダ（標準の json / msgpack）で解析する
+        loads: Callable[[bytes], Any] = (lambda b: msgpack.unpackb(b, raw=False)) if media_type == MSGPACK_MEDIA_TYPE else json.loads
+
+        def client_parse() -> Any:
+            return loads(gzip.decompress(wire) if compressed else wire)
+
+        assert client_parse() == json.loads(encode(content)), f"{name}: 往復で内容が変わりました"
+        results[name] = {
+            "bytes": len(wire),
+            "encode_ms": round(_median_ms(server_encode, repeat), 4),
+            "parse_ms": round(_median_ms(client_parse, repeat), 4),
+        }
+    baseline = results["json"]
+    for metrics in results.values():
+        metrics["size_ratio"] = round(metrics["bytes"] / baseline["bytes"], 3)
+        metrics["parse_ratio"] = round(metrics["parse_ms"] / baseline["parse_ms"], 3) if baseline["parse_ms"] else None
+    return results
+
+
+def print_table(run: Dict) -> None:
+    print(f"{'payload':16} {'format':13} {'bytes':>9} {'size':>6} {'encode ms':>10} {'parse ms':>9} {'parse':>6}")
+    for payload, formats in run["payloads"].items():
+        for name, m in formats.items():
+            parse_ratio = f"{m['parse_ratio']:.2f}" if m["parse_ratio"] is not None else "-"
+            print(f"{payload:16} {name:13} {m['bytes']:9d} {m['size_ratio']:6.2f} {m['encode_ms']:10.3f} {m['parse_ms']:9.3f} {parse_ratio:>6}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="応答エンコードのベンチマーク")
+    parser.add_argument("--history", default=HISTORY_FILE, help="結果を追記する履歴 JSON")
+    parser.add_argument("--repeat", type=int, default=20, help="時間計測の繰り返し回数（中央値を採用）")
+    parser.add_argument("--no-save", action="store_true", help="履歴に追記しない")
+    args = parser.parse_args()
+
+    if msgpack is None:
+        print("⚠️ msgpack がインストールされていないため JSON のみ計測します（pip install msgpack）")
+    payloads = collect_payloads()
+    run: Dict[str, Optional[Any]] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "gzip_level": DEFAULT_GZIP_LEVEL,
+        "payloads": {name: measure(content, args.repeat) for name, content in payloads.items()},
+    }
+    print_table(run)
+
+    if not args.no_save:
+        history = load_history(args.history)
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, "w", encoding="utf-8") as f:
+            json.dump(history + [run], f, ensure_ascii=False, indent=2)
+        print(f"✅ 履歴に追記: {args.history}（{len(history) + 1} 件）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+検索品質とレイテンシのベンチマーク - 正解付き質問セットで全検索方式を比較する
+
+retrieval_golden.jsonl の各質問には、正解となるルールブックの記述（同じ意味の表記を並べた
+文字列のリスト）と技名が付いている。検索方式ごとに recall@k・MRR・技の再現率・
+コンテキストのトークン数・1質問あたりのレイテンシを求め、結果を履歴 JSON に追記する。
+OpenAI API は使わない（オフラインで完結する）。
+
+使い方（リポジトリのルートで実行）:
+    python benchmarks/retrieval_benchmark.py
+    python benchmarks/retrieval_benchmark.py --check      # 前回より悪化していたら終了コード 1（履歴には追記しない）
+    python benchmarks/retrieval_benchmark.py --validate   # 正解の記述が知識ベースに存在するか確認
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import unicodedata
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from compact_corpus import estimate_tokens  # noqa: E402
+from skill_linker import TABLES_FILE  # noqa: E402
+
+GOLDEN_FILE = os.path.join("benchmarks", "retrieval_golden.jsonl")
+HISTORY_FILE = os.path.join("benchmarks", "results", "retrieval_history.json")
+K_VALUES = (1, 3, 5)
+
+# --check で悪化とみなす幅
+RECALL_TOLERANCE = 0.02
+MRR_TOLERANCE = 0.02
+LATENCY_TOLERANCE = 1.5  # 前回の p95 の倍率
+LATENCY_FLOOR_MS = 0.5   # これ未満の差はノイズとみなす
+
+# 検索方式: 質問 → 順位付きのチャンク（文字列）
+Backend = Callable[[str], List[str]]
+
+
+def normalize(text: str) -> str:
+    """表記ゆれ・Markdown・表の区切りを無視して照合する"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if ch.isalnum() or ch == ".")
+
+
+def load_golden(path: str = GOLDEN_FILE) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def build_backends() -> Dict[str, Backend]:
+    """配信側と同じ知識ベース・索引で検索方式を組み立てる"""
+    import server_advanced as server
+    import server_world_class_ai as world
+    from intent_matcher import match_message
+    asyncio.run(server.LIFECYCLE.run(include_warmup=False))
+    asyncio.run(world.LIFECYCLE.run(include_warmup=False))
+    linker = server.SKILL_LINKER
+    answerer = server.LOCAL_ANSWERER
+    # 配信側と同じく、英語の用語・技名に日本語の表記を付け足してから検索する
+    expand = server.TERM_DICTIONARY.expand
+
+    def keyword(question: str) -> List[str]:
+        context = server.search_knowledge(expand(question))
+        return [chunk for chunk in context.split("\n\n") if chunk.strip()]
+
+    def linked_facts(question: str) -> Tuple[List[str], bool]:
+        mentions = linker.link(expand(question))
+        facts = linker.format_facts(mentions)
+        return facts.splitlines()[1:], bool(mentions)
+
+    def keyword_linker(question: str) -> List[str]:
+        # /chat/message と同じ組み立て（技が特定できたら難度表の段落検索を省く）
+        facts, linked = linked_facts(question)
+        context = server.search_knowledge(expand(question), exclude_files={TABLES_FILE} if linked else None)
+        return facts + [chunk for chunk in context.split("\n\n") if chunk.strip()]
+
+    def scoped_apparatus(question: str) -> Optional[str]:
+        # server_world_class_ai の /chat/message と同じく、種目が1つに決まる場合だけ絞り込む
+        apparatus = match_message(question).apparatus
+        return apparatus[0] if len(apparatus) == 1 else None
+
+    def keyword_apparatus(question: str) -> List[str]:
+        query = world.TERM_DICTIONARY.expand(question)
+        context = world.search_knowledge(query, apparatus=scoped_apparatus(query))
+        return [chunk for chunk in context.split("\n\n") if chunk.strip()]
+
+    def keyword_linker_apparatus(question: str) -> List[str]:
+        query = world.TERM_DICTIONARY.expand(question)
+        apparatus = match_message(query).apparatus
+        mentions = world.SKILL_LINKER.link(query, apparatus)
+        facts = world.SKILL_LINKER.format_facts(mentions).splitlines()[1:]
+        context = world.search_knowledge(
+            query, exclude_files={TABLES_FILE} if mentions else None, apparatus=scoped_apparatus(query)
+        )
+        return facts + [chunk for chunk in context.split("\n\n") if chunk.strip()]
+
+    def bigram(question: str) -> List[str]:
+        ranked = answerer.search(expand(question))
+        passages = [answerer.passages[idx] for _, idx in ranked[:max(K_VALUES)]]
+        return [f"{p.heading}\n{p.text}" for p in passages]
+
+    def bigram_linker(question: str) -> List[str]:
+        facts, _ = linked_facts(question)
+        return facts + bigram(question)
+
+    return {
+        "keyword": keyword,
+        "keyword+linker": keyword_linker,
+        "keyword+apparatus": keyword_apparatus,
+        "keyword+linker+apparatus": keyword_linker_apparatus,
+        "bigram": bigram,
+        "bigram+linker": bigram_linker,
+    }
+
+
+def _first_hit(chunks: List[str], alternatives: List[str]) -> Optional[int]:
+    wanted = [normalize(a) for a in alternatives]
+    for rank, chunk in enumerate(chunks, 1):
+        text = normalize(chunk)
+        if any(w in text for w in wanted):
+            return rank
+    return None
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def evaluate(backend: Backend, golden: List[Dict], repeat: int) -> Dict:
+    recalls = {k: [] for k in K_VALUES}
+    reciprocal_ranks: List[float] = []
+    skill_recalls: List[float] = []
+    tokens: List[int] = []
+    latencies: List[float] = []
+    misses: List[str] = []
+    for item in golden:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            chunks = backend(item["question"])
+            timings.append((time.perf_counter() - started) * 1000)
+        latencies.append(statistics.median(timings))
+
+        ranks = [_first_hit(chunks, alternatives) for alternatives in item["gold_passages"]]
+        for k in K_VALUES:
+            recalls[k].append(sum(1 for r in ranks if r is not None and r <= k) / len(ranks))
+        first = min((r for r in ranks if r is not None), default=None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+        if first is None:
+            misses.append(item["id"])
+
+        context = "\n\n".join(chunks[:max(K_VALUES)])
+        tokens.append(estimate_tokens(context))
+        if item.get("gold_skills"):
+            normalized = normalize(context)
+            found = sum(1 for name in item["gold_skills"] if normalize(name) in normalized)
+            skill_recalls.append(found / len(item["gold_skills"]))
+
+    return {
+        **{f"recall@{k}": round(statistics.mean(values), 4) for k, values in recalls.items()},
+        "mrr": round(statistics.mean(reciprocal_ranks), 4),
+        "skill_recall": round(statistics.mean(skill_recalls), 4) if skill_recalls else None,
+        "context_tokens_mean": round(statistics.mean(tokens), 1),
+        "latency_ms_mean": round(statistics.mean(latencies), 3),
+        "latency_ms_p95": round(_percentile(latencies, 0.95), 3),
+        "misses": misses,
+    }
+
+
+def evaluate_by_language(backend: Backend, golden: List[Dict], repeat: int) -> Dict:
+    result = evaluate(backend, golden, repeat)
+    for lang in sorted({item["lang"] for item in golden}):
+        subset = [item for item in golden if item["lang"] == lang]
+        scores = evaluate(backend, subset, 1)
+        result[f"recall@3_{lang}"] = scores["recall@3"]
+        result[f"mrr_{lang}"] = scores["mrr"]
+    return result
+
+
+def validate_golden(golden: List[Dict]) -> int:
+    """正解の記述が知識ベースのどこにもない（ラベルが古い）質問を列挙する"""
+    from local_answerer import DEFAULT_CORPUS_FILES
+    corpus = ""
+    for file_name in DEFAULT_CORPUS_FILES + ["ai_implementation_guide.md", "apparatus_details.md"]:
+        path = os.path.join("data", file_name)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                corpus += normalize(f.read())
+    problems = 0
+    for item in golden:
+        for alternatives in item["gold_passages"]:
+            if not any(normalize(a) in corpus for a in alternatives):
+                print(f"❌ {item['id']}: 正解の記述が見つかりません {alternatives}")
+                problems += 1
+    print(f"正解ラベル検証: {len(golden)} 問 / 問題 {problems} 件")
+    return problems
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path: str = HISTORY_FILE) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_regressions(previous: Dict, current: Dict) -> List[str]:
+    regressions = []
+    for name, metrics in current["backends"].items():
+        before = previous.get("backends", {}).get(name)
+        if not before:
+            continue
+        for key, tolerance in (("recall@3", RECALL_TOLERANCE), ("mrr", MRR_TOLERANCE)):
+            if metrics[key] < before[key] - tolerance:
+                regressions.append(f"{name}: {key} {before[key]} → {metrics[key]}")
+        limit = max(before["latency_ms_p95"] * LATENCY_TOLERANCE, before["latency_ms_p95"] + LATENCY_FLOOR_MS)
+        if metrics["latency_ms_p95"] > limit:
+            regressions.append(f"{name}: latency_ms_p95 {before['latency_ms_p95']} → {metrics['latency_ms_p95']}")
+    return regressions
+
+
+def print_table(run: Dict) -> None:
+    print(f"{'backend':24} {'R@1':>6} {'R@3':>6} {'R@5':>6} {'MRR':>6} {'skill':>6} {'tokens':>7} {'mean ms':>8} {'p95 ms':>8}")
+    for name, m in run["backends"].items():
+        skill = f"{m['skill_recall']:.2f}" if m["skill_recall"] is not None else "-"
+        print(f"{name:24} {m['recall@1']:6.2f} {m['recall@3']:6.2f} {m['recall@5']:6.2f} {m['mrr']:6.2f} "
+              f"{skill:>6} {m['context_tokens_mean']:7.0f} {m['latency_ms_mean']:8.3f} {m['latency_ms_p95']:8.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="検索品質とレイテンシのベンチマーク")
+    parser.add_argument("--golden", default=GOLDEN_FILE, help="正解付き質問セット（JSONL）")
+    parser.add_argument("--history", default=HISTORY_FILE, help="結果を追記する履歴 JSON")
+    parser.add_argument("--backend", action="append", help="対象の検索方式（複数指定可、既定: すべて）")
+    parser.add_argument("--repeat", type=int, default=5, help="レイテンシ計測の繰り返し回数（中央値を採用）")
+    parser.add_argument("--no-save", action="store_true", help="履歴に追記しない")
+    parser.add_argument("--check", action="store_true", help="前回の結果より悪化していたら終了コード 1")
+    parser.add_argument("--validate", action="store_true", help="正解ラベルが知識ベースに存在するか確認して終了する")
+    args = parser.parse_args()
+
+    golden = load_golden(args.golden)
+    if args.validate:
+        sys.exit(1 if validate_golden(golden) else 0)
+
+    backends = build_backends()
+    selected = args.backend or list(backends)
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "questions": len(golden),
+        "backends": {name: evaluate_by_language(backends[name], golden, args.repeat) for name in selected},
+    }
+    print_table(run)
+    for name, metrics in run["backends"].items():
+        if metrics["misses"]:
+            print(f"  {name} 未検出: {', '.join(metrics['misses'])}")
+
+    history = load_history(args.history)
+    regressions = find_regressions(history[-1], run) if history else []
+    if args.check and regressions:
+        print("悪化があるため履歴には追記しません")
+    elif not args.no_save:
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, "w", encoding="utf-8") as f:
+            json.dump(history + [run], f, ensure_ascii=False, indent=2)
+        print(f"✅ 履歴に追記: {args.history}（{len(history) + 1} 件）")
+    for regression in regressions:
+        print(f"⚠️ 悪化: {regression}")
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
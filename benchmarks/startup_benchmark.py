@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+起動時間とメモリ使用量のベンチマーク - サーバーごとの予算を超えたら失敗する
+
+サーバーのエントリーポイントごとに新しいプロセスを起動し、次の値を測る。
+    import_ms          モジュールの import にかかった時間
+    first_response_ms  プロセス内の計測開始から最初の /health 応答まで（起動ステップを含む）
+    steady_ms          ウォームアップまで終わって定常状態になるまで
+    rss_mb             定常状態の RSS（/proc/<pid>/statm、タスクプールのワーカーなど子孫プロセスを含む合計）
+    traced_mb          tracemalloc で追跡した Python オブジェクトの確保量（別プロセスで計測）
+起動ステップ（Lifecycle）ごとの所要時間と、確保したファイル（サブシステム）ごとのメモリ内訳も記録する。
+tracemalloc は処理を遅くするため、時間の計測とメモリ内訳の計測は別々のプロセスで行う。
+
+予算は benchmarks/startup_budgets.json に書く（サーバーごと・指標ごとの上限）。
+OpenAI API には接続しない（OPENAI_API_KEY を外して起動する）。
+タスクプールのワーカー数は配備先で TASK_POOL_PROCESSES を上げることがあるため、rss_mb を比べられるよう
+TASK_POOL_PROCESSES を BENCHMARK_TASK_POOL_PROCESSES に固定する（環境変数で指定した場合はそれを使う）。
+
+使い方（リポジトリのルートで実行）:
+    python benchmarks/startup_benchmark.py                     # 全サーバー、予算超過で終了コード 1
+    python benchmarks/startup_benchmark.py --server server_advanced
+    python benchmarks/startup_benchmark.py --no-save --top 15  # 内訳を15件まで表示
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import sysconfig
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+HISTORY_FILE = os.path.join("benchmarks", "results", "startup_history.json")
+BUDGETS_FILE = os.path.join("benchmarks", "startup_budgets.json")
+SERVERS = ["server", "server_advanced", "server_fallback", "server_openai", "server_world_class_ai"]
+METRICS = ("import_ms", "first_response_ms", "steady_ms", "rss_mb", "traced_mb")
+STEADY_TIMEOUT = 60.0
+CHILD_TIMEOUT = 180
+BENCHMARK_TASK_POOL_PROCESSES = "2"
+
+
+def _rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/statm", "r") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def _descendants(pid: int) -> List[int]:
+    """/proc の親プロセスIDをたどって、pid の子孫プロセスを列挙する"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # コマンド名に空白や括弧が入ることがあるため、最後の ")" の後ろを読む
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def _process_tree_rss() -> Dict[str, float]:
+    """このプロセスと子孫プロセス（タスクプールのワーカー）の RSS"""
+    own = _rss_mb(os.getpid())
+    total = own
+    descendants = _descendants(os.getpid())
+    for pid in descendants:
+        try:
+            total += _rss_mb(pid)
+        except OSError:
+            pass  # 計測中に終了したプロセス
+    return {"rss_mb": round(total, 1), "rss_self_mb": round(own, 1), "processes": 1 + len(descendants)}
+
+
+def _subsystem(filename: str) -> str:
+    """確保した場所のファイルをサブシステム名にまとめる（リポジトリのモジュール・外部パッケージ・標準ライブラリ）"""
+    if filename.startswith(ROOT) and "site-packages" not in filename:
+        return os.path.relpath(filename, ROOT)
+    if "site-packages" in filename:
+        package = filename.split("site-packages" + os.sep, 1)[1].split(os.sep, 1)[0]
+        return f"site-packages/{package.split('.')[0]}"
+    if filename.startswith(sysconfig.get_paths()["stdlib"]):
+        return "stdlib"
+    return filename
+
+
+def run_child(server: str, trace: bool) -> Dict:
+    """このプロセスでサーバーを起動して計測する（--child から呼ばれる）"""
+    if trace:
+        import tracemalloc
+        tracemalloc.start()
+    started = time.perf_counter()
+    module = __import__(server)
+    import_ms = (time.perf_counter() - started) * 1000
+
+    from fastapi.testclient import TestClient
+    with TestClient(module.app) as client:
+        response = client.get("/health")
+        first_response_ms = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"/health が {response.status_code} を返しました")
+        # ウォームアップ（レディ後の任意ステップ）が終わるまで待つ
+        deadline = time.monotonic() + STEADY_TIMEOUT
+        while time.monotonic() < deadline:
+            steps = client.get("/ready").json()["steps"]
+            if all(step["status"] in ("done", "failed") for step in steps.values()):
+                break
+            time.sleep(0.05)
+        steady_ms = (time.perf_counter() - started) * 1000
+        result = {
+            "import_ms": round(import_ms, 1),
+            "first_response_ms": round(first_response_ms, 1),
+            "steady_ms": round(steady_ms, 1),
+            **_process_tree_rss(),
+            "steps": {name: {"status": s["status"], "elapsed_ms": s.get("elapsed_ms")} for name, s in steps.items()},
+        }
+        if trace:
+            snapshot = tracemalloc.take_snapshot()
+            by_subsystem: Dict[str, int] = {}
+            for stat in snapshot.statistics("filename"):
+                name = _subsystem(stat.traceback[0].filename)
+                by_subsystem[name] = by_subsystem.get(name, 0) + stat.size
+            result["traced_mb"] = round(sum(by_subsystem.values()) / 1024 / 1024, 2)
+            result["memory_by_subsystem_kb"] = {
+                name: round(size / 1024) for name, size in sorted(by_subsystem.items(), key=lambda item: -item[1])
+            }
+    return result
+
+
+def measure(server: str) -> Dict:
+    """時間計測用とメモリ内訳用の2つのプロセスを起動して結果をまとめる"""
+    env = {k: v for k, v in os.environ.items() if k not in ("OPENAI_API_KEY", "PROFILE_DIR", "REQUEST_CAPTURE_PATH")}
+    env.setdefault("TASK_POOL_PROCESSES", BENCHMARK_TASK_POOL_PROCESSES)
+    results = []
+    for trace in (False, True):
+        command = [sys.executable, os.path.abspath(__file__), "--child", server] + (["--trace"] if trace else [])
+        started = time.perf_counter()
+        completed = subprocess.run(command, capture_output=True, text=True, env=env, timeout=CHILD_TIMEOUT)
+        if completed.returncode != 0:
+            raise RuntimeError(f"{server} の計測に失敗しました:\n{completed.stderr[-2000:]}")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result["process_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        results.append(result)
+    timing, memory = results
+    return {
+        **timing,
+        "traced_mb": memory["traced_mb"],
+        "memory_by_subsystem_kb": memory["memory_by_subsystem_kb"],
+    }
+
+
+def load_budgets(path: str = BUDGETS_FILE) -> Dict[str, Dict[str, float]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_violations(run: Dict, budgets: Dict[str, Dict[str, float]]) -> List[str]:
+    violations = []
+    for server, metrics in run["servers"].items():
+        budget = {**budgets.get("default", {}), **budgets.get(server, {})}
+        for key in METRICS:
+            if key in budget and metrics[key] > budget[key]:
+                violations.append(f"{server}: {key} {metrics[key]} > 予算 {budget[key]}")
+    return violations
+
+
+def print_table(run: Dict, top: int) -> None:
+    print(f"{'server':24} {'import ms':>10} {'first ms':>9} {'steady ms':>10} {'process ms':>11} {'RSS MB':>7} {'(本体)':>7} {'procs':>6} {'traced MB':>10}")
+    for server, m in run["servers"].items():
+        print(f"{server:24} {m['import_ms']:10.1f} {m['first_response_ms']:9.1f} {m['steady_ms']:10.1f} "
+              f"{m['process_ms']:11.1f} {m['rss_mb']:7.1f} {m['rss_self_mb']:7.1f} {m['processes']:6d} {m['traced_mb']:10.2f}")
+    for server, m in run["servers"].items():
+        steps = ", ".join(f"{name} {s['elapsed_ms']}ms" for name, s in m["steps"].items())
+        print(f"\n{server} 起動ステップ: {steps}")
+        for name, size in list(m["memory_by_subsystem_kb"].items())[:top]:
+            print(f"  {size:8d} KB  {name}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="起動時間とメモリ使用量のベンチマーク")
+    parser.add_argument("--server", action="append", choices=SERVERS, help="対象のサーバー（複数指定可、既定: すべて）")
+    parser.add_argument("--budgets", default=BUDGETS_FILE, help="予算の JSON")
+    parser.add_argument("--history", default=HISTORY_FILE, help="結果を追記する履歴 JSON")
+    parser.add_argument("--top", type=int, default=8, help="メモリ内訳の表示件数")
+    parser.add_argument("--no-save", action="store_true", help="履歴に追記しない")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--trace", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # 計測結果は最後の行に JSON で出す（サーバーの起動ログと混ざらないように）
+        print(json.dumps(run_child(args.child, args.trace), ensure_ascii=False))
+        return
+
+    from retrieval_benchmark import git_revision, load_history
+
+    run: Dict[str, Optional[object]] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "servers": {server: measure(server) for server in args.server or SERVERS},
+    }
+    print_table(run, args.top)
+
+    violations = find_violations(run, load_budgets(args.budgets))
+    if not args.no_save:
+        history = load_history(args.history)
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, "w", encoding="utf-8") as f:
+            json.dump(history + [run], f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 履歴に追記: {args.history}（{len(history) + 1} 件）")
+    for violation in violations:
+        print(f"❌ 予算超過: {violation}")
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+知識ベースのコンパクト化 - LLM に渡す入力トークンを削減するオフライン処理
+
+PDF 抽出テキストのページ見出し・文字化けグリフ・空行の連続を除去し、
+全角英数・半角カナを正規化したうえで、ファイル間でほぼ同一の段落を1つにまとめる
+（同じ読み込み側が一緒に読むファイルの間だけ。本文を落とした見出しも一緒に落とす）。
+結果は data/compact/ に同名で書き出し、サーバーは resolve_corpus_file() で
+元ファイルより新しいコンパクト版があればそちらを読み込む。
+
+使い方:
+    python compact_corpus.py            # data/compact/ を生成し、ファイルごとの削減量を表示
+    python compact_corpus.py --dry-run  # 書き出さずに削減量だけ表示
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+DATA_DIR = "data"
+COMPACT_DIR = os.path.join(DATA_DIR, "compact")
+MANIFEST_FILE = "manifest.json"
+
+# 重複判定で先に残す順（上にあるファイルの段落が優先される）
+CORPUS_FILES = [
+    "d_score_master_knowledge.md",
+    "difficulty_calculation_system.md",
+    "comprehensive_rulebook_analysis.md",
+    "rulebook_ja_summary.md",
+    "apparatus_details.md",
+    "ai_implementation_guide.md",
+    "skills_difficulty_tables.md",
+    "rulebook_ja_full.txt",
+]
+
+# 一緒に読み込まれるファイルの組（読み込み側ごと）。段落を重複として落とすのは、
+# そのファイルを読む全ての組に、先に残した側のファイルも含まれる場合だけ
+# （別々に読み込まれるファイル間でまとめると、片方を読む側から内容が消えるため）
+LOAD_SETS: Dict[str, Tuple[str, ...]] = {
+    "server_advanced": (
+        "d_score_master_knowledge.md", "comprehensive_rulebook_analysis.md", "ai_implementation_guide.md",
+        "rulebook_ja_summary.md", "skills_difficulty_tables.md", "apparatus_details.md",
+        "difficulty_calculation_system.md",
+    ),
+    "server_world_class_ai": (
+        "rulebook_ja_full.txt", "rulebook_ja_summary.md", "skills_difficulty_tables.md",
+        "ai_implementation_guide.md", "comprehensive_rulebook_analysis.md", "apparatus_details.md",
+    ),
+    "local_answerer": (
+        "d_score_master_knowledge.md", "difficulty_calculation_system.md", "comprehensive_rulebook_analysis.md",
+        "rulebook_ja_summary.md", "apparatus_details.md", "skills_difficulty_tables.md", "rulebook_ja_full.txt",
+    ),
+    "fact_lookup": ("skills_difficulty_tables.md", "difficulty_calculation_system.md"),
+}
+
+# 重複判定の対象とする段落の最小文字数（見出しなど短い段落は残す）
+MIN_DEDUP_CHARS = 40
+# シングル（文字5-gram）の Jaccard 係数がこれ以上なら重複とみなす
+NEAR_DUPLICATE_THRESHOLD = 0.85
+SHINGLE_SIZE = 5
+SKETCH_SIZE = 8
+# PDF抽出テキストで、この回数以上現れる行はページごとの定型文とみなし初出のみ残す
+BOILERPLATE_MIN_REPEATS = 5
+BOILERPLATE_MIN_CHARS = 20
+
+MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s")
+PAGE_BANNER = re.compile(r"^=+\s*ページ\s*\d+\s*=+$")
+PAGE_NUMBER = re.compile(r"^\d{1,3}$")
+CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b-\x1f\x7f-\x9f]")
+SPACE_RUN = re.compile(r"[ \t　]+")
+
+# 正常な文字として扱う範囲（それ以外は抽出時の文字化けグリフ）
+_ALLOWED_RANGES = [
+    (0x0020, 0x007E),  # ASCII
+    (0x00A0, 0x017F),  # Latin-1 / Latin Extended-A（技名のアクセント記号）
+    (0x2000, 0x22FF),  # 一般句読点・数字の形（Ⅰ〜Ⅳ）・矢印・数学記号
+    (0x2460, 0x27BF),  # 丸数字・罫線・図形（●）・記号
+    (0x3000, 0x30FF),  # 和文句読点・ひらがな・カタカナ
+    (0x3400, 0x9FFF),  # 漢字
+    (0xF900, 0xFAFF),  # 互換漢字
+    (0xFF00, 0xFFEF),  # 全角・半角形
+]
+
+
+def _is_allowed(ch: str) -> bool:
+    code = ord(ch)
+    return any(lo <= code <= hi for lo, hi in _ALLOWED_RANGES)
+
+
+def normalize_width(text: str) -> str:
+    """全角英数記号を半角に、半角カナを全角にそろえる（ローマ数字や丸数字はそのまま）"""
+    return "".join(
+        unicodedata.normalize("NFKC", ch) if 0xFF01 <= ord(ch) <= 0xFFEF else ch
+        for ch in text
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """入力トークン数の概算（tiktoken があれば使う）"""
+    try:
+        import tiktoken
+    except ImportError:
+        # 日本語は概ね1文字1トークン、英数字は4文字1トークン
+        wide = sum(1 for ch in text if ord(ch) > 0x2FFF)
+        return wide + (len(text) - wide + 3) // 4
+    return len(tiktoken.get_encoding("cl100k_base").encode(text))
+
+
+def clean_line(line: str) -> Optional[str]:
+    """1行分の抽出ノイズを除去する。行ごと捨てる場合は None"""
+    line = CONTROL_CHARS.sub("", line)
+    stripped = line.strip()
+    if PAGE_BANNER.match(stripped) or PAGE_NUMBER.match(stripped):
+        return None
+    if stripped:
+        garbage = sum(1 for ch in stripped if not _is_allowed(ch))
+        if garbage / len(stripped) > 0.3:
+            return None
+        line = "".join(ch for ch in line if _is_allowed(ch))
+    line = normalize_width(line)
+    if not line.strip():
+        return ""
+    # Markdown の行頭インデントは保持し、それ以外の空白の連続を1つにする
+    indent = line[:len(line) - len(line.lstrip(" "))]
+    return indent + SPACE_RUN.sub(" ", line.strip())
+
+
+def strip_noise(text: str, extracted: bool) -> str:
+    """ノイズ除去・幅の正規化・空行の圧縮（extracted は PDF 抽出テキストか）"""
+    lines = [clean_line(line) for line in text.splitlines()]
+    lines = [line for line in lines if line is not None]
+
+    if extracted:
+        # PDF 抽出テキストの行頭空白は意味を持たない
+        lines = [line.lstrip() for line in lines]
+        counts: Dict[str, int] = {}
+        for line in lines:
+            counts[line] = counts.get(line, 0) + 1
+        seen: Set[str] = set()
+        kept = []
+        for line in lines:
+            if len(line) >= BOILERPLATE_MIN_CHARS and counts[line] >= BOILERPLATE_MIN_REPEATS:
+                if line in seen:
+                    continue
+                seen.add(line)
+            kept.append(line)
+        lines = kept
+
+    result: List[str] = []
+    for line in lines:
+        if not line and (not result or not result[-1]):
+            continue
+        result.append(line)
+    while result and not result[-1]:
+        result.pop()
+    return "\n".join(result) + "\n"
+
+
+def split_paragraphs(text: str) -> List[str]:
+    return [p for p in text.split("\n\n") if p.strip()]
+
+
+def _fingerprint(paragraph: str) -> str:
+    return re.sub(r"[\W_]+", "", paragraph).lower()
+
+
+def _shingles(fingerprint: str) -> Set[int]:
+    return {
+        int.from_bytes(hashlib.blake2b(fingerprint[i:i + SHINGLE_SIZE].encode("utf-8"), digest_size=8).digest(), "big")
+        for i in range(max(1, len(fingerprint) - SHINGLE_SIZE + 1))
+    }
+
+
+class NearDuplicateIndex:
+    """bottom-k スケッチで候補を絞り、シングルの Jaccard 係数で重複を判定する"""
+
+    def __init__(self):
+        self._entries: List[Set[int]] = []
+        self._sources: List[str] = []
+        self._exact: Dict[str, str] = {}
+        self._by_sketch: Dict[int, List[int]] = {}
+
+    def seen(self, paragraph: str, source: str = "", allowed: Optional[Set[str]] = None) -> bool:
+        """既出（ほぼ同一）なら True、そうでなければ登録して False
+
+        allowed を指定すると、そのファイルに残した段落だけを既出として扱う。
+        """
+        fingerprint = _fingerprint(paragraph)
+        if len(fingerprint) < MIN_DEDUP_CHARS:
+            return False
+        if fingerprint in self._exact and (allowed is None or self._exact[fingerprint] in allowed):
+            return True
+        shingles = _shingles(fingerprint)
+        sketch = sorted(shingles)[:SKETCH_SIZE]
+        candidates = {i for h in sketch for i in self._by_sketch.get(h, ())}
+        for i in candidates:
+            if allowed is not None and self._sources[i] not in allowed:
+                continue
+            other = self._entries[i]
+            if len(shingles & other) / len(shingles | other) >= NEAR_DUPLICATE_THRESHOLD:
+                return True
+        self._exact.setdefault(fingerprint, source)
+        index = len(self._entries)
+        self._entries.append(shingles)
+        self._sources.append(source)
+        for h in sketch:
+            self._by_sketch.setdefault(h, []).append(index)
+        return False
+
+
+def dedup_sources(file_name: str, load_sets: Dict[str, Tuple[str, ...]] = LOAD_SETS) -> Set[str]:
+    """file_name の段落を重複として落としてよい相手（file_name 自身と、file_name を読む全ての組に含まれるファイル）"""
+    sets = [set(files) for files in load_sets.values() if file_name in files]
+    return set.intersection(*sets) if sets else {file_name}
+
+
+def _heading_level(paragraph: str) -> int:
+    """1行だけの Markdown 見出しならそのレベル、それ以外は 0"""
+    match = MARKDOWN_HEADING.match(paragraph)
+    return len(match.group(1)) if match and "\n" not in paragraph.strip() else 0
+
+
+def drop_orphan_headings(paragraphs: List[str], kept: List[bool]) -> List[bool]:
+    """本文をすべて重複として落とした見出しも落とす（見出しだけが残らないように）"""
+    kept = list(kept)
+    for i in range(len(paragraphs) - 1, -1, -1):
+        level = _heading_level(paragraphs[i])
+        if not kept[i] or not level:
+            continue
+        body = []
+        for j in range(i + 1, len(paragraphs)):
+            other = _heading_level(paragraphs[j])
+            if other and other <= level:
+                break
+            body.append(j)
+        if body and not any(kept[j] for j in body):
+            kept[i] = False
+    return kept
+
+
+def compact_corpus(data_dir: str = DATA_DIR) -> Tuple[Dict[str, str], List[Dict]]:
+    """全ファイルをコンパクト化し、(ファイル名→本文, ファイルごとの統計) を返す"""
+    index = NearDuplicateIndex()
+    compacted: Dict[str, str] = {}
+    report: List[Dict] = []
+    for file_name in CORPUS_FILES:
+        path = os.path.join(data_dir, file_name)
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            original = f.read()
+        cleaned = strip_noise(original, extracted=file_name.endswith(".txt"))
+        paragraphs = split_paragraphs(cleaned)
+        allowed = dedup_sources(file_name)
+        flags = drop_orphan_headings(paragraphs, [not index.seen(p, file_name, allowed) for p in paragraphs])
+        kept = [p for p, keep in zip(paragraphs, flags) if keep]
+        text = "\n\n".join(kept) + "\n"
+        compacted[file_name] = text
+        before, after = estimate_tokens(original), estimate_tokens(text)
+        report.append({
+            "file": file_name,
+            "source_sha256": hashlib.sha256(original.encode("utf-8")).hexdigest(),
+            "chars_before": len(original),
+            "chars_after": len(text),
+            "tokens_before": before,
+            "tokens_after": after,
+            "duplicate_paragraphs": len(paragraphs) - len(kept),
+        })
+    return compacted, report
+
+
+def write_compacted(compacted: Dict[str, str], report: List[Dict], output_dir: str = COMPACT_DIR) -> None:
+    os.makedirs(output_dir, exist_ok=True)
+    for file_name, text in compacted.items():
+        with open(os.path.join(output_dir, file_name), "w", encoding="utf-8") as f:
+            f.write(text)
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({"files": report}, f, ensure_ascii=False, indent=2)
+
+
+def _load_manifest(compact_dir: str) -> Dict[str, str]:
+    try:
+        with open(os.path.join(compact_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return {entry["file"]: entry["source_sha256"] for entry in json.load(f)["files"]}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def resolve_corpus_file(path: str) -> str:
+    """元ファイルから生成されたコンパクト版があればそのパスを、なければ元のパスを返す
+
+    マニフェストに記録した元ファイルのハッシュが現在の内容と一致する場合のみ使う。
+    """
+    compact_dir = os.path.join(os.path.dirname(path), "compact")
+    compact_path = os.path.join(compact_dir, os.path.basename(path))
+    expected = _load_manifest(compact_dir).get(os.path.basename(path))
+    if not expected or not os.path.exists(compact_path) or not os.path.exists(path):
+        return path
+    with open(path, "r", encoding="utf-8") as f:
+        if hashlib.sha256(f.read().encode("utf-8")).hexdigest() != expected:
+            return path
+    return compact_path
+
+
+def print_report(report: List[Dict]) -> None:
+    total_before = sum(r["tokens_before"] for r in report)
+    total_after = sum(r["tokens_after"] for r in report)
+    print(f"{'ファイル':<40}{'トークン(前)':>12}{'トークン(後)':>12}{'削減率':>8}{'重複段落':>8}")
+    for r in report:
+        reduction = 1 - r["tokens_after"] / r["tokens_before"] if r["tokens_before"] else 0.0
+        print(f"{r['file']:<40}{r['tokens_before']:>12}{r['tokens_after']:>12}{reduction:>8.1%}{r['duplicate_paragraphs']:>8}")
+    if total_before:
+        print(f"{'合計':<40}{total_before:>12}{total_after:>12}{1 - total_after / total_before:>8.1%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="知識ベースのノイズ除去と重複段落の統合")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="元ファイルのディレクトリ")
+    parser.add_argument("--output-dir", default=None, help="出力先（既定: <data-dir>/compact）")
+    parser.add_argument("--dry-run", action="store_true", help="書き出さずに削減量だけ表示する")
+    args = parser.parse_args()
+
+    compacted, report = compact_corpus(args.data_dir)
+    print_report(report)
+    if not args.dry_run:
+        write_compacted(compacted, report, args.output_dir or os.path.join(args.data_dir, "compact"))
+
+
+if __name__ == "__main__":
+    main()
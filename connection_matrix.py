@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+連続技ボーナス行列と演技順序の最適化
+
+連続技ボーナスは2技のグループと難度だけで決まるため、
+(グループ, 難度) クラス同士のボーナス表を NumPy 配列として一度だけ作り、
+技カタログ全体の技×技行列もそこから切り出して保持する。
+演技の隣接ペアはこの行列の参照1回でまとめて採点でき、
+順序最適化は固定位置（終末技など）を守る部分集合DPで行い、上限（0.4点）で頭打ちにした合計で比べる。
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from dscore import MAX_CONNECTION_BONUS, RoutineSkill, pair_connection_bonus
+from skill_catalog import APPARATUS_NAMES, LETTER_VALUES, Skill, load_skills_ja
+
+GROUP_SLOTS = 6   # グループ 0（不明）〜 5
+LETTER_SLOTS = len(LETTER_VALUES)
+
+# 部分集合DPで厳密に解く最大技数（これを超える場合は局所探索）
+EXACT_LIMIT = 12
+
+
+def skill_class(group: int, value: float) -> int:
+    """(グループ, 難度) をクラス番号に変換する"""
+    letter_index = min(max(int(round(value * 10)) - 1, 0), LETTER_SLOTS - 1)
+    group = group if 0 <= group < GROUP_SLOTS else 0
+    return group * LETTER_SLOTS + letter_index
+
+
+def build_class_matrix(apparatus: str) -> np.ndarray:
+    """クラス×クラスの連続技ボーナス表"""
+    size = GROUP_SLOTS * LETTER_SLOTS
+    matrix = np.zeros((size, size), dtype=np.float32)
+    if apparatus not in ("FX", "HB"):
+        return matrix
+    values = [round((i + 1) / 10, 1) for i in range(LETTER_SLOTS)]
+    for g1 in range(GROUP_SLOTS):
+        for l1, v1 in enumerate(values):
+            for g2 in range(GROUP_SLOTS):
+                for l2, v2 in enumerate(values):
+                    matrix[g1 * LETTER_SLOTS + l1, g2 * LETTER_SLOTS + l2] = pair_connection_bonus(apparatus, g1, v1, g2, v2)
+    return matrix
+
+
+class ConnectionMatrix:
+    """1種目分の連続技ボーナス行列（クラス表 + 技カタログ行列）"""
+
+    def __init__(self, apparatus: str, catalog: Sequence[Skill]):
+        self.apparatus = apparatus
+        self.class_matrix = build_class_matrix(apparatus)
+        self.skills = [s for s in catalog if s.apparatus == apparatus]
+        self.skill_index: Dict[str, int] = {s.id: i for i, s in enumerate(self.skills)}
+        classes = np.array([skill_class(s.group, s.value) for s in self.skills], dtype=np.intp)
+        self.skill_matrix = self.class_matrix[np.ix_(classes, classes)]
+
+    def routine_matrix(self, skills: Sequence[RoutineSkill]) -> np.ndarray:
+        """演技構成の技同士のボーナス行列"""
+        classes = np.array([skill_class(s.group, s.value) for s in skills], dtype=np.intp)
+        return self.class_matrix[np.ix_(classes, classes)]
+
+    def score_adjacent(self, skills: Sequence[RoutineSkill]) -> np.ndarray:
+        """隣接する全ペアのボーナスを1回のベクトル演算で求める"""
+        if len(skills) < 2:
+            return np.zeros(0, dtype=np.float32)
+        classes = np.array([skill_class(s.group, s.value) for s in skills], dtype=np.intp)
+        return self.class_matrix[classes[:-1], classes[1:]]
+
+
+def order_score(matrix: np.ndarray, order: Sequence[int]) -> float:
+    if len(order) < 2:
+        return 0.0
+    order = np.asarray(order)
+    return float(matrix[order[:-1], order[1:]].sum())
+
+
+def _exact_order(matrix: np.ndarray, allowed: np.ndarray) -> Optional[List[int]]:
+    """固定位置付きの最大ボーナス順序（部分集合DP、技数 n で O(2^n · n^2)）"""
+    n = matrix.shape[0]
+    size = 1 << n
+    full = size - 1
+    bits = ((np.arange(size)[:, None] >> np.arange(n)) & 1).astype(bool)
+    popcount = bits.sum(axis=1)
+    dp = np.full((size, n), -np.inf)
+    parent = np.full((size, n), -1, dtype=np.int16)
+    columns = np.arange(n)
+
+    for j in np.flatnonzero(allowed[0]):
+        dp[1 << j, j] = 0.0
+    for mask in range(1, full):
+        row = dp[mask]
+        if not np.isfinite(row).any():
+            continue
+        targets = np.flatnonzero(allowed[popcount[mask]] & ~bits[mask])
+        if targets.size == 0:
+            continue
+        candidates = row[:, None] + matrix[:, targets]
+        best_prev = candidates.argmax(axis=0)
+        best = candidates[best_prev, np.arange(targets.size)]
+        new_masks = mask | (1 << targets)
+        improved = best > dp[new_masks, targets]
+        dp[new_masks[improved], targets[improved]] = best[improved]
+        parent[new_masks[improved], targets[improved]] = columns[best_prev[improved]]
+
+    last = int(dp[full].argmax())
+    if not np.isfinite(dp[full, last]):
+        return None
+    order = [last]
+    mask = full
+    while len(order) < n:
+        prev = int(parent[mask, order[-1]])
+        mask ^= 1 << order[-1]
+        order.append(prev)
+    return order[::-1]
+
+
+def _local_search_order(matrix: np.ndarray, start: List[int], movable: List[int]) -> List[int]:
+    """技数が多い場合の入れ替え局所探索（固定位置は動かさない）"""
+    order = list(start)
+    best = order_score(matrix, order)
+    improved = True
+    while improved:
+        improved = False
+        for a_idx, a in enumerate(movable):
+            for b in movable[a_idx + 1:]:
+                order[a], order[b] = order[b], order[a]
+                score = order_score(matrix, order)
+                if score > best + 1e-9:
+                    best = score
+                    improved = True
+                else:
+                    order[a], order[b] = order[b], order[a]
+    return order
+
+
+def _moved(order: Sequence[int]) -> int:
+    """元の位置から動いた技の数"""
+    return sum(1 for position, skill in enumerate(order) if position != skill)
+
+
+def _fewest_moves_order(matrix: np.ndarray, order: List[int], movable: List[int], target: float) -> List[int]:
+    """target 以上のボーナスを保ったまま、元の順序からの移動が少ない並び順
+
+    1回の入れ替えで届くならその中から選び、届かなければ最適順序から
+    元の位置へ戻せる技を1つずつ戻していく（target を保てる限り）。
+    """
+    original = list(range(len(order)))
+    for a_idx, a in enumerate(movable):
+        for b in movable[a_idx + 1:]:
+            original[a], original[b] = original[b], original[a]
+            if order_score(matrix, original) >= target - 1e-9:
+                return original
+            original[a], original[b] = original[b], original[a]
+    order = list(order)
+    reverted = True
+    while reverted:
+        reverted = False
+        for position in movable:
+            if order[position] == position:
+                continue
+            other = order.index(position)
+            order[position], order[other] = order[other], order[position]
+            if order_score(matrix, order) >= target - 1e-9:
+                reverted = True
+            else:
+                order[position], order[other] = order[other], order[position]
+    return order
+
+
+def optimize_order(matrix: np.ndarray, fixed_positions: Sequence[int] = (), cap: Optional[float] = None) -> Tuple[List[int], float]:
+    """連続技ボーナス合計が最大となる並び順（fixed_positions の技は元の位置に固定）
+
+    cap を指定すると上限で頭打ちにした合計で比べ、元の順序で上限に届いていれば並び替えない。
+    同じ合計になる並び順のうち、元の順序から動かす技の少ないものを返す。
+    """
+    n = matrix.shape[0]
+    original = list(range(n))
+    if n < 2:
+        return original, 0.0
+    fixed = {p for p in fixed_positions if 0 <= p < n}
+    movable = [i for i in range(n) if i not in fixed]
+    limit = cap if cap is not None else np.inf
+    original_score = order_score(matrix, original)
+
+    order: Optional[List[int]] = None
+    if original_score < limit - 1e-9:
+        if n <= EXACT_LIMIT:
+            allowed = np.zeros((n + 1, n), dtype=bool)
+            movable_mask = np.array([i not in fixed for i in range(n)])
+            for position in range(n):
+                if position in fixed:
+                    allowed[position, position] = True
+                else:
+                    allowed[position] = movable_mask
+            order = _exact_order(matrix, allowed)
+        if order is None:
+            order = _local_search_order(matrix, original, movable)
+
+    # 上限で頭打ちにした合計が改善しなければ元の順序を返す
+    if order is None:
+        return original, original_score
+    target = min(order_score(matrix, order), limit)
+    if target <= min(original_score, limit) + 1e-9:
+        return original, original_score
+    order = _fewest_moves_order(matrix, order, movable, target)
+    return order, order_score(matrix, order)
+
+
+# 種目ごとの行列（起動時に技カタログから構築）
+_MATRICES: Dict[str, ConnectionMatrix] = {}
+
+
+def get_connection_matrix(apparatus: str) -> ConnectionMatrix:
+    if not _MATRICES:
+        catalog = load_skills_ja()
+        for code in APPARATUS_NAMES:
+            _MATRICES[code] = ConnectionMatrix(code, catalog)
+    return _MATRICES[apparatus]
+
+
+def analyze_connections(apparatus: str, skills: Sequence[RoutineSkill], fixed_positions: Sequence[int] = (), optimize: bool = True) -> Dict:
+    """隣接ペアの採点と、連続技ボーナス最大化の並び替え提案"""
+    cm = get_connection_matrix(apparatus)
+    pair_bonuses = cm.score_adjacent(skills)
+    raw_total = float(pair_bonuses.sum())
+    result: Dict = {
+        "pairs": [
+            {
+                "position": i,
+                "from": skills[i].name,
+                "to": skills[i + 1].name,
+                "bonus": round(float(bonus), 2),
+            }
+            for i, bonus in enumerate(pair_bonuses)
+        ],
+        "raw_total": round(raw_total, 2),
+        "total": round(min(raw_total, MAX_CONNECTION_BONUS), 2),
+    }
+    if optimize:
+        order, best = optimize_order(cm.routine_matrix(skills), fixed_positions, MAX_CONNECTION_BONUS)
+        result["optimized"] = {
+            "order": order,
+            "skills": [skills[i].name for i in order],
+            "raw_total": round(best, 2),
+            "total": round(min(best, MAX_CONNECTION_BONUS), 2),
+            "gain": round(min(best, MAX_CONNECTION_BONUS) - min(raw_total, MAX_CONNECTION_BONUS), 2),
+            "fixed_positions": sorted({p for p in fixed_positions if 0 <= p < len(skills)}),
+        }
+    return result
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+種目別の知識ベース分割 - 種目を指定した検索を、その種目の章と共通の章だけに絞る
+
+rulebook_ja_full.txt は第3部の章（第10章 ゆか 〜 第15章 鉄棒）の境界で、
+Markdown は種目名・種目コードを含む見出しの範囲で、読み込み時に段落を種目ごとに振り分ける。
+どの種目にも属さない段落（第1〜9章・第4部 補足・全種目共通の節）は共通（general）とする。
+"""
+
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+GENERAL = "general"
+
+# 第3部 種目の章番号
+APPARATUS_CHAPTERS: Dict[int, str] = {10: "FX", 11: "PH", 12: "SR", 13: "VT", 14: "PB", 15: "HB"}
+APPARATUS_PART = 3
+
+# Markdown の見出しで種目を判定するキーワード（NFKC 正規化後に照合）
+HEADING_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "FX": ("床", "ゆか", "floor"),
+    "PH": ("あん馬", "pommel"),
+    "SR": ("つり輪", "rings"),
+    "VT": ("跳馬", "vault"),
+    "PB": ("平行棒", "parallel"),
+    "HB": ("鉄棒", "horizontal bar"),
+}
+_APPARATUS_CODE = re.compile(r"\b(FX|PH|SR|VT|PB|HB)\b")
+_CHAPTER = re.compile(r"第\s*(\d+)\s*章")
+_PART = re.compile(r"^第\s*(\d+)\s*部")
+# 章の見出しは行頭から数文字以内にある（「第3部 種 目 第10章 ゆ か」）
+CHAPTER_HEADING_WINDOW = 24
+
+
+def heading_apparatus(heading: str) -> Optional[str]:
+    """見出しが1つの種目だけを指していればその種目コード"""
+    text = unicodedata.normalize("NFKC", heading)
+    found = set(_APPARATUS_CODE.findall(text))
+    chapter = _CHAPTER.search(text)
+    if chapter and int(chapter.group(1)) in APPARATUS_CHAPTERS:
+        found.add(APPARATUS_CHAPTERS[int(chapter.group(1))])
+    lowered = text.lower()
+    found.update(code for code, keywords in HEADING_KEYWORDS.items() if any(k in lowered for k in keywords))
+    return found.pop() if len(found) == 1 else None
+
+
+def _partition_rulebook(content: str) -> List[Tuple[str, str]]:
+    """章の見出し行で区切る（目次のように章番号が戻る行は見出しとみなさない）"""
+    lines: List[Tuple[str, str]] = []
+    current, chapter = GENERAL, 0
+    for line in content.splitlines():
+        head = unicodedata.normalize("NFKC", line.strip())[:CHAPTER_HEADING_WINDOW]
+        if head.startswith("第"):
+            part = _PART.match(head)
+            match = _CHAPTER.search(head)
+            if match and int(match.group(1)) > chapter:
+                chapter = int(match.group(1))
+                current = APPARATUS_CHAPTERS.get(chapter, GENERAL)
+            elif part and int(part.group(1)) > APPARATUS_PART:
+                current = GENERAL
+        lines.append((current, line))
+    return lines
+
+
+def _partition_markdown(content: str) -> List[Tuple[str, str]]:
+    """種目を指す見出しの範囲（同じか上位の見出しが来るまで）をその種目に振り分ける"""
+    lines: List[Tuple[str, str]] = []
+    stack: List[Tuple[int, Optional[str]]] = []  # (見出しレベル, 種目)
+    for line in content.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            level = len(stripped) - len(stripped.lstrip("#"))
+            stack = [entry for entry in stack if entry[0] < level]
+            stack.append((level, heading_apparatus(stripped.lstrip("#"))))
+        current = next((code for _, code in reversed(stack) if code), GENERAL)
+        lines.append((current, line))
+    return lines
+
+
+def partition_text(file_name: str, content: str) -> List[Tuple[str, str]]:
+    """(区分, 段落) を文書の順に返す（段落は空行区切り、区分の境界でも区切る）"""
+    lines = _partition_markdown(content) if file_name.endswith(".md") else _partition_rulebook(content)
+    paragraphs: List[Tuple[str, str]] = []
+    buffer: List[str] = []
+    current = GENERAL
+
+    def flush() -> None:
+        if buffer:
+            paragraphs.append((current, "\n".join(buffer)))
+            buffer.clear()
+
+    for partition, line in lines:
+        if partition != current:
+            flush()
+            current = partition
+        if not line.strip():
+            flush()
+            continue
+        buffer.append(line)
+    flush()
+    return paragraphs
+
+
+class PartitionedCorpus:
+    """ファイルごと・区分ごとの段落リスト"""
+
+    def __init__(self, knowledge_base: Optional[Dict[str, str]] = None):
+        self._all: Dict[str, List[str]] = {}
+        self._partitions: Dict[str, Dict[str, List[str]]] = {}
+        for file_name, content in (knowledge_base or {}).items():
+            self.add(file_name, content)
+
+    def add(self, file_name: str, content: str) -> None:
+        # 種目を指定しない検索はこれまでどおり空行区切りの段落をそのまま使う
+        self._all[file_name] = content.split("\n\n")
+        partitions: Dict[str, List[str]] = {}
+        for partition, paragraph in partition_text(file_name, content):
+            partitions.setdefault(partition, []).append(paragraph)
+        self._partitions[file_name] = partitions
+
+    def paragraphs(self, file_name: str, apparatus: Optional[str] = None) -> List[str]:
+        """種目を指定した場合はその種目の段落、続いて共通の段落を返す"""
+        if apparatus is None or file_name not in self._partitions:
+            return self._all.get(file_name, [])
+        partitions = self._partitions[file_name]
+        return partitions.get(apparatus, []) + partitions.get(GENERAL, [])
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """ファイルごと・区分ごとの段落数"""
+        return {
+            file_name: {partition: len(paragraphs) for partition, paragraphs in partitions.items()}
+            for file_name, partitions in self._partitions.items()
+        }
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Dスコア計算 - アプリ（lib/d_score_calculator.dart）と同じ規則のサーバー側実装
+
+技の価値点・グループボーナス・連続技ボーナス（床・鉄棒）・ND減点を計算する。
+演技構成データはアプリが送る routine_data（name / valueLetter / group / value）をそのまま受け付ける。
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from skill_catalog import parse_group, parse_value
+
+APPARATUS_RULES: Dict[str, Dict[str, float]] = {
+    "FX": {"count_limit": 8, "groups_required": 4, "bonus_per_group": 0.5},
+    "PH": {"count_limit": 8, "groups_required": 4, "bonus_per_group": 0.5},
+    "SR": {"count_limit": 8, "groups_required": 4, "bonus_per_group": 0.5},
+    "VT": {"count_limit": 1, "groups_required": 0, "bonus_per_group": 0.0},
+    "PB": {"count_limit": 8, "groups_required": 4, "bonus_per_group": 0.5},
+    "HB": {"count_limit": 8, "groups_required": 4, "bonus_per_group": 0.5},
+}
+
+# ルールブック6-3条「短い演技に対して」
+SKILL_COUNT_DEDUCTIONS: Dict[int, float] = {
+    8: 0.0, 7: 0.0, 6: 0.0, 5: 3.0, 4: 4.0, 3: 5.0, 2: 6.0, 1: 7.0, 0: 10.0,
+}
+
+# 連続技ボーナスの上限（FIG規則）
+MAX_CONNECTION_BONUS = 0.4
+
+_EPS = 1e-9
+
+
+@dataclass
+class RoutineSkill:
+    """演技構成中の1技"""
+    name: str
+    group: int
+    value: float
+    value_letter: str = ""
+    connected_to_next: bool = False
+
+
+def routine_skills_from_payload(apparatus: str, routine_data: Sequence[Dict]) -> List[RoutineSkill]:
+    """アプリの routine_data を RoutineSkill のリストに変換する"""
+    skills = []
+    for item in routine_data:
+        letter = str(item.get("valueLetter") or item.get("value_letter") or "")
+        group = item.get("group")
+        value = item.get("value")
+        skills.append(RoutineSkill(
+            name=str(item.get("name", "")),
+            group=group if isinstance(group, int) else parse_group(group),
+            value=float(value) if value else parse_value(apparatus, letter),
+            value_letter=letter,
+            connected_to_next=bool(item.get("connected_to_next", False)),
+        ))
+    return skills
+
+
+def pair_connection_bonus(apparatus: str, g1: int, v1: float, g2: int, v2: float) -> float:
+    """隣接する2技の連続技ボーナス（床・鉄棒のみ）"""
+    if apparatus == "FX":
+        # グループ1（技術系）、切り返し系（前方系↔後方系）、グループ4同士は対象外
+        if g1 == 1 or g2 == 1:
+            return 0.0
+        if (g1, g2) in ((2, 3), (3, 2)) or (g1 == 4 and g2 == 4):
+            return 0.0
+        if v1 >= 0.4 - _EPS and v2 >= 0.4 - _EPS:
+            return 0.2
+        if (v1 >= 0.4 - _EPS and 0.2 - _EPS <= v2 <= 0.3 + _EPS) or (0.2 - _EPS <= v1 <= 0.3 + _EPS and v2 >= 0.4 - _EPS):
+            return 0.1
+        return 0.0
+
+    if apparatus == "HB":
+        d1, d2 = v1 >= 0.4 - _EPS, v2 >= 0.4 - _EPS
+        e1, e2 = v1 >= 0.5 - _EPS, v2 >= 0.5 - _EPS
+        c1, c2 = abs(v1 - 0.3) < _EPS, abs(v2 - 0.3) < _EPS
+        # 手放し技同士（グループII同士）
+        if g1 == 2 and g2 == 2:
+            if (d1 and e2) or (e1 and d2):
+                return 0.2
+            if d1 and d2:
+                return 0.1
+            if (c1 and d2) or (d1 and c2):
+                return 0.1
+            return 0.0
+        # グループI/III技 + 手放し技
+        if g1 in (1, 3) and g2 == 2:
+            if d1 and e2:
+                return 0.2
+            if d1 and d2:
+                return 0.1
+            return 0.0
+        # 手放し技 + グループI/III技
+        if g1 == 2 and g2 in (1, 3):
+            if e1 and d2:
+                return 0.2
+            if d1 and d2:
+                return 0.1
+        return 0.0
+
+    return 0.0
+
+
+def group_bonus_for(apparatus: str, group: int, highest_value: float) -> float:
+    """グループごとの最高難度技から決まるグループボーナス"""
+    if apparatus == "VT":
+        return 0.0
+    if group == 1:
+        return 0.5
+    if group in (2, 3):
+        return 0.5 if highest_value >= 0.4 - _EPS else 0.3
+    if group == 4:
+        if apparatus == "FX":
+            return 0.5 if highest_value >= 0.4 - _EPS else 0.3
+        # その他種目: グループ4は終末技、技の難度値をそのまま加算
+        return highest_value
+    return 0.0
+
+
+def group_bonus(apparatus: str, skills: Sequence[RoutineSkill]) -> float:
+    highest: Dict[int, float] = {}
+    for skill in skills:
+        if skill.value > highest.get(skill.group, -1.0):
+            highest[skill.group] = skill.value
+    return sum(group_bonus_for(apparatus, group, value) for group, value in highest.items())
+
+
+def select_counted_skills(apparatus: str, skills: Sequence[RoutineSkill]) -> List[int]:
+    """技数上限を超える場合、難度点 + グループボーナスが最大となる技を選ぶ（アプリと同じ探索）"""
+    count_limit = int(APPARATUS_RULES[apparatus]["count_limit"])
+    indices = list(range(len(skills)))
+    if len(skills) <= count_limit:
+        return indices
+
+    by_group: Dict[int, List[int]] = {}
+    for i in indices:
+        by_group.setdefault(skills[i].group, []).append(i)
+    for members in by_group.values():
+        members.sort(key=lambda i: -skills[i].value)
+
+    best_score = 0.0
+    best: List[int] = []
+    for min_per_group in range(3):
+        chosen: List[int] = []
+        used_groups = set()
+        for group, members in by_group.items():
+            for i in members[:min_per_group]:
+                if len(chosen) < count_limit:
+                    chosen.append(i)
+                    used_groups.add(group)
+        remaining = []
+        for group, members in by_group.items():
+            skip = min_per_group if group in used_groups else 0
+            remaining.extend(members[skip:])
+        remaining.sort(key=lambda i: -skills[i].value)
+        for i in remaining:
+            if len(chosen) >= count_limit:
+                break
+            chosen.append(i)
+        subset = [skills[i] for i in chosen]
+        score = sum(s.value for s in subset) + group_bonus(apparatus, subset)
+        if score > best_score:
+            best_score = score
+            best = chosen
+    if not best:
+        best = sorted(indices, key=lambda i: -skills[i].value)[:count_limit]
+    return sorted(best)
+
+
+def neutral_deductions(apparatus: str, skill_count: int) -> float:
+    if apparatus == "VT":
+        return 0.0
+    return SKILL_COUNT_DEDUCTIONS.get(skill_count, 10.0 if skill_count <= 0 else 0.0)
+
+
+def connection_bonus(apparatus: str, skills: Sequence[RoutineSkill], connections: Optional[Sequence[bool]] = None) -> float:
+    """連続実施された隣接技のボーナス合計（上限0.4）"""
+    total = 0.0
+    for i in range(len(skills) - 1):
+        connected = connections[i] if connections is not None else skills[i].connected_to_next
+        if connected:
+            a, b = skills[i], skills[i + 1]
+            total += pair_connection_bonus(apparatus, a.group, a.value, b.group, b.value)
+    return min(total, MAX_CONNECTION_BONUS)
+
+
+def calculate_d_score(apparatus: str, skills: Sequence[RoutineSkill], connections: Optional[Sequence[bool]] = None) -> Dict:
+    """Dスコアを計算し、アプリの DScoreResult と同じ項目を返す"""
+    if not skills or apparatus not in APPARATUS_RULES:
+        return {
+            "total_d_score": 0.0, "difficulty_value": 0.0, "group_bonus": 0.0,
+            "connection_bonus": 0.0, "neutral_deductions": 0.0, "fulfilled_groups": 0,
+            "required_groups": 0, "total_skills": 0, "counted_skills": [],
+        }
+    counted = select_counted_skills(apparatus, skills)
+    counted_skills = [skills[i] for i in counted]
+    difficulty = sum(s.value for s in counted_skills)
+    g_bonus = group_bonus(apparatus, counted_skills)
+    c_bonus = connection_bonus(apparatus, skills, connections)
+    nd = neutral_deductions(apparatus, len(skills))
+    return {
+        "total_d_score": round(difficulty + g_bonus + c_bonus - nd, 3),
+        "difficulty_value": round(difficulty, 3),
+        "group_bonus": round(g_bonus, 3),
+        "connection_bonus": round(c_bonus, 3),
+        "neutral_deductions": nd,
+        "fulfilled_groups": len({s.group for s in counted_skills}),
+        "required_groups": int(APPARATUS_RULES[apparatus]["groups_required"]),
+        "total_skills": len(skills),
+        "counted_skills": counted,
+    }
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Dスコアのモンテカルロ・リスクシミュレーション
+
+技ごとの成功確率から1万回前後の試行を NumPy で一括生成し、
+失敗による不認定・格下げ、連続技の不成立、グループ要求の喪失を反映した
+Dスコア分布（平均・パーセンタイル・ヒストグラム）を返す。
+"""
+
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from connection_matrix import LETTER_SLOTS, get_connection_matrix
+from dscore import APPARATUS_RULES, MAX_CONNECTION_BONUS, SKILL_COUNT_DEDUCTIONS, RoutineSkill
+
+# 既定の試行回数（鉄棒10〜12技で約25ms。2万回では50msの目標を超えることがある）
+DEFAULT_TRIALS = 10000
+MAX_TRIALS = 200000
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def default_success_probability(skill: RoutineSkill) -> float:
+    """成功確率の既定値（難度が1段上がるごとに3%下げる）"""
+    letter_index = min(max(int(round(skill.value * 10)) - 1, 0), LETTER_SLOTS - 1)
+    return max(0.5, 0.98 - 0.03 * letter_index)
+
+
+def _group_bonus(apparatus: str, group: int, highest: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """dscore.group_bonus_for の試行ベクトル版"""
+    if apparatus == "VT" or group not in (1, 2, 3, 4):
+        return np.zeros_like(highest)
+    if group == 1:
+        bonus = np.full_like(highest, 0.5)
+    elif group == 4 and apparatus != "FX":
+        bonus = highest
+    else:
+        bonus = np.where(highest >= 0.4 - 1e-9, 0.5, 0.3)
+    return np.where(present, bonus, 0.0)
+
+
+def _nd_table() -> np.ndarray:
+    table = np.zeros(64)
+    for count, deduction in SKILL_COUNT_DEDUCTIONS.items():
+        table[count] = deduction
+    return table
+
+
+_ND_TABLE = _nd_table()
+
+
+def simulate_d_scores(
+    apparatus: str,
+    skills: Sequence[RoutineSkill],
+    success_probabilities: Optional[Sequence[float]] = None,
+    connections: Optional[Sequence[bool]] = None,
+    downgrade_share: float = 0.3,
+    trials: int = DEFAULT_TRIALS,
+    seed: Optional[int] = None,
+) -> Dict:
+    """試行ごとのDスコアを一括計算し、分布の要約を返す
+
+    失敗した技は downgrade_share の割合で1段階格下げ（A難度なら不認定）、
+    残りは不認定とする。連続技は両方の技が成功した場合のみ成立する。
+    connections を省略した場合は隣接する全ペアを連続実施とみなす。
+    """
+    started = time.perf_counter()
+    n = len(skills)
+    trials = max(1, min(int(trials), MAX_TRIALS))
+    rng = np.random.default_rng(seed)
+    if n == 0:
+        return {"trials": trials, "planned_d_score": 0.0, "mean": 0.0, "percentiles": {}, "elapsed_ms": 0.0}
+
+    probabilities = np.array(
+        success_probabilities if success_probabilities is not None else [default_success_probability(s) for s in skills],
+        dtype=np.float64,
+    )
+    if probabilities.shape != (n,):
+        raise ValueError("success_probabilities の長さが技数と一致しません")
+    probabilities = np.clip(probabilities, 0.0, 1.0)
+    values = np.array([s.value for s in skills], dtype=np.float64)
+    groups = np.array([s.group for s in skills], dtype=np.intp)
+
+    success = rng.random((trials, n)) < probabilities
+    # 跳馬は格下げの概念がないため、失敗は不認定のみ
+    share = 0.0 if apparatus == "VT" else downgrade_share
+    downgraded = ~success & (rng.random((trials, n)) < share)
+    credited_values = np.where(success, values, np.where(downgraded, values - 0.1, 0.0))
+    credited_values = np.round(credited_values, 1)
+    credited = credited_values > 1e-9
+
+    scores = _score_trials(apparatus, skills, groups, credited_values, credited, success, connections)
+    planned = _score_trials(
+        apparatus, skills, groups,
+        values[None, :], np.ones((1, n), dtype=bool), np.ones((1, n), dtype=bool), connections,
+    )
+
+    total = scores["total"]
+    histogram_counts, histogram_edges = np.histogram(total, bins=np.arange(np.floor(total.min() * 10) / 10, total.max() + 0.2, 0.1))
+    # 各技の失敗が平均Dスコアに与える影響（成功時平均 - 失敗時平均）
+    impact = []
+    for i in range(n):
+        failed = ~success[:, i]
+        if failed.any() and (~failed).any():
+            impact.append(round(float(total[~failed].mean() - total[failed].mean()), 3))
+        else:
+            impact.append(0.0)
+
+    return {
+        "trials": trials,
+        "planned_d_score": round(float(planned["total"][0]), 3),
+        "mean": round(float(total.mean()), 3),
+        "std": round(float(total.std()), 3),
+        "min": round(float(total.min()), 3),
+        "max": round(float(total.max()), 3),
+        "percentiles": {f"p{p}": round(float(v), 3) for p, v in zip(PERCENTILES, np.percentile(total, PERCENTILES))},
+        "probability_planned_or_better": round(float((total >= planned["total"][0] - 1e-9).mean()), 4),
+        "expected_losses": {
+            "difficulty": round(float(planned["difficulty"][0] - scores["difficulty"].mean()), 3),
+            "group_bonus": round(float(planned["group_bonus"][0] - scores["group_bonus"].mean()), 3),
+            "connection_bonus": round(float(planned["connection_bonus"][0] - scores["connection_bonus"].mean()), 3),
+            "neutral_deductions": round(float(scores["neutral_deductions"].mean() - planned["neutral_deductions"][0]), 3),
+        },
+        "skill_impact": [
+            {"index": i, "name": s.name, "success_probability": round(float(probabilities[i]), 3), "failure_cost": impact[i]}
+            for i, s in enumerate(skills)
+        ],
+        "histogram": [
+            {"from": round(float(lo), 2), "count": int(c)}
+            for lo, c in zip(histogram_edges[:-1], histogram_counts) if c
+        ],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def _counted_skills(apparatus: str, groups: np.ndarray, credited_values: np.ndarray, count_limit: int) -> np.ndarray:
+    """dscore.select_counted_skills の試行ベクトル版（各グループの上位 k 技を先に入れ、残りを難度順に埋める）
+
+    認定結果が同じ試行は同じ選び方になるため、異なる結果だけを計算して戻す。
+    """
+    credited_values, inverse = _unique_rows(credited_values)
+    trials, n = credited_values.shape
+    credited = credited_values > 1e-9
+    index = np.arange(n)
+    same_group = groups[:, None] == groups[None, :]
+    # グループ内の順位（難度の高い順、同じ難度は前の技が先）
+    ahead = (credited_values[:, None, :] > credited_values[:, :, None]) | (
+        (credited_values[:, None, :] == credited_values[:, :, None]) & (index[None, :] < index[:, None])[None, :, :]
+    )
+    rank = (ahead & same_group[None, :, :] & credited[:, None, :]).sum(axis=2)
+    # グループの並び（認定された技が最初に現れた位置）
+    first = np.where(same_group[None, :, :] & credited[:, None, :], index[None, None, :], n).min(axis=2)
+
+    best_score = np.full(trials, -np.inf)
+    best = np.zeros((trials, n), dtype=bool)
+    for min_per_group in range(3):
+        phase = np.where(credited, np.where(rank < min_per_group, 0, 1), 2)
+        value_key = np.where(phase == 1, -credited_values, 0.0)
+        order = np.lexsort((rank, first, value_key, phase), axis=-1)[:, :count_limit]
+        counted = np.zeros((trials, n), dtype=bool)
+        np.put_along_axis(counted, order, True, axis=1)
+        counted &= credited
+        score = np.where(counted, credited_values, 0.0).sum(axis=1)
+        for group in np.unique(groups):
+            in_group = counted & (groups == group)[None, :]
+            highest = np.where(in_group, credited_values, 0.0).max(axis=1)
+            score += _group_bonus(apparatus, int(group), highest, in_group.any(axis=1))
+        improved = score > best_score + 1e-9
+        best_score = np.where(improved, score, best_score)
+        best[improved] = counted[improved]
+    return best[inverse]
+
+
+def _unique_rows(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """異なる行と、各行がそのどれに当たるか（np.unique(axis=0) より速い列ごとの並べ替え）"""
+    order = np.lexsort(matrix.T[::-1])
+    ordered = matrix[order]
+    starts = np.concatenate(([True], (ordered[1:] != ordered[:-1]).any(axis=1)))
+    inverse = np.empty(len(matrix), dtype=np.intp)
+    inverse[order] = np.cumsum(starts) - 1
+    return ordered[starts], inverse
+
+
+def _score_trials(
+    apparatus: str,
+    skills: Sequence[RoutineSkill],
+    groups: np.ndarray,
+    credited_values: np.ndarray,
+    credited: np.ndarray,
+    success: np.ndarray,
+    connections: Optional[Sequence[bool]],
+) -> Dict[str, np.ndarray]:
+    """試行 × 技の行列から各試行のDスコア内訳を求める"""
+    trials, n = credited_values.shape
+    count_limit = int(APPARATUS_RULES.get(apparatus, {"count_limit": 8})["count_limit"])
+
+    # 技数上限を超える場合は calculate_d_score と同じ選び方（グループボーナスを含めて最大）で数える
+    counted = _counted_skills(apparatus, groups, credited_values, count_limit) if n > count_limit else credited.copy()
+    counted_values = np.where(counted, credited_values, 0.0)
+    difficulty = counted_values.sum(axis=1)
+
+    group_bonus = np.zeros(trials)
+    for group in np.unique(groups):
+        in_group = counted & (groups == group)[None, :]
+        present = in_group.any(axis=1)
+        highest = np.where(in_group, credited_values, 0.0).max(axis=1)
+        group_bonus += _group_bonus(apparatus, int(group), highest, present)
+
+    connection_bonus = np.zeros(trials)
+    if n > 1 and apparatus in ("FX", "HB"):
+        class_matrix = get_connection_matrix(apparatus).class_matrix
+        letter_index = np.clip(np.rint(credited_values * 10).astype(np.intp) - 1, 0, LETTER_SLOTS - 1)
+        classes = np.clip(groups, 0, 5)[None, :] * LETTER_SLOTS + letter_index
+        pair_bonus = class_matrix[classes[:, :-1], classes[:, 1:]]
+        attempted = np.ones(n - 1, dtype=bool) if connections is None else np.asarray(connections[: n - 1], dtype=bool)
+        made = success[:, :-1] & success[:, 1:] & attempted[None, :]
+        connection_bonus = np.minimum((pair_bonus * made).sum(axis=1), MAX_CONNECTION_BONUS)
+
+    if apparatus == "VT":
+        neutral = np.zeros(trials)
+    else:
+        neutral = _ND_TABLE[np.minimum(credited.sum(axis=1), len(_ND_TABLE) - 1)]
+
+    return {
+        "total": difficulty + group_bonus + connection_bonus - neutral,
+        "difficulty": difficulty,
+        "group_bonus": group_bonus,
+        "connection_bonus": connection_bonus,
+        "neutral_deductions": neutral,
+    }
+
+
+def format_simulation_summary(result: Dict) -> str:
+    """分析プロンプトに埋め込む短い要約"""
+    if not result.get("percentiles"):
+        return ""
+    p = result["percentiles"]
+    risky = sorted(result["skill_impact"], key=lambda s: -s["failure_cost"] * (1 - s["success_probability"]))[:3]
+    lines = [
+        f"- 計画通りのDスコア: {result['planned_d_score']}点 / 期待値: {result['mean']}点（{result['trials']}回試行）",
+        f"- 分布: p5={p['p5']} p50={p['p50']} p95={p['p95']}、計画以上の確率 {result['probability_planned_or_better'] * 100:.1f}%",
+        f"- 期待損失: 難度点 {result['expected_losses']['difficulty']} / グループ {result['expected_losses']['group_bonus']} / 連続技 {result['expected_losses']['connection_bonus']}",
+    ]
+    for skill in risky:
+        lines.append(f"- 失敗時の影響が大きい技: {skill['name']}（成功率 {skill['success_probability']:.0%}、失敗で -{skill['failure_cost']}点）")
+    return "\n".join(lines)
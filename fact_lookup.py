@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+難度表の事実照会 - 「D難度は何点？」「鉄棒のグループⅡの技は？」に表から直接答える
+
+skills_difficulty_tables.md（種目 → グループ → 技名・難度の表）と
+difficulty_calculation_system.md の難度価値表を読み込み時に型付きの表へ変換し、
+質問をパターンで照合して出典付きの回答を組み立てる。
+表の範囲を超える質問（理由・練習方法・比較など）は None を返して LLM に任せる。
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from compact_corpus import resolve_corpus_file
+from intent_matcher import match_message
+from skill_catalog import APPARATUS_NAMES, DATA_DIR, GROUP_ROMAN, LETTER_VALUES, parse_group
+from skill_linker import _inside_katakana_word
+
+TABLES_FILE = "skills_difficulty_tables.md"
+VALUE_TABLE_FILE = "difficulty_calculation_system.md"
+
+# 一覧で表示する最大技数
+MAX_LISTED = 20
+# 技名の照合に使う最短の長さ（短い別名の誤一致を防ぐ）
+MIN_NAME_CHARS = 3
+
+# 表に書かれていないことを尋ねている質問は LLM に回す
+OUT_OF_SCOPE = re.compile(
+    r"なぜ|どうして|どうすれば|コツ|練習|方法|おすすめ|比べ|比較|違い|構成|最も|最高|最低|一番|いちばん|多い|少ない|以上|以下|why|how"
+)
+_ASKS_VALUE = re.compile(r"何点|価値|点数|得点|いくつ|value")
+_ASKS_COUNT = re.compile(r"何個|何技|いくつ|技数|数は|how many")
+_ASKS_SKILLS = re.compile(r"技")
+_LETTER = re.compile(r"(?<![a-z])([a-j])\s*難度")
+_GROUP = re.compile(r"グループ\s*(iii|ii|iv|i|v|[1-5])(?![a-z])")
+# 「CとD難度」「グループⅠとⅡ」のように複数を並べた指定（1つの表引きでは答えられない）
+_LETTER_LIST = re.compile(r"(?<![a-z])[a-j]\s*(?:と|・|、|,|や|/|or)\s*[a-j]\s*難度")
+_GROUP_LIST = re.compile(r"グループ\s*(?:iii|ii|iv|i|v|[1-5])\s*(?:と|・|、|,|や|/|or)\s*(?:グループ)?\s*(?:iii|ii|iv|i|v|[1-5])(?![a-z])")
+_APPARATUS_HEADING = re.compile(r"^##\s+(FX|PH|SR|VT|PB|HB)\b")
+_GROUP_HEADING = re.compile(r"^###\s+グループ\s*(\S+)\s*-\s*(.+)$")
+_TABLE_ROW = re.compile(r"^\|(.+)\|(.+)\|\s*$")
+_PAREN = re.compile(r"[（(]([^（）()]*)[）)]")
+
+
+@dataclass(frozen=True)
+class TableSkill:
+    apparatus: str
+    group: int
+    name: str
+    value_letter: str
+    value: float
+    line: int
+
+
+@dataclass
+class FactAnswer:
+    text: str
+    kind: str
+    sources: List[Dict] = field(default_factory=list)
+    elapsed_ms: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return {"text": self.text, "kind": self.kind, "sources": self.sources, "elapsed_ms": self.elapsed_ms}
+
+
+def _normalize(text: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def _aliases(name: str) -> List[str]:
+    """技名・括弧を除いた技名・括弧内の通称（秒数などの短い注記は除く）"""
+    aliases = [name, _PAREN.sub("", name)]
+    aliases += [inner for inner in _PAREN.findall(name) if not re.fullmatch(r"[\d./秒回°]+", inner)]
+    return [a for a in {_normalize(a) for a in aliases} if len(a) >= MIN_NAME_CHARS]
+
+
+def parse_skill_tables(content: str) -> Tuple[List[TableSkill], Dict[Tuple[str, int], Tuple[str, int]]]:
+    """技の一覧と、(種目, グループ) → (グループ名, 見出しの行番号)"""
+    skills: List[TableSkill] = []
+    groups: Dict[Tuple[str, int], Tuple[str, int]] = {}
+    apparatus: Optional[str] = None
+    group = 0
+    for number, line in enumerate(content.splitlines(), 1):
+        stripped = line.strip()
+        if stripped.startswith("## "):
+            heading = _APPARATUS_HEADING.match(stripped)
+            apparatus = heading.group(1) if heading else None
+            group = 0
+            continue
+        heading = _GROUP_HEADING.match(stripped)
+        if heading and apparatus:
+            group = parse_group(heading.group(1))
+            groups[(apparatus, group)] = (heading.group(2).strip(), number)
+            continue
+        row = _TABLE_ROW.match(stripped)
+        if not (row and apparatus and group):
+            continue
+        name, letter = row.group(1).strip(), row.group(2).strip().upper()
+        if name in ("技名",) or set(name) <= set("-: "):
+            continue
+        if apparatus == "VT" and not letter.isalpha():
+            try:
+                value = float(letter)
+            except ValueError:
+                continue
+        elif letter in LETTER_VALUES:
+            value = LETTER_VALUES[letter]
+        else:
+            continue
+        skills.append(TableSkill(apparatus, group, name, letter, value, number))
+    return skills, groups
+
+
+def parse_value_table(content: str) -> Dict[str, Tuple[float, int]]:
+    """難度価値表（| 難度 | 価値点 | ... |）→ {レター: (価値点, 行番号)}"""
+    values: Dict[str, Tuple[float, int]] = {}
+    for number, line in enumerate(content.splitlines(), 1):
+        cells = [c.strip() for c in line.strip().strip("|").split("|")]
+        if len(cells) >= 2 and len(cells[0]) == 1 and cells[0] in LETTER_VALUES:
+            try:
+                values[cells[0]] = (float(cells[1]), number)
+            except ValueError:
+                continue
+    return values
+
+
+class FactLookup:
+    """難度表の型付き索引とパターン照合"""
+
+    def __init__(self, tables: str = "", value_table: str = ""):
+        self.skills, self.groups = parse_skill_tables(tables)
+        self.values = parse_value_table(value_table)
+        self._by_group: Dict[Tuple[str, int], List[TableSkill]] = {}
+        self._names: List[Tuple[str, TableSkill]] = []
+        for skill in self.skills:
+            self._by_group.setdefault((skill.apparatus, skill.group), []).append(skill)
+            self._names += [(alias, skill) for alias in _aliases(skill.name)]
+        # 長い名前から照合する（「後方かかえ込み2回宙返り」より「後方かかえ込み2回宙返り1回ひねり」を優先）
+        self._names.sort(key=lambda entry: -len(entry[0]))
+
+    @classmethod
+    def from_data(cls, data_dir: str = DATA_DIR) -> "FactLookup":
+        contents = []
+        for file_name in (TABLES_FILE, VALUE_TABLE_FILE):
+            path = os.path.join(data_dir, file_name)
+            if os.path.exists(path):
+                with open(resolve_corpus_file(path), "r", encoding="utf-8") as f:
+                    contents.append(f.read())
+            else:
+                print(f"ファイルが見つかりません: {path}")
+                contents.append("")
+        return cls(*contents)
+
+    def __len__(self) -> int:
+        return len(self.skills)
+
+    def _group_source(self, apparatus: str, group: int) -> Dict:
+        title, line = self.groups.get((apparatus, group), ("", 0))
+        return {
+            "file": TABLES_FILE,
+            "section": f"{apparatus}（{APPARATUS_NAMES[apparatus]}） > グループ{GROUP_ROMAN.get(group, group)} - {title}",
+            "line": line,
+        }
+
+    def _letter_value(self, letter: str) -> Optional[FactAnswer]:
+        if letter in self.values:
+            value, line = self.values[letter]
+            source = {"file": VALUE_TABLE_FILE, "section": "難度価値表（全種目共通）", "line": line}
+        elif letter in LETTER_VALUES:
+            value, source = LETTER_VALUES[letter], {"file": TABLES_FILE, "section": "難度記号", "line": 0}
+        else:
+            return None
+        return FactAnswer(f"{letter}難度の価値点は{value:.2f}点です（跳馬は難度記号ではなく技ごとの得点）。", "letter_value", [source])
+
+    def _list(self, title: str, skills: List[TableSkill], sources: List[Dict], kind: str) -> FactAnswer:
+        lines = [f"{title}: {len(skills)}技"]
+        lines += [f"- {s.name}（{s.value_letter}）" for s in skills[:MAX_LISTED]]
+        if len(skills) > MAX_LISTED:
+            lines.append(f"ほか{len(skills) - MAX_LISTED}技")
+        return FactAnswer("\n".join(lines), kind, sources)
+
+    def _find_skill(self, normalized: str, apparatus: List[str]) -> List[TableSkill]:
+        for alias, _ in self._names:
+            start = normalized.find(alias)
+            # カタカナの別名が長いカタカナ語の一部に一致した箇所は使わない（「グループ」中の「ループ」等）
+            while start >= 0 and _inside_katakana_word(normalized, start, start + len(alias)):
+                start = normalized.find(alias, start + 1)
+            if start < 0:
+                continue
+            # 同名の技が複数種目にある場合は質問の種目に絞る（質問の種目にない技は答えない）
+            matches = [s for a, s in self._names if a == alias and (not apparatus or s.apparatus in apparatus)]
+            if matches:
+                return list(dict.fromkeys(matches))
+        return []
+
+    def answer(self, message: str) -> Optional[FactAnswer]:
+        """表だけで答えられる質問なら出典付きの回答、そうでなければ None"""
+        started = time.perf_counter()
+        normalized = _normalize(message)
+        if not normalized or OUT_OF_SCOPE.search(normalized):
+            return None
+        # 難度・グループを複数指定した質問は一部だけ答えることになるため LLM に回す
+        if (len({m.group(1) for m in _LETTER.finditer(normalized)}) > 1 or _LETTER_LIST.search(normalized)
+                or len({m.group(1) for m in _GROUP.finditer(normalized)}) > 1 or _GROUP_LIST.search(normalized)):
+            return None
+        apparatus = match_message(message).apparatus
+        letter = _LETTER.search(normalized)
+        group = _GROUP.search(normalized)
+        result: Optional[FactAnswer] = None
+
+        if len(apparatus) == 1 and group and _ASKS_SKILLS.search(normalized[group.end():]):
+            code, number = apparatus[0], parse_group(group.group(1).upper())
+            skills = self._by_group.get((code, number), [])
+            if letter:
+                skills = [s for s in skills if s.value_letter == letter.group(1).upper()]
+            if skills:
+                title = f"{APPARATUS_NAMES[code]} グループ{GROUP_ROMAN[number]}" + (f"の{letter.group(1).upper()}難度" if letter else "")
+                result = self._list(title, skills, [self._group_source(code, number)], "group_skills")
+        elif len(apparatus) == 1 and letter and _ASKS_SKILLS.search(normalized[letter.end():]):
+            code, value_letter = apparatus[0], letter.group(1).upper()
+            skills = [s for s in self.skills if s.apparatus == code and s.value_letter == value_letter]
+            if skills:
+                sources = [self._group_source(code, g) for g in sorted({s.group for s in skills})]
+                title = f"{APPARATUS_NAMES[code]}の{value_letter}難度"
+                if _ASKS_COUNT.search(normalized):
+                    result = FactAnswer(f"{title}の技は{len(skills)}技です。", "letter_count", sources)
+                else:
+                    result = self._list(title, skills, sources, "letter_skills")
+        elif letter and _ASKS_VALUE.search(normalized):
+            result = self._letter_value(letter.group(1).upper())
+        elif len(apparatus) == 1 and "グループ" in normalized and not group:
+            code = apparatus[0]
+            numbers = sorted(g for (a, g) in self.groups if a == code)
+            if numbers:
+                lines = [f"{APPARATUS_NAMES[code]}のグループ（{len(numbers)}）:"]
+                lines += [f"- グループ{GROUP_ROMAN[g]}: {self.groups[(code, g)][0]}（{len(self._by_group.get((code, g), []))}技）" for g in numbers]
+                result = FactAnswer("\n".join(lines), "apparatus_groups", [self._group_source(code, g) for g in numbers])
+        elif re.search(r"難度|何点|価値|得点|グループ", normalized):
+            skills = self._find_skill(normalized, apparatus)
+            if skills:
+                lines = []
+                for s in skills:
+                    score = f"{s.value:.1f}点" if s.apparatus == "VT" else f"{s.value_letter}難度（{s.value:.1f}点）"
+                    lines.append(f"{APPARATUS_NAMES[s.apparatus]}「{s.name}」は グループ{GROUP_ROMAN.get(s.group, s.group)}・{score}です。")
+                sources = [{**self._group_source(s.apparatus, s.group), "line": s.line} for s in skills]
+                result = FactAnswer("\n".join(lines), "skill_value", sources)
+
+        if result is None:
+            return None
+        sections: Dict[str, List[str]] = {}
+        for source in result.sources:
+            sections.setdefault(source["file"], [])
+            if source["section"] not in sections[source["file"]]:
+                sections[source["file"]].append(source["section"])
+        cited = "、".join(f"{file_name} " + "".join(f"「{s}」" for s in names) for file_name, names in sections.items())
+        result.text = f"{result.text}\n（出典: {cited}）"
+        result.elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+
+# 表から答えてはいけない（None を返すべき）質問と、表から答えるべき質問の回答種別
+REGRESSION_CASES: List[Tuple[str, Optional[str]]] = [
+    ("床のグループIIは何点？", None),
+    ("グループⅠの要求は何点？", None),
+    ("鉄棒で最もE難度の技が多いグループは？", None),
+    ("あん馬でC難度の技とD難度の技の数は？", None),
+    ("床でコールマンは何難度？", None),
+    ("D難度は何点？", "letter_value"),
+    ("鉄棒のE難度の技は何個？", "letter_count"),
+    ("床のグループ2の技は？", "group_skills"),
+    ("ツカハラ1回ひねりの得点は？", "skill_value"),
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="難度表の事実照会")
+    parser.add_argument("question", nargs="*", help="照会する質問（省略すると回帰ケースを確認する）")
+    args = parser.parse_args()
+
+    lookup = FactLookup.from_data()
+    if args.question:
+        result = lookup.answer(" ".join(args.question))
+        print(result.text if result else "（表からは答えません）")
+        return
+    failures = 0
+    for question, expected in REGRESSION_CASES:
+        result = lookup.answer(question)
+        kind = result.kind if result else None
+        ok = kind == expected
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {question} → {kind}（期待: {expected}）")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
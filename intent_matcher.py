@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+意図・種目・参照ファイル判定 - Aho-Corasick による一括キーワード照合
+
+全サーバー共通のキーワード表をここで一度だけ定義し、
+起動時に1つのオートマトンへコンパイルする。
+メッセージは1回の走査（メッセージ長に比例）で照合される。
+英数字のキーワード（"ph"・"nd" など）は単語の境界で始まり・終わる場合だけ一致とする
+（"graph" や "and" の中の一致を除くため）。
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Set, Tuple
+
+# 種目キーワード（照合は小文字化したメッセージに対して行う）
+APPARATUS_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "FX": ("床", "ゆか", "fx"),
+    "PH": ("あん馬", "ph"),
+    "SR": ("つり輪", "sr"),
+    "VT": ("跳馬", "vt"),
+    "PB": ("平行棒", "pb"),
+    "HB": ("鉄棒", "hb"),
+}
+
+# 質問意図キーワード
+INTENT_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "about_gymnastics": ("体操って", "体操とは", "体操について", "gymnastics"),
+    "greeting": ("こんにちは", "はじめまして", "よろしく", "hello"),
+    "connection": ("連続技", "接続"),
+    "nd_deduction": ("nd減点",),
+    "routine_analysis": ("演技構成分析",),
+}
+
+# キーワードと知識ベースファイルの対応（旧 SEARCH_MAPPING / keyword_to_file を統合）
+KEYWORD_FILES: Dict[str, Tuple[str, ...]] = {
+    "床": ("rulebook_ja_full.txt", "skills_difficulty_tables.md"),
+    "ゆか": ("rulebook_ja_full.txt", "skills_difficulty_tables.md"),
+    "あん馬": ("rulebook_ja_full.txt", "skills_difficulty_tables.md"),
+    "つり輪": ("rulebook_ja_full.txt", "skills_difficulty_tables.md"),
+    "跳馬": ("rulebook_ja_full.txt", "skills_difficulty_tables.md"),
+    "平行棒": ("rulebook_ja_full.txt", "skills_difficulty_tables.md"),
+    "鉄棒": ("rulebook_ja_full.txt", "skills_difficulty_tables.md"),
+    "連続技": ("d_score_master_knowledge.md", "comprehensive_rulebook_analysis.md"),
+    "組合せ": ("d_score_master_knowledge.md",),
+    "cv": ("d_score_master_knowledge.md",),
+    "接続": ("comprehensive_rulebook_analysis.md",),
+    "nd": ("d_score_master_knowledge.md", "comprehensive_rulebook_analysis.md"),
+    "減点": ("comprehensive_rulebook_analysis.md",),
+    "ルール": ("comprehensive_rulebook_analysis.md", "rulebook_ja_summary.md"),
+    "難度": ("skills_difficulty_tables.md", "difficulty_calculation_system.md"),
+    "グループ": ("comprehensive_rulebook_analysis.md",),
+    "器具": ("apparatus_details.md",),
+    "種目": ("apparatus_details.md",),
+    "実装": ("ai_implementation_guide.md",),
+}
+
+
+@dataclass
+class MessageMatch:
+    """1メッセージの照合結果"""
+    intents: Set[str] = field(default_factory=set)
+    apparatus: List[str] = field(default_factory=list)
+    files: List[str] = field(default_factory=list)
+    keywords: List[str] = field(default_factory=list)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick オートマトン（キーワード → ペイロード一覧）"""
+
+    def __init__(self, payloads: Dict[str, List[Tuple[str, str]]]):
+        self.payloads = payloads
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+
+        for keyword in payloads:
+            self._insert(keyword)
+        self._build_failure_links()
+
+    def _insert(self, keyword: str) -> None:
+        state = 0
+        for ch in keyword:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append(keyword)
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                self._out[next_state] += self._out[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """(開始位置, キーワード) を出現順に返す"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for keyword in out[state]:
+                yield i - len(keyword) + 1, keyword
+
+
+def _compile_tables() -> KeywordAutomaton:
+    """共通キーワード表を1つのオートマトンにまとめる"""
+    payloads: Dict[str, List[Tuple[str, str]]] = {}
+    for code, keywords in APPARATUS_KEYWORDS.items():
+        for keyword in keywords:
+            payloads.setdefault(keyword, []).append(("apparatus", code))
+    for intent, keywords in INTENT_KEYWORDS.items():
+        for keyword in keywords:
+            payloads.setdefault(keyword, []).append(("intent", intent))
+    for keyword, files in KEYWORD_FILES.items():
+        for file_name in files:
+            payloads.setdefault(keyword, []).append(("file", file_name))
+    return KeywordAutomaton(payloads)
+
+
+MATCHER = _compile_tables()
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+def _at_word_boundary(text: str, start: int, keyword: str) -> bool:
+    """英数字で始まる（終わる）キーワードの前（後ろ）が英数字でないこと"""
+    end = start + len(keyword)
+    if _is_word_char(keyword[0]) and start > 0 and _is_word_char(text[start - 1]):
+        return False
+    if _is_word_char(keyword[-1]) and end < len(text) and _is_word_char(text[end]):
+        return False
+    return True
+
+
+def match_message(message: str) -> MessageMatch:
+    """メッセージを1回走査し、意図・種目・参照ファイルを返す"""
+    result = MessageMatch()
+    text = message.lower()
+    for start, keyword in MATCHER.iter_matches(text):
+        if not _at_word_boundary(text, start, keyword):
+            continue
+        result.keywords.append(keyword)
+        for kind, value in MATCHER.payloads[keyword]:
+            if kind == "intent":
+                result.intents.add(value)
+            elif kind == "apparatus":
+                if value not in result.apparatus:
+                    result.apparatus.append(value)
+            elif value not in result.files:
+                result.files.append(value)
+    return result
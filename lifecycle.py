@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+サーバーの起動ライフサイクル - 読み込み・ウォームアップ・レディネス判定
+
+モジュール読み込み時のファイルI/Oやクライアント生成をやめ、FastAPI の lifespan で
+登録済みの起動ステップをバックグラウンド実行する。必須ステップがすべて完了した時点で
+/ready が 200 を返し（Cloud Run の起動プローブ用）、それまでに届いたリクエストは
+完了を待ってから処理する。ウォームアップ（索引構築・接続確立・キャッシュ準備）は
+レディ後も続行し、失敗してもサービスは止めない。
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# レディ前に届いたリクエストを待たせる最大秒数
+READY_WAIT_SECONDS = float(os.environ.get("READY_WAIT_SECONDS", 30))
+# レディを待たずに応答するパス
+EXEMPT_PATHS = ("/", "/health", "/ready")
+
+STEP_PENDING = "pending"
+STEP_RUNNING = "running"
+STEP_DONE = "done"
+STEP_FAILED = "failed"
+
+
+def create_openai_client(api_key: Optional[str] = None) -> Any:
+    """APIキーがある場合のみ openai を読み込んでクライアントを作る（フォールバック時は import しない）"""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+
+def warm_openai_connection(client: Any) -> None:
+    """上流への接続（TLS・コネクションプール）を事前に確立する"""
+    if client is not None:
+        client.with_options(timeout=10.0, max_retries=0).models.list()
+
+
+class Lifecycle:
+    """起動ステップの登録と実行状態"""
+
+    def __init__(self):
+        self._steps: List[Tuple[str, Callable[[], Any], bool]] = []
+        self.status: Dict[str, Dict[str, Any]] = {}
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._shutdown: List[Tuple[str, Callable[[], Any]]] = []
+
+    def step(self, name: str) -> Callable:
+        """必須の起動ステップ（登録順に実行、完了するまでレディにならない）"""
+        return self._register(name, critical=True)
+
+    def warmup(self, name: str) -> Callable:
+        """任意のウォームアップ（レディ後に実行、失敗しても続行）"""
+        return self._register(name, critical=False)
+
+    def shutdown(self, name: str) -> Callable:
+        """終了時の後片付け（登録と逆順に実行、失敗しても続行）"""
+        def decorator(func: Callable[[], Any]) -> Callable[[], Any]:
+            self._shutdown.append((name, func))
+            return func
+        return decorator
+
+    def _register(self, name: str, critical: bool) -> Callable:
+        def decorator(func: Callable[[], Any]) -> Callable[[], Any]:
+            self._steps.append((name, func, critical))
+            self.status[name] = {"status": STEP_PENDING, "critical": critical}
+            return func
+        return decorator
+
+    @property
+    def ready(self) -> bool:
+        return self._ready is not None and self._ready.is_set()
+
+    async def _run_step(self, name: str, func: Callable[[], Any]) -> bool:
+        entry = self.status[name]
+        entry["status"] = STEP_RUNNING
+        started = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(func):
+                await func()
+            else:
+                # 同期のファイルI/Oはスレッドで実行し、イベントループを止めない
+                await asyncio.to_thread(func)
+            entry["status"] = STEP_DONE
+            return True
+        except Exception as e:
+            entry["status"] = STEP_FAILED
+            entry["error"] = str(e)
+            logger.error(f"起動ステップ失敗: {name}: {e}")
+            return False
+        finally:
+            entry["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def run(self, include_warmup: bool = True) -> None:
+        """必須ステップ → レディ → ウォームアップ の順に実行する（CLI からは include_warmup=False）"""
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        self.started_at = time.time()
+        critical = [(name, func) for name, func, is_critical in self._steps if is_critical]
+        warmups = [(name, func) for name, func, is_critical in self._steps if not is_critical]
+        for name, func in critical:
+            if not await self._run_step(name, func):
+                return
+        self.ready_at = time.time()
+        self._ready.set()
+        logger.info(f"レディ: {self.ready_at - self.started_at:.2f} 秒")
+        if include_warmup:
+            await asyncio.gather(*(self._run_step(name, func) for name, func in warmups))
+
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI):
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+        try:
+            yield
+        finally:
+            self._task.cancel()
+            for name, func in reversed(self._shutdown):
+                try:
+                    func()
+                except Exception as e:
+                    logger.error(f"終了処理失敗: {name}: {e}")
+
+    async def wait_ready(self, timeout: float = READY_WAIT_SECONDS) -> bool:
+        if self._ready is None:
+            return False
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def readiness(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "startup_seconds": round(self.ready_at - self.started_at, 3) if self.ready_at and self.started_at else None,
+            "steps": self.status,
+        }
+
+    def install(self, app: FastAPI) -> None:
+        """/ready エンドポイントと、レディ前のリクエストを待たせるミドルウェアを追加する"""
+        @app.get("/ready")
+        async def ready():
+            return JSONResponse(self.readiness(), status_code=200 if self.ready else 503)
+
+        app.add_middleware(ReadinessGateMiddleware, lifecycle=self)
+
+
+class ReadinessGateMiddleware:
+    """レディになるまでリクエストを待たせ、時間切れなら 503 を返す（ASGI ミドルウェア）"""
+
+    def __init__(self, app, lifecycle: Lifecycle):
+        self.app = app
+        self.lifecycle = lifecycle
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS or self.lifecycle.ready:
+            await self.app(scope, receive, send)
+            return
+        if not await self.lifecycle.wait_ready():
+            response = JSONResponse({"detail": "サーバーの起動処理中です"}, status_code=503, headers={"Retry-After": "5"})
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
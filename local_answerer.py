@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+抽出型のローカル回答エンジン - APIキーなし・上流障害時のフォールバック
+
+知識ベースを文（表は行）単位の索引にし、質問との文字バイグラムの重なり（IDF 重み付き）で
+関連する文を選んで出典順に並べ、技の難度・グループ・条文番号などの事実を添えて回答を組み立てる。
+LLM を呼ばないため数ミリ秒で応答できる。
+"""
+
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from compact_corpus import resolve_corpus_file
+from intent_matcher import match_message
+from skill_catalog import APPARATUS_NAMES, DATA_DIR, LETTER_VALUES
+from skill_linker import SkillLinker
+from term_dictionary import TermDictionary
+
+DEFAULT_CORPUS_FILES = [
+    "d_score_master_knowledge.md",
+    "difficulty_calculation_system.md",
+    "comprehensive_rulebook_analysis.md",
+    "rulebook_ja_summary.md",
+    "apparatus_details.md",
+    "skills_difficulty_tables.md",
+    "rulebook_ja_full.txt",
+]
+
+MAX_PASSAGES = 5
+MAX_PASSAGE_CHARS = 220
+MIN_PASSAGE_CHARS = 8
+# これ未満のスコアしかない場合は回答しない（定型文に任せる）
+MIN_SCORE = 4.0
+# 出現率がこれを超えるバイグラムは検索に使わない
+MAX_DOCUMENT_FREQUENCY = 0.05
+# 最上位スコアに対してこの割合未満の文は採用しない
+RELATIVE_SCORE_CUTOFF = 0.35
+# 選んだ文同士のバイグラム重複率がこれを超える場合は片方を捨てる
+REDUNDANCY_THRESHOLD = 0.6
+
+_SENTENCE_END = re.compile(r"(?<=[。！？])")
+_ARTICLE = re.compile(r"\d{1,2}-\d{1,2}条")
+_LETTER_MENTION = re.compile(r"([A-J])難度")
+_TABLE_SEPARATOR = re.compile(r"^\|[\s\-:|]+\|$")
+_MARKDOWN_DECORATION = re.compile(r"\*\*|__|`")
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if ch.isalnum())
+
+
+def _is_content_bigram(bigram: str) -> bool:
+    """ひらがなだけのバイグラム（助詞・語尾）は検索語にしない"""
+    return any(not ("ぁ" <= ch <= "ゟ") for ch in bigram)
+
+
+def _bigrams(text: str) -> Set[str]:
+    normalized = _normalize(text)
+    return {normalized[i:i + 2] for i in range(len(normalized) - 1) if _is_content_bigram(normalized[i:i + 2])}
+
+
+@dataclass
+class Passage:
+    file: str
+    position: int
+    heading: str
+    text: str
+
+
+@dataclass
+class LocalAnswer:
+    text: str
+    passages: List[Passage] = field(default_factory=list)
+    facts: List[str] = field(default_factory=list)
+    articles: List[str] = field(default_factory=list)
+    elapsed_ms: float = 0.0
+
+
+def split_passages(file_name: str, content: str) -> List[Passage]:
+    """Markdown は見出しを引き継いだ文・表の行、抽出テキストは文単位に分ける"""
+    passages: List[Passage] = []
+    headings: List[str] = []
+    for line in content.splitlines():
+        stripped = line.strip()
+        if not stripped or _TABLE_SEPARATOR.match(stripped):
+            continue
+        if stripped.startswith("#"):
+            level = len(stripped) - len(stripped.lstrip("#"))
+            headings = headings[:level - 1] + [stripped.lstrip("#").strip()]
+            continue
+        if stripped.startswith("|"):
+            cells = [c.strip() for c in stripped.strip("|").split("|")]
+            pieces = [" / ".join(c for c in cells if c)]
+        else:
+            pieces = _SENTENCE_END.split(stripped.lstrip("-*・ ").strip())
+        for piece in pieces:
+            piece = _MARKDOWN_DECORATION.sub("", piece).strip()
+            if len(piece) < MIN_PASSAGE_CHARS:
+                continue
+            if len(piece) > MAX_PASSAGE_CHARS:
+                piece = piece[:MAX_PASSAGE_CHARS] + "…"
+            passages.append(Passage(file_name, len(passages), " > ".join(headings[-2:]), piece))
+    return passages
+
+
+class LocalAnswerer:
+    """文単位のバイグラム転置索引による抽出型回答"""
+
+    def __init__(self, knowledge_base: Dict[str, str], linker: Optional[SkillLinker] = None, terms: Optional[TermDictionary] = None):
+        self.linker = linker
+        self.terms = terms
+        self.passages: List[Passage] = []
+        for file_name, content in knowledge_base.items():
+            self.passages.extend(split_passages(file_name, content))
+
+        postings: Dict[str, List[int]] = defaultdict(list)
+        self._lengths: List[int] = []
+        for idx, passage in enumerate(self.passages):
+            grams = _bigrams(passage.heading + passage.text)
+            self._lengths.append(max(1, len(grams)))
+            for gram in grams:
+                postings[gram].append(idx)
+        total = max(1, len(self.passages))
+        self._average_length = sum(self._lengths) / total
+        limit = max(1, int(total * MAX_DOCUMENT_FREQUENCY))
+        self._postings = {gram: ids for gram, ids in postings.items() if len(ids) <= limit}
+        self._idf = {gram: math.log(total / len(ids)) for gram, ids in self._postings.items()}
+
+    @classmethod
+    def from_data(cls, data_dir: str = DATA_DIR, linker: Optional[SkillLinker] = None, terms: Optional[TermDictionary] = None) -> "LocalAnswerer":
+        knowledge_base = {}
+        for file_name in DEFAULT_CORPUS_FILES:
+            path = os.path.join(data_dir, file_name)
+            if os.path.exists(path):
+                with open(resolve_corpus_file(path), "r", encoding="utf-8") as f:
+                    knowledge_base[file_name] = f.read()
+        return cls(knowledge_base, linker, terms)
+
+    def search(self, query: str, preferred_files: Optional[List[str]] = None, apparatus: Optional[List[str]] = None) -> List[tuple]:
+        """(スコア, 文番号) を高い順に返す"""
+        scores: Dict[int, float] = defaultdict(float)
+        for gram in _bigrams(query):
+            idf = self._idf.get(gram)
+            if idf is None:
+                continue
+            for idx in self._postings[gram]:
+                scores[idx] += idf
+        preferred = set(preferred_files or ())
+        apparatus_names = [APPARATUS_NAMES[a] for a in apparatus or () if a in APPARATUS_NAMES]
+        ranked = []
+        for idx, score in scores.items():
+            passage = self.passages[idx]
+            # 長い文ほど偶然一致しやすいため長さで割り引く
+            score /= 0.5 + 0.5 * self._lengths[idx] / self._average_length
+            if passage.file in preferred:
+                score *= 1.5
+            if apparatus_names and any(name in passage.heading or name in passage.text for name in apparatus_names):
+                score *= 1.3
+            ranked.append((score, idx))
+        ranked.sort(reverse=True)
+        return ranked
+
+    def _select(self, ranked: List[tuple]) -> List[Passage]:
+        chosen: List[int] = []
+        chosen_grams: List[Set[str]] = []
+        cutoff = max(MIN_SCORE / 2, ranked[0][0] * RELATIVE_SCORE_CUTOFF) if ranked else 0.0
+        for score, idx in ranked:
+            if len(chosen) >= MAX_PASSAGES or score < cutoff:
+                break
+            grams = _bigrams(self.passages[idx].text)
+            if any(len(grams & other) / max(1, min(len(grams), len(other))) > REDUNDANCY_THRESHOLD for other in chosen_grams):
+                continue
+            chosen.append(idx)
+            chosen_grams.append(grams)
+        # 出典ファイルごと（最上位の文を含むファイルから）に、文書内の順序で並べる
+        file_order: Dict[str, int] = {}
+        for idx in chosen:
+            file_order.setdefault(self.passages[idx].file, len(file_order))
+        chosen.sort(key=lambda i: (file_order[self.passages[i].file], self.passages[i].position))
+        return [self.passages[i] for i in chosen]
+
+    def _facts(self, message: str, apparatus: List[str]) -> List[str]:
+        facts = []
+        if self.linker:
+            block = self.linker.format_facts(self.linker.link(message, apparatus))
+            facts.extend(block.splitlines()[1:])
+        normalized = unicodedata.normalize("NFKC", message).upper()
+        for letter in dict.fromkeys(_LETTER_MENTION.findall(normalized)):
+            facts.append(f"- {letter}難度の価値点：{LETTER_VALUES[letter]:.1f}点")
+        return facts
+
+    def answer(self, message: str) -> Optional[LocalAnswer]:
+        """関連する文が見つからない場合は None"""
+        started = time.perf_counter()
+        # 英語の質問は対訳辞書で日本語の用語を付け足してから照合する
+        query = self.terms.expand(message) if self.terms else message
+        message_match = match_message(query)
+        if "greeting" in message_match.intents and len(message) <= 20:
+            return None
+        ranked = self.search(query, message_match.files, message_match.apparatus)
+        facts = self._facts(query, message_match.apparatus)
+        if not facts and (not ranked or ranked[0][0] < MIN_SCORE):
+            return None
+        passages = self._select(ranked)
+        articles = list(dict.fromkeys(a for p in passages for a in _ARTICLE.findall(p.text)))
+
+        lines = [f"「{message.strip()}」について、ルールブックと技データから該当する内容をまとめました。"]
+        if facts:
+            lines += ["", "【技データ】"] + facts
+        if passages:
+            lines += ["", "【関連する規定】"]
+            for passage in passages:
+                source = f"{passage.file}「{passage.heading}」" if passage.heading else passage.file
+                lines.append(f"・{passage.text}（出典: {source}）")
+        if articles:
+            lines += ["", f"【関連条文】{'、'.join(articles)}"]
+        lines += ["", "※ 知識ベースからの抜粋です。詳細はルールブックの該当箇所をご確認ください。"]
+        return LocalAnswer(
+            text="\n".join(lines),
+            passages=passages,
+            facts=facts,
+            articles=articles,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 3),
+        )
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+よくある質問の回答をオフラインで一括生成する
+
+ログ（server_log.txt 形式、または message を含む JSONL）から頻出質問を集計し、
+設定済みのプロバイダーへ一定レートで問い合わせて事前生成回答ストアへ保存する。
+知識ベースが変わった質問（corpus_version 不一致）は再生成される。
+
+使い方:
+    python precompute_answers.py server_log.txt captures/requests.jsonl --top 50 --rate 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+from answer_store import DEFAULT_STORE_PATH, AnswerStore, corpus_version, normalize_question
+
+# server.py / server_advanced.py 系のログ行（50文字で切り詰められた質問は除外する）
+LOG_PATTERNS = [
+    re.compile(r"Processing question: (.*?)\.\.\.$"),
+    re.compile(r"処理中: (.*?)\.\.\.$"),
+]
+TRUNCATED_LENGTH = 50
+
+
+def iter_logged_questions(paths: Iterable[str]) -> Iterable[str]:
+    """ログファイルから質問文を取り出す"""
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    if line.startswith("{"):
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        body = record.get("body") if isinstance(record.get("body"), dict) else record
+                        message = body.get("message")
+                        if isinstance(message, str) and message.strip():
+                            yield message.strip()
+                        continue
+                    for pattern in LOG_PATTERNS:
+                        m = pattern.search(line)
+                        if m and len(m.group(1)) < TRUNCATED_LENGTH:
+                            yield m.group(1).strip()
+                            break
+        except OSError as e:
+            print(f"❌ ログを読み込めません: {path} ({e})")
+
+
+def top_questions(paths: Iterable[str], top: int, min_count: int) -> List[Tuple[str, int]]:
+    """正規化した質問ごとに集計し、代表表記と件数を頻度順に返す"""
+    counts: Counter = Counter()
+    surfaces: Dict[str, Counter] = {}
+    for question in iter_logged_questions(paths):
+        key = normalize_question(question)
+        if not key:
+            continue
+        counts[key] += 1
+        surfaces.setdefault(key, Counter())[question] += 1
+    return [
+        (surfaces[key].most_common(1)[0][0], count)
+        for key, count in counts.most_common(top)
+        if count >= min_count
+    ]
+
+
+async def generate_answers(args: argparse.Namespace) -> None:
+    # 配信側と同じ知識ベース・プロンプトで生成する
+    import server_advanced as server
+    await server.LIFECYCLE.run(include_warmup=False)
+
+    store = AnswerStore(args.store).load()
+    version = corpus_version(server.KNOWLEDGE_BASE)
+    questions = top_questions(args.logs, args.top, args.min_count)
+    print(f"頻出質問: {len(questions)} 件 (corpus_version={version})")
+
+    pending = [
+        (question, count) for question, count in questions
+        if args.force or not store.is_fresh(normalize_question(question), version)
+    ]
+    print(f"生成対象: {len(pending)} 件（最新の回答がある質問はスキップ）")
+    if args.dry_run or not pending:
+        for question, count in pending:
+            print(f"  {count:5d}  {question}")
+        return
+    if not server.openai_client:
+        print("❌ OPENAI_API_KEY が設定されていないため生成できません")
+        return
+
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    failed: List[str] = []
+    for i, (question, count) in enumerate(pending, 1):
+        started = time.monotonic()
+        # /chat/message と同じコンテキスト（用語の対訳・技の事実・難度表の段落除外）で問い合わせる
+        knowledge_context, _, _ = server.build_knowledge_context(question)
+        # get_ai_response は失敗時にデモ回答を返すため、API を直接呼んで失敗を検知する
+        # （デモ回答を事前生成回答として保存しない）
+        try:
+            answer = server.request_completion(question, knowledge_context)
+        except Exception as e:
+            failed.append(question)
+            print(f"❌ [{i}/{len(pending)}] {question[:40]}（生成失敗のため保存しません: {e}）")
+        else:
+            store.put(question, answer, version, args.model, count)
+            store.save()
+            print(f"✅ [{i}/{len(pending)}] {question[:40]}")
+        elapsed = time.monotonic() - started
+        if interval > elapsed and i < len(pending):
+            await asyncio.sleep(interval - elapsed)
+    if failed:
+        print(f"⚠️ 生成に失敗した質問: {len(failed)} 件（次回の実行で再試行されます）")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="頻出質問の回答を事前生成する")
+    parser.add_argument("logs", nargs="+", help="ログファイル（server_log.txt 形式または JSONL）")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="事前生成回答ストアのパス")
+    parser.add_argument("--top", type=int, default=50, help="対象とする頻出質問数")
+    parser.add_argument("--min-count", type=int, default=2, help="対象とする最小出現回数")
+    parser.add_argument("--rate", type=float, default=0.5, help="1秒あたりの最大リクエスト数")
+    parser.add_argument("--model", default="gpt-4-turbo-preview", help="記録用のモデル名")
+    parser.add_argument("--force", action="store_true", help="最新の回答があっても再生成する")
+    parser.add_argument("--dry-run", action="store_true", help="生成対象の一覧だけを表示する")
+    asyncio.run(generate_answers(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+キャプチャしたリクエストの再送ツール
+
+request_capture.py が記録した JSONL を任意のサーバーへ再送する。
+元の到着間隔を --speed で伸縮（1=等速, N=N倍速, max=待ち時間なし）して
+本番の負荷形状を手元で再現する。
+
+使い方:
+    python replay_requests.py captures/requests.jsonl --target http://localhost:8080 --speed 4
+"""
+
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+
+def load_captures(paths: List[str], path_filter: Optional[str]) -> List[Dict]:
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if path_filter and not record.get("path", "").startswith(path_filter):
+                    continue
+                records.append(record)
+    records.sort(key=lambda r: r.get("ts", 0.0))
+    return records
+
+
+def send_request(target: str, record: Dict, timeout: float) -> Tuple[int, float]:
+    url = target.rstrip("/") + record.get("path", "/")
+    if record.get("query"):
+        url += "?" + record["query"]
+    data = None
+    headers = {}
+    if record.get("body") is not None:
+        data = json.dumps(record["body"], ensure_ascii=False).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    request = urllib.request.Request(url, data=data, headers=headers, method=record.get("method", "GET"))
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return status, (time.perf_counter() - started) * 1000
+
+
+def replay(records: List[Dict], target: str, speed: Optional[float], concurrency: int, timeout: float) -> None:
+    if not records:
+        print("再送するリクエストがありません")
+        return
+    origin = records[0].get("ts", 0.0)
+    started = time.monotonic()
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if speed:
+                due = (record.get("ts", origin) - origin) / speed
+                wait = due - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+            futures.append((record, pool.submit(send_request, target, record, timeout)))
+        results = [(record, future.result()) for record, future in futures]
+    wall = time.monotonic() - started
+
+    statuses = Counter(status for _, (status, _) in results)
+    latencies = sorted(latency for _, (_, latency) in results)
+    print(f"再送: {len(results)} 件 / {wall:.2f} 秒 ({len(results) / wall:.1f} req/s)")
+    print(f"ステータス: {dict(statuses)}")
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"レイテンシ(ms): p50={statistics.median(latencies):.1f} p95={p95:.1f} max={latencies[-1]:.1f}")
+
+    by_path: Dict[str, List[float]] = {}
+    for record, (_, latency) in results:
+        by_path.setdefault(record.get("path", "/"), []).append(latency)
+    for path, values in sorted(by_path.items()):
+        original = [r.get("duration_ms", 0.0) for r, _ in results if r.get("path") == path]
+        print(f"  {path}: {len(values)} 件 p50={statistics.median(values):.1f}ms "
+              f"(記録時 p50={statistics.median(original):.1f}ms)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="キャプチャしたリクエストを再送する")
+    parser.add_argument("captures", nargs="+", help="request_capture.py が出力した JSONL")
+    parser.add_argument("--target", default="http://localhost:8080", help="再送先のベースURL")
+    parser.add_argument("--speed", default="1", help="再生速度（1, N, max）")
+    parser.add_argument("--concurrency", type=int, default=16, help="最大同時リクエスト数")
+    parser.add_argument("--timeout", type=float, default=60.0, help="1リクエストのタイムアウト秒")
+    parser.add_argument("--path", default=None, help="指定したパスで始まるリクエストのみ再送")
+    args = parser.parse_args()
+
+    speed = None if args.speed == "max" else float(args.speed)
+    records = load_captures(args.captures, args.path)
+    replay(records, args.target, speed, args.concurrency, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
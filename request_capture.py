@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+構造化リクエストキャプチャ - サンプリング付き非同期 JSONL 記録
+
+環境変数 REQUEST_CAPTURE_PATH を設定したときだけ有効になる。
+記録はバックグラウンドスレッドがまとめて書き込むため、イベントループを止めない。
+キューが溢れた場合は記録を捨てて件数だけ数える。
+
+    REQUEST_CAPTURE_PATH         出力先（例: captures/requests.jsonl）
+    REQUEST_CAPTURE_SAMPLE_RATE  記録する割合（0.0〜1.0、既定 1.0）
+    REQUEST_CAPTURE_MAX_BYTES    ローテーションするファイルサイズ（既定 10MB）
+    REQUEST_CAPTURE_BACKUPS      保持する世代数（既定 3）
+
+エンドポイント側からは annotate() でキャッシュ・応答段階などの判断を記録できる。
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_CAPTURED_BODY = 64 * 1024
+QUEUE_SIZE = 10000
+FLUSH_INTERVAL = 1.0
+
+_current_annotations: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "request_capture_annotations", default=None
+)
+
+
+def annotate(**fields: Any) -> None:
+    """処理中リクエストの記録に項目を追加する（記録対象外なら何もしない）"""
+    annotations = _current_annotations.get()
+    if annotations is not None:
+        annotations.update(fields)
+
+
+class RequestCapture:
+    """JSONL への非同期バッファ書き込み（サイズでローテーション）"""
+
+    def __init__(self, path: str, sample_rate: float = 1.0, max_bytes: int = 10 * 1024 * 1024, backups: int = 3):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=QUEUE_SIZE)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="request-capture", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["RequestCapture"]:
+        path = os.getenv("REQUEST_CAPTURE_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            sample_rate=float(os.getenv("REQUEST_CAPTURE_SAMPLE_RATE", "1.0")),
+            max_bytes=int(os.getenv("REQUEST_CAPTURE_MAX_BYTES", str(10 * 1024 * 1024))),
+            backups=int(os.getenv("REQUEST_CAPTURE_BACKUPS", "3")),
+        )
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _rotate(self) -> None:
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch)
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            self.written += len(batch)
+        except OSError as e:
+            logger.error(f"リクエスト記録の書き込みエラー: {e}")
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < 500:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+
+class RequestCaptureMiddleware:
+    """ASGI ミドルウェア - 本文を読み捨てずに記録する"""
+
+    def __init__(self, app, capture: RequestCapture):
+        self.app = app
+        self.capture = capture
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.capture.sampled():
+            await self.app(scope, receive, send)
+            return
+
+        started = time.time()
+        clock = time.perf_counter()
+        body_chunks: List[bytes] = []
+        sizes = {"request": 0, "response": 0}
+        status = {"code": 500}
+        annotations: Dict[str, Any] = {}
+        token = _current_annotations.set(annotations)
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                sizes["request"] += len(chunk)
+                if sizes["request"] <= MAX_CAPTURED_BODY:
+                    body_chunks.append(chunk)
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            _current_annotations.reset(token)
+            body: Any = None
+            if body_chunks and sizes["request"] <= MAX_CAPTURED_BODY:
+                try:
+                    body = json.loads(b"".join(body_chunks))
+                except ValueError:
+                    body = None
+            headers = dict(scope.get("headers") or [])
+            self.capture.record({
+                "ts": started,
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status["code"],
+                "duration_ms": round((time.perf_counter() - clock) * 1000, 3),
+                "request_bytes": sizes["request"],
+                "response_bytes": sizes["response"],
+                "content_type": headers.get(b"content-type", b"").decode("latin-1"),
+                "body": body,
+                "annotations": annotations,
+            })
+
+
+def install_request_capture(app) -> Optional[RequestCapture]:
+    """環境変数で有効化されていればミドルウェアを登録する"""
+    capture = RequestCapture.from_env()
+    if capture:
+        app.add_middleware(RequestCaptureMiddleware, capture=capture)
+        logger.info(f"リクエスト記録を有効化: {capture.path} (sample_rate={capture.sample_rate})")
+    return capture
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+応答のエンコード選択と圧縮 - モバイル向けに MessagePack と gzip を使い分ける
+
+Accept ヘッダーに application/msgpack（または application/x-msgpack）を含むリクエストには
+構造化された応答を MessagePack で返し、それ以外は従来どおり JSON を返す。
+JSON は orjson があればそれで、なければ標準の json で直列化する。
+一定サイズ以上の応答は、Accept-Encoding に gzip を含む場合に圧縮する
+（Server-Sent Events などのストリーミング応答は逐次配信を妨げないよう圧縮しない）。
+
+    RESPONSE_GZIP_MIN_BYTES  圧縮する最小サイズ（既定 1024、0 で圧縮しない）
+    RESPONSE_GZIP_LEVEL      圧縮レベル（既定 6）
+
+msgpack / orjson はどちらも任意の依存で、インストールされていなければ JSON（標準ライブラリ）に戻る。
+"""
+
+import contextvars
+import gzip
+import json
+import logging
+import os
+from typing import Any, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from request_capture import annotate
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_ACCEPT = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+DEFAULT_GZIP_MIN_BYTES = 1024
+DEFAULT_GZIP_LEVEL = 6
+# 圧縮しても小さくならない、または逐次配信が必要な応答
+UNCOMPRESSED_TYPES = ("text/event-stream", "image/", "application/gzip", "application/zip")
+
+_preferred_media_type: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "response_media_type", default=JSON_MEDIA_TYPE
+)
+
+
+def negotiate(accept: str) -> str:
+    """Accept ヘッダーから応答形式を選ぶ（MessagePack を明示した場合だけ切り替える）"""
+    if msgpack is None or not accept:
+        return JSON_MEDIA_TYPE
+    for part in accept.split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        if media_type.lower() in MSGPACK_ACCEPT and "q=0" not in params:
+            return MSGPACK_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def _msgpack_default(value: Any) -> Any:
+    # jsonable_encoder を通った後に残るのは numpy の数値などに限られる
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def encode(content: Any, media_type: str = JSON_MEDIA_TYPE) -> bytes:
+    """応答本文を指定形式で直列化する（ベンチマークと共用）"""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(content, use_bin_type=True, default=_msgpack_default)
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class NegotiatedResponse(JSONResponse):
+    """処理中リクエストの Accept に合わせて JSON または MessagePack で返す応答"""
+
+    def __init__(self, content: Any, *args: Any, **kwargs: Any):
+        self.media_type = _preferred_media_type.get()
+        super().__init__(content, *args, **kwargs)
+        self.headers.setdefault("vary", "Accept")
+
+    def render(self, content: Any) -> bytes:
+        return encode(content, self.media_type)
+
+
+class ResponseEncodingMiddleware:
+    """ASGI ミドルウェア - 応答形式の選択と、一定サイズ以上の応答の gzip 圧縮"""
+
+    def __init__(self, app, min_bytes: int = DEFAULT_GZIP_MIN_BYTES, level: int = DEFAULT_GZIP_LEVEL):
+        self.app = app
+        self.min_bytes = min_bytes
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = {k.lower(): v for k, v in scope.get("headers") or []}
+        media_type = negotiate(headers.get(b"accept", b"").decode("latin-1"))
+        token = _preferred_media_type.set(media_type)
+        accepts_gzip = self.min_bytes > 0 and b"gzip" in headers.get(b"accept-encoding", b"")
+        if not accepts_gzip:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _preferred_media_type.reset(token)
+            return
+
+        start: Optional[dict] = None
+
+        async def compressing_send(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # 本文を見てから圧縮するか決める
+                return
+            if start is None:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            response_headers = [(k.lower(), v) for k, v in start["headers"]]
+            content_type = dict(response_headers).get(b"content-type", b"").decode("latin-1")
+            compressible = (
+                not message.get("more_body", False)
+                and len(body) >= self.min_bytes
+                and b"content-encoding" not in dict(response_headers)
+                and not content_type.startswith(UNCOMPRESSED_TYPES)
+            )
+            if compressible:
+                compressed = gzip.compress(body, compresslevel=self.level)
+                if len(compressed) < len(body):
+                    annotate(encoding=media_type, gzip_ratio=round(len(compressed) / len(body), 3))
+                    response_headers = [(k, v) for k, v in response_headers if k not in (b"content-length", b"vary")]
+                    vary = dict(start["headers"]).get(b"vary", b"")
+                    response_headers += [
+                        (b"content-encoding", b"gzip"),
+                        (b"content-length", str(len(compressed)).encode("latin-1")),
+                        (b"vary", b", ".join(v for v in (vary, b"Accept-Encoding") if v)),
+                    ]
+                    start = {**start, "headers": response_headers}
+                    message = {**message, "body": compressed}
+            await send(start)
+            start = None
+            await send(message)
+
+        try:
+            await self.app(scope, receive, compressing_send)
+        finally:
+            _preferred_media_type.reset(token)
+
+
+def install_response_encoding(app: FastAPI) -> None:
+    """以降に登録するエンドポイントの既定の応答形式と、圧縮ミドルウェアを設定する"""
+    app.router.default_response_class = NegotiatedResponse
+    app.add_middleware(
+        ResponseEncodingMiddleware,
+        min_bytes=int(os.environ.get("RESPONSE_GZIP_MIN_BYTES", DEFAULT_GZIP_MIN_BYTES)),
+        level=int(os.environ.get("RESPONSE_GZIP_LEVEL", DEFAULT_GZIP_LEVEL)),
+    )
+    if msgpack is None:
+        logger.info("msgpack が見つからないため、応答は JSON のみで返します")
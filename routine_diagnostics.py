@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+演技構成の規則チェック - 不足・無駄になっている要素と失う点数を決定的に求める
+
+difficulty_calculation_system.md の規則（各グループ最低1技・同一グループは最大4技まで有効・
+上位8技のみ価値点対象・終末技は最後に実施・C難度以上の終末技で着地加点対象）と
+dscore.py の採点で、違反ごとの機械可読なコードと点数への影響を返す。LLM は使わない。
+"""
+
+import time
+import unicodedata
+from dataclasses import replace
+from typing import Dict, List, Sequence
+
+from dscore import APPARATUS_RULES, RoutineSkill, calculate_d_score, group_bonus_for
+from skill_catalog import GROUP_ROMAN, LETTER_VALUES
+
+# 同一グループで価値点の対象になる最大技数
+MAX_SKILLS_PER_GROUP = 4
+# 終末技のグループ（床・跳馬以外）
+DISMOUNT_GROUP = 4
+# 着地加点（7-2条第9項）の対象になる最低難度と加点
+STICK_BONUS_MIN_VALUE = LETTER_VALUES["C"]
+STICK_BONUS = 0.1
+# 着地加点のない種目
+NO_STICK_BONUS_APPARATUS = ("FX", "PH", "VT")
+
+SEVERITY_ERROR = "error"      # 点数を失っている、または規則上無効な点数を数えている
+SEVERITY_WARNING = "warning"  # 点数にはならないが実施の負担になっている
+
+_EPS = 1e-9
+
+
+def _normalize_name(name: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", name).split())
+
+
+def _violation(code: str, severity: str, message: str, point_cost: float = 0.0,
+               positions: Sequence[int] = (), groups: Sequence[int] = (), overstated_by: float = 0.0) -> Dict:
+    return {
+        "code": code,
+        "severity": severity,
+        "point_cost": round(point_cost, 2),
+        "overstated_by": round(overstated_by, 2),
+        "positions": list(positions),
+        "groups": list(groups),
+        "message": message,
+    }
+
+
+def _capped_difficulty(skills: Sequence[RoutineSkill], count_limit: int) -> float:
+    """同一グループ最大4技の制限を守って選んだ場合の難度点"""
+    per_group: Dict[int, int] = {}
+    total = 0.0
+    chosen = 0
+    for skill in sorted(skills, key=lambda s: -s.value):
+        if chosen >= count_limit:
+            break
+        if per_group.get(skill.group, 0) >= MAX_SKILLS_PER_GROUP:
+            continue
+        per_group[skill.group] = per_group.get(skill.group, 0) + 1
+        total += skill.value
+        chosen += 1
+    return total
+
+
+def diagnose_routine(apparatus: str, skills: Sequence[RoutineSkill]) -> Dict:
+    """違反の一覧と、違反がなかった場合に取れた点数の合計（point_cost）を返す
+
+    d_score はアプリの計算（同一グループ4技の制限なし）と同じ値のため、制限を超えて数えた分は
+    失点ではなく「Dスコアが過大になっている点数」（overstated_by）として別に返す。
+    """
+    started = time.perf_counter()
+    rules = APPARATUS_RULES[apparatus]
+    score = calculate_d_score(apparatus, skills)
+    counted = set(score["counted_skills"])
+    violations: List[Dict] = []
+
+    if apparatus != "VT":
+        count_limit = int(rules["count_limit"])
+        present = {s.group for s in skills}
+
+        # グループ要求: 各グループ最低1技（C難度の技を1つ加えた場合に得られるグループボーナスを失点とする）
+        for group in range(1, int(rules["groups_required"]) + 1):
+            if group not in present:
+                violations.append(_violation(
+                    "missing_group", SEVERITY_ERROR,
+                    f"グループ{GROUP_ROMAN[group]}の技がありません",
+                    point_cost=group_bonus_for(apparatus, group, STICK_BONUS_MIN_VALUE),
+                    groups=[group],
+                ))
+
+        # 2回目以降の同じ技（過大分は repeated_skill で数えるため、グループの制限は異なる技だけで見る）
+        seen: Dict[str, int] = {}
+        repeated = []
+        for i, skill in enumerate(skills):
+            key = _normalize_name(skill.name)
+            if key and key in seen:
+                repeated.append(i)
+            seen.setdefault(key, i)
+        distinct_counted = [i for i in sorted(counted) if i not in repeated]
+
+        # 同一グループは最大4技まで有効（d_score は5技目以降も数えているので、その分だけ過大）
+        per_group: Dict[int, List[int]] = {}
+        for i in distinct_counted:
+            per_group.setdefault(skills[i].group, []).append(i)
+        over_cap = {g: members for g, members in per_group.items() if len(members) > MAX_SKILLS_PER_GROUP}
+        if over_cap:
+            difficulty = sum(skills[i].value for i in distinct_counted)
+            distinct = [s for i, s in enumerate(skills) if i not in repeated]
+            overstated = max(0.0, difficulty - _capped_difficulty(distinct, count_limit))
+            for group, members in over_cap.items():
+                excess = sorted(members, key=lambda i: -skills[i].value)[MAX_SKILLS_PER_GROUP:]
+                violations.append(_violation(
+                    "group_cap_exceeded", SEVERITY_ERROR,
+                    f"グループ{GROUP_ROMAN.get(group, group)}から{len(members)}技を数えていますが有効は{MAX_SKILLS_PER_GROUP}技までです"
+                    f"（Dスコアは規則上{overstated:.1f}点過大）",
+                    positions=excess,
+                    groups=[group],
+                    overstated_by=overstated,
+                ))
+                overstated = 0.0  # 過大分は1回だけ計上する
+
+        # 上位8技に入らない技
+        uncounted = [i for i in range(len(skills)) if i not in counted]
+        if uncounted:
+            violations.append(_violation(
+                "uncounted_skills", SEVERITY_WARNING,
+                f"{len(uncounted)}技が価値点の対象外です（上位{count_limit}技のみ有効）",
+                positions=uncounted,
+            ))
+
+        # 同じ技の繰り返しは1回しか数えない（d_score は2回目以降も数えているので、その分だけ過大）
+        if repeated:
+            # 2回目以降を価値点0として数え直した Dスコアとの差（代わりに数えられる技があればその分を含む）
+            revalued = [replace(s, value=0.0) if i in repeated else s for i, s in enumerate(skills)]
+            overstated = max(0.0, score["total_d_score"] - calculate_d_score(apparatus, revalued)["total_d_score"])
+            note = f"Dスコアは規則上{overstated:.1f}点過大" if overstated > _EPS else "2回目以降は価値点にならない"
+            violations.append(_violation(
+                "repeated_skill", SEVERITY_ERROR,
+                f"同じ技を繰り返しています（{note}）",
+                positions=repeated,
+                overstated_by=overstated,
+            ))
+
+        # 短い演技の減点
+        if score["neutral_deductions"] > 0:
+            violations.append(_violation(
+                "short_routine", SEVERITY_ERROR,
+                f"技数が{len(skills)}技のため減点されます",
+                point_cost=score["neutral_deductions"],
+            ))
+
+    if apparatus not in ("FX", "VT") and skills:
+        dismounts = [i for i, s in enumerate(skills) if s.group == DISMOUNT_GROUP]
+        last = len(skills) - 1
+        if dismounts and skills[last].group != DISMOUNT_GROUP:
+            best = max(skills[i].value for i in dismounts)
+            violations.append(_violation(
+                "dismount_not_last", SEVERITY_ERROR,
+                "終末技（グループⅣ）が演技の最後にありません",
+                point_cost=group_bonus_for(apparatus, DISMOUNT_GROUP, best),
+                positions=dismounts,
+                groups=[DISMOUNT_GROUP],
+            ))
+        elif (apparatus not in NO_STICK_BONUS_APPARATUS and skills[last].group == DISMOUNT_GROUP
+              and skills[last].value < STICK_BONUS_MIN_VALUE - _EPS):
+            violations.append(_violation(
+                "weak_dismount", SEVERITY_WARNING,
+                "終末技がC難度未満のため着地加点（+0.1）の対象になりません",
+                point_cost=STICK_BONUS,
+                positions=[last],
+                groups=[DISMOUNT_GROUP],
+            ))
+
+    return {
+        "apparatus": apparatus,
+        "d_score": score["total_d_score"],
+        "breakdown": {
+            "difficulty": score["difficulty_value"],
+            "group_bonus": score["group_bonus"],
+            "connection_bonus": score["connection_bonus"],
+            "neutral_deductions": score["neutral_deductions"],
+        },
+        "fulfilled_groups": score["fulfilled_groups"],
+        "required_groups": score["required_groups"],
+        "counted_skills": score["counted_skills"],
+        "violations": violations,
+        "total_point_cost": round(sum(v["point_cost"] for v in violations), 2),
+        "d_score_overstated_by": round(sum(v["overstated_by"] for v in violations), 2),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def format_diagnostics(skills: Sequence[RoutineSkill], diagnostics: Dict) -> str:
+    """分析プロンプト用の簡潔な構成と診断（対象外の技には × を付ける）"""
+    counted = set(diagnostics["counted_skills"])
+    listing = " / ".join(
+        f"{i + 1}.{s.name}({s.value_letter or s.value}/{GROUP_ROMAN.get(s.group, s.group)}){'' if i in counted else '×'}"
+        for i, s in enumerate(skills)
+    )
+    b = diagnostics["breakdown"]
+    lines = [
+        f"D={diagnostics['d_score']}（難度{b['difficulty']}+G{b['group_bonus']}+連続{b['connection_bonus']}−ND{b['neutral_deductions']}）"
+        f" グループ{diagnostics['fulfilled_groups']}/{diagnostics['required_groups']}",
+        listing,
+    ]
+    for v in diagnostics["violations"]:
+        cost = f" −{v['point_cost']:.1f}" if v["point_cost"] else ""
+        if v["overstated_by"]:
+            cost += f" 過大+{v['overstated_by']:.1f}"
+        lines.append(f"- [{v['code']}]{cost} {v['message']}")
+    if not diagnostics["violations"]:
+        lines.append("- 規則違反なし")
+    return "\n".join(lines)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+演技構成の編集セッション - サーバー側で演技構成を保持し、差分で再採点する
+
+アプリでは1技ずつ追加・削除・入れ替えを行うため、編集操作（insert / replace / move / delete / connect）
+だけを受け取り、影響する項（難度点の合計、該当グループのボーナス、前後の連続技ペア）のみを更新する。
+レスポンスは前回の採点結果から変化した項目だけを返す。
+"""
+
+import bisect
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from dscore import (
+    APPARATUS_RULES, MAX_CONNECTION_BONUS, RoutineSkill, group_bonus, group_bonus_for,
+    neutral_deductions, pair_connection_bonus, select_counted_skills,
+)
+
+EDIT_OPERATIONS = ("insert", "replace", "move", "delete", "connect")
+
+
+def connections_from_groups(connection_groups: Sequence[int], skill_count: int) -> List[bool]:
+    """アプリの連続技グループID（0は単独）を隣接ペアごとの連続フラグに変換する"""
+    groups = list(connection_groups) + [0] * max(0, skill_count - len(connection_groups))
+    return [groups[i] != 0 and groups[i] == groups[i + 1] for i in range(skill_count - 1)]
+
+
+@dataclass
+class RoutineSession:
+    """1演技構成分の状態と、差分更新用の中間値"""
+    id: str
+    apparatus: str
+    skills: List[RoutineSkill] = field(default_factory=list)
+    connections: List[bool] = field(default_factory=list)
+    version: int = 0
+    updated_at: float = field(default_factory=time.time)
+    result: Dict[str, Any] = field(default_factory=dict)
+    # 差分更新用の中間値
+    _pair_bonuses: List[float] = field(default_factory=list)
+    _group_values: Dict[int, List[float]] = field(default_factory=dict)
+    _group_terms: Dict[int, float] = field(default_factory=dict)
+    _value_sum: float = 0.0
+
+    def rebuild(self) -> None:
+        """中間値を一から作り直す（セッション作成時のみ）"""
+        self._pair_bonuses = [self._pair_bonus(i) for i in range(len(self.skills) - 1)]
+        self._group_values = {}
+        self._value_sum = 0.0
+        for skill in self.skills:
+            self._add_value(skill)
+        self._group_terms = {
+            group: group_bonus_for(self.apparatus, group, values[-1])
+            for group, values in self._group_values.items()
+        }
+        self.result = self._compose_result()
+
+    # --- 中間値の更新 ---
+
+    def _pair_bonus(self, i: int) -> float:
+        if not self.connections[i]:
+            return 0.0
+        a, b = self.skills[i], self.skills[i + 1]
+        return pair_connection_bonus(self.apparatus, a.group, a.value, b.group, b.value)
+
+    def _refresh_pairs(self, *positions: int) -> None:
+        for i in set(positions):
+            if 0 <= i < len(self._pair_bonuses):
+                self._pair_bonuses[i] = self._pair_bonus(i)
+
+    def _add_value(self, skill: RoutineSkill) -> None:
+        bisect.insort(self._group_values.setdefault(skill.group, []), skill.value)
+        self._value_sum += skill.value
+
+    def _remove_value(self, skill: RoutineSkill) -> None:
+        values = self._group_values[skill.group]
+        del values[bisect.bisect_left(values, skill.value)]
+        if not values:
+            del self._group_values[skill.group]
+        self._value_sum -= skill.value
+
+    def _refresh_groups(self, *groups: int) -> None:
+        for group in set(groups):
+            values = self._group_values.get(group)
+            if values:
+                self._group_terms[group] = group_bonus_for(self.apparatus, group, values[-1])
+            else:
+                self._group_terms.pop(group, None)
+
+    # --- 編集操作 ---
+
+    def insert(self, index: int, skill: RoutineSkill, connected: bool = False) -> None:
+        """index の位置に技を挿入する（connected は直前の技との連続）"""
+        index = max(0, min(index, len(self.skills)))
+        self.skills.insert(index, skill)
+        if len(self.skills) > 1:
+            # 挿入位置の前のペアを分割し、新しい技の前後にペアを作る
+            if index == 0:
+                self.connections.insert(0, False)
+                self._pair_bonuses.insert(0, 0.0)
+            else:
+                self.connections.insert(index - 1, connected)
+                self._pair_bonuses.insert(index - 1, 0.0)
+                if index < len(self.skills) - 1:
+                    self.connections[index] = self.connections[index] and connected
+        self._add_value(skill)
+        self._refresh_groups(skill.group)
+        self._refresh_pairs(index - 1, index)
+
+    def delete(self, index: int) -> RoutineSkill:
+        self._check_index(index)
+        skill = self.skills.pop(index)
+        if self.connections:
+            # 削除した技の前後ペアは、前の技から次の技へのペアにまとめる
+            pair = index if index < len(self.connections) else index - 1
+            if 0 < index < len(self.connections):
+                self.connections[index - 1] = self.connections[index - 1] and self.connections[index]
+            del self.connections[pair]
+            del self._pair_bonuses[pair]
+        self._remove_value(skill)
+        self._refresh_groups(skill.group)
+        self._refresh_pairs(index - 1)
+        return skill
+
+    def replace(self, index: int, skill: RoutineSkill) -> None:
+        self._check_index(index)
+        old = self.skills[index]
+        self.skills[index] = skill
+        self._remove_value(old)
+        self._add_value(skill)
+        self._refresh_groups(old.group, skill.group)
+        self._refresh_pairs(index - 1, index)
+
+    def move(self, source: int, target: int) -> None:
+        self._check_index(source)
+        self._check_index(target)
+        if source != target:
+            self.insert(target, self.delete(source))
+
+    def connect(self, index: int, connected: bool) -> None:
+        """index の技と次の技の連続を設定・解除する"""
+        if not 0 <= index < len(self.connections):
+            raise ValueError(f"連続を設定できない位置です: {index}")
+        self.connections[index] = connected
+        self._refresh_pairs(index)
+
+    def _check_index(self, index: int) -> None:
+        if not 0 <= index < len(self.skills):
+            raise ValueError(f"技の位置が範囲外です: {index}")
+
+    # --- 採点 ---
+
+    def _compose_result(self) -> Dict[str, Any]:
+        """中間値から calculate_d_score と同じ項目を組み立てる"""
+        n = len(self.skills)
+        count_limit = int(APPARATUS_RULES[self.apparatus]["count_limit"])
+        if n <= count_limit:
+            counted = list(range(n))
+            difficulty = self._value_sum
+            g_bonus = sum(self._group_terms.values())
+            fulfilled = len(self._group_values)
+        else:
+            # 技数上限を超える場合のみ対象技の選択をやり直す
+            counted = select_counted_skills(self.apparatus, self.skills)
+            counted_skills = [self.skills[i] for i in counted]
+            difficulty = sum(s.value for s in counted_skills)
+            g_bonus = group_bonus(self.apparatus, counted_skills)
+            fulfilled = len({s.group for s in counted_skills})
+        c_bonus = min(sum(self._pair_bonuses), MAX_CONNECTION_BONUS)
+        nd = neutral_deductions(self.apparatus, n) if n else 0.0
+        return {
+            "total_d_score": round(difficulty + g_bonus + c_bonus - nd, 3) if n else 0.0,
+            "difficulty_value": round(difficulty, 3),
+            "group_bonus": round(g_bonus, 3),
+            "connection_bonus": round(c_bonus, 3),
+            "neutral_deductions": nd,
+            "fulfilled_groups": fulfilled,
+            "required_groups": int(APPARATUS_RULES[self.apparatus]["groups_required"]) if n else 0,
+            "total_skills": n,
+            "counted_skills": counted,
+            "pair_bonuses": [round(b, 2) for b in self._pair_bonuses],
+        }
+
+    def rescore(self) -> Dict[str, Any]:
+        """再採点し、前回の結果から変化した項目のみを返す"""
+        previous = self.result
+        self.result = self._compose_result()
+        self.version += 1
+        self.updated_at = time.time()
+        changed = {key: value for key, value in self.result.items() if previous.get(key) != value}
+        if "pair_bonuses" in changed:
+            # ペアは変化した位置だけ返す
+            old_pairs = previous.get("pair_bonuses", [])
+            changed["pair_bonuses"] = {
+                i: bonus for i, bonus in enumerate(self.result["pair_bonuses"])
+                if i >= len(old_pairs) or old_pairs[i] != bonus
+            }
+            changed["pair_count"] = len(self.result["pair_bonuses"])
+        return changed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.id,
+            "apparatus": self.apparatus,
+            "version": self.version,
+            "skills": [s.name for s in self.skills],
+            "connections": list(self.connections),
+            "result": self.result,
+        }
+
+
+class RoutineSessionStore:
+    """編集セッションの保持（一定時間操作のないセッションは破棄）"""
+
+    def __init__(self, ttl_seconds: float = 1800.0, max_sessions: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.sessions: Dict[str, RoutineSession] = {}
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        expired = [sid for sid, s in self.sessions.items() if now - s.updated_at > self.ttl_seconds]
+        for sid in expired:
+            del self.sessions[sid]
+
+    def create(self, apparatus: str, skills: List[RoutineSkill], connections: Optional[List[bool]] = None) -> RoutineSession:
+        if apparatus not in APPARATUS_RULES:
+            raise ValueError(f"未対応の種目です: {apparatus}")
+        self._purge_expired()
+        if len(self.sessions) >= self.max_sessions:
+            raise RuntimeError("セッション数が上限に達しています")
+        pair_count = max(0, len(skills) - 1)
+        flags = list(connections or [])[:pair_count]
+        flags += [False] * (pair_count - len(flags))
+        session = RoutineSession(id=uuid.uuid4().hex, apparatus=apparatus, skills=list(skills), connections=flags)
+        session.rebuild()
+        self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str) -> Optional[RoutineSession]:
+        self._purge_expired()
+        return self.sessions.get(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        return self.sessions.pop(session_id, None) is not None
+
+
+def apply_edit(session: RoutineSession, op: str, index: int = 0, target: Optional[int] = None,
+               skill: Optional[RoutineSkill] = None, connected: bool = False) -> None:
+    """編集操作を1件適用する（不正な操作は ValueError）"""
+    if op == "insert":
+        if skill is None:
+            raise ValueError("insert には skill が必要です")
+        session.insert(index, skill, connected)
+    elif op == "replace":
+        if skill is None:
+            raise ValueError("replace には skill が必要です")
+        session.replace(index, skill)
+    elif op == "move":
+        if target is None:
+            raise ValueError("move には target が必要です")
+        session.move(index, target)
+    elif op == "delete":
+        session.delete(index)
+    elif op == "connect":
+        session.connect(index, connected)
+    else:
+        raise ValueError(f"未対応の編集操作です: {op}")
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+サンプリングプロファイラ - 稼働中インスタンスの CPU 時間の内訳を取る
+
+環境変数 PROFILE_DIR を設定したときだけ有効になる（未設定ならミドルウェアも
+エンドポイントも登録しないため、無効時のオーバーヘッドはない）。
+有効時はバックグラウンドスレッドが一定間隔でイベントループと to_thread のワーカーの
+スタックを採取し、collapsed-stack（flamegraph.pl / speedscope 互換）または
+speedscope JSON として保存する。
+
+    PROFILE_DIR            出力先ディレクトリ（例: profiles）
+    PROFILE_SAMPLE_RATE    プロファイルするリクエストの割合（0.0〜1.0、既定 0.0）
+    PROFILE_INTERVAL_MS    採取間隔（既定 5ms）
+    PROFILE_FLUSH_SECONDS  リクエスト単位の採取結果を書き出す間隔（既定 60 秒）
+    PROFILE_ADMIN_TOKEN    管理エンドポイント用トークン（未設定なら管理エンドポイントなし）
+
+管理エンドポイント（X-Admin-Token ヘッダー必須）:
+
+    POST /admin/profile?seconds=10&format=speedscope  指定秒数だけ採取して結果を返す
+    GET  /admin/profiles                              保存済みファイルの一覧
+    GET  /admin/profiles/{name}                       保存済みファイルのダウンロード
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+
+logger = logging.getLogger(__name__)
+
+FORMAT_COLLAPSED = "collapsed"
+FORMAT_SPEEDSCOPE = "speedscope"
+FILE_EXTENSIONS = {FORMAT_COLLAPSED: ".collapsed.txt", FORMAT_SPEEDSCOPE: ".speedscope.json"}
+
+MAX_STACK_DEPTH = 128
+MAX_WINDOW_SECONDS = 120.0
+# これらの関数で止まっているスタックは待機中とみなし、CPU 時間に数えない
+IDLE_LEAVES = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get"), ("thread.py", "_worker")}
+
+Frame = Tuple[str, str, int]
+
+
+def _frame_key(frame) -> Frame:
+    code = frame.f_code
+    return code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+
+
+def _walk_stack(frame) -> Tuple[Frame, ...]:
+    """根から葉の順のフレーム列"""
+    frames: List[Frame] = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        frames.append(_frame_key(frame))
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+class StackProfile:
+    """採取したスタックの集計"""
+
+    def __init__(self, name: str, interval: float):
+        self.name = name
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.started_at = time.time()
+        self.ended_at: Optional[float] = None
+
+    def add(self, thread_name: str, stack: Tuple[Frame, ...]) -> None:
+        leaf = stack[-1] if stack else None
+        if leaf and (leaf[1], leaf[0]) in IDLE_LEAVES:
+            self.idle += 1
+            return
+        self.counts[(thread_name,) + stack] += 1
+        self.samples += 1
+
+    def to_collapsed(self) -> str:
+        lines = []
+        for stack, count in self.counts.most_common():
+            thread_name, frames = stack[0], stack[1:]
+            labels = [thread_name] + [f"{name} ({file}:{line})" for name, file, line in frames]
+            lines.append(f"{';'.join(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self) -> Dict[str, Any]:
+        frame_index: Dict[Any, int] = {}
+        frames: List[Dict[str, Any]] = []
+        samples: List[List[int]] = []
+        weights: List[float] = []
+        interval_ms = self.interval * 1000
+        for stack, count in self.counts.most_common():
+            indices = []
+            for key in ((stack[0], "", 0),) + stack[1:]:
+                if key not in frame_index:
+                    frame_index[key] = len(frames)
+                    name, file, line = key
+                    frames.append({"name": name, "file": file, "line": line} if file else {"name": name})
+                indices.append(frame_index[key])
+            samples.append(indices)
+            weights.append(round(count * interval_ms, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "sampling_profiler",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+    def render(self, fmt: str) -> str:
+        if fmt == FORMAT_SPEEDSCOPE:
+            return json.dumps(self.to_speedscope(), ensure_ascii=False)
+        return self.to_collapsed()
+
+    def write(self, directory: str, fmt: str) -> str:
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        path = os.path.join(directory, f"{self.name}-{stamp}-{os.getpid()}{FILE_EXTENSIONS[fmt]}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.render(fmt))
+        return path
+
+
+class SamplingProfiler:
+    """採取スレッドと、リクエスト単位・時間窓単位の集計先"""
+
+    def __init__(self, directory: str, interval: float = 0.005, sample_rate: float = 0.0,
+                 flush_seconds: float = 60.0, admin_token: Optional[str] = None):
+        self.directory = directory
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.flush_seconds = flush_seconds
+        self.admin_token = admin_token
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sinks: List[StackProfile] = []
+        self._loop_thread_id: Optional[int] = None
+        self._active_requests = 0
+        self._request_profile: Optional[StackProfile] = None
+        self._last_flush = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["SamplingProfiler"]:
+        directory = os.getenv("PROFILE_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0.0")),
+            flush_seconds=float(os.getenv("PROFILE_FLUSH_SECONDS", "60")),
+            admin_token=os.getenv("PROFILE_ADMIN_TOKEN") or None,
+        )
+
+    def sampled(self) -> bool:
+        return self.sample_rate > 0 and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+
+    def _attach(self, profile: StackProfile) -> None:
+        # 呼び出し元（イベントループのスレッド）を採取対象にする
+        self._loop_thread_id = threading.get_ident()
+        with self._lock:
+            self._sinks.append(profile)
+        self._wake.set()
+
+    def _detach(self, profile: StackProfile) -> None:
+        with self._lock:
+            if profile in self._sinks:
+                self._sinks.remove(profile)
+            if not self._sinks:
+                self._wake.clear()
+        profile.ended_at = time.time()
+
+    def begin_request(self) -> None:
+        with self._lock:
+            self._active_requests += 1
+            if self._request_profile is None:
+                self._request_profile = StackProfile("requests", self.interval)
+            profile = self._request_profile
+            attached = profile in self._sinks
+        if not attached:
+            self._attach(profile)
+
+    def end_request(self) -> None:
+        with self._lock:
+            self._active_requests -= 1
+            idle = self._active_requests == 0
+            profile = self._request_profile
+        if idle and profile is not None:
+            self._detach(profile)
+
+    def flush_requests(self, force: bool = False) -> Optional[str]:
+        """リクエスト単位の採取結果をファイルに書き出して集計をやり直す"""
+        with self._lock:
+            profile = self._request_profile
+            if profile is None or not profile.samples:
+                return None
+            if not force and time.monotonic() - self._last_flush < self.flush_seconds:
+                return None
+            self._last_flush = time.monotonic()
+            replacement = StackProfile("requests", self.interval)
+            self._request_profile = replacement
+            if profile in self._sinks:
+                self._sinks[self._sinks.index(profile)] = replacement
+        profile.ended_at = time.time()
+        try:
+            return profile.write(self.directory, FORMAT_COLLAPSED)
+        except OSError as e:
+            logger.error(f"プロファイルの書き込みエラー: {e}")
+            return None
+
+    async def profile_window(self, seconds: float, name: str = "window") -> StackProfile:
+        """指定秒数のあいだ全リクエストを対象に採取する"""
+        profile = StackProfile(name, self.interval)
+        self._attach(profile)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._detach(profile)
+        return profile
+
+    def _target_threads(self) -> Dict[int, str]:
+        targets = {}
+        for thread in threading.enumerate():
+            # asyncio.to_thread の既定ワーカーは asyncio_N という名前になる
+            if thread.ident == self._loop_thread_id:
+                targets[thread.ident] = "event-loop"
+            elif thread.name.startswith("asyncio_"):
+                targets[thread.ident] = thread.name
+        return targets
+
+    def _sample(self, sinks: List[StackProfile]) -> None:
+        frames = sys._current_frames()
+        for ident, thread_name in self._target_threads().items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = _walk_stack(frame)
+            for sink in sinks:
+                sink.add(thread_name, stack)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(timeout=self.flush_seconds)
+            with self._lock:
+                sinks = list(self._sinks)
+            if sinks:
+                self._sample(sinks)
+                time.sleep(self.interval)
+            self.flush_requests()
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(tuple(FILE_EXTENSIONS.values())):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append({"name": name, "bytes": stat.st_size, "modified": stat.st_mtime})
+        return sorted(files, key=lambda f: f["modified"], reverse=True)
+
+
+class ProfilingMiddleware:
+    """抽出したリクエストの処理中だけ採取する（ASGI ミドルウェア）"""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.sampled():
+            await self.app(scope, receive, send)
+            return
+        self.profiler.begin_request()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.end_request()
+
+
+def _install_admin_endpoints(app: FastAPI, profiler: SamplingProfiler) -> None:
+    def authorize(token: Optional[str]) -> None:
+        if not token or not hmac.compare_digest(token, profiler.admin_token):
+            raise HTTPException(status_code=403, detail="管理トークンが正しくありません")
+
+    @app.post("/admin/profile")
+    async def admin_profile(seconds: float = 10.0, format: str = FORMAT_COLLAPSED,
+                            x_admin_token: Optional[str] = Header(None)):
+        """指定秒数だけ採取し、保存したうえで結果を返す"""
+        authorize(x_admin_token)
+        if format not in FILE_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"format は {', '.join(FILE_EXTENSIONS)} のいずれかです")
+        if not 0 < seconds <= MAX_WINDOW_SECONDS:
+            raise HTTPException(status_code=400, detail=f"seconds は 0〜{MAX_WINDOW_SECONDS:.0f} の範囲で指定してください")
+        profile = await profiler.profile_window(seconds)
+        path = await asyncio.to_thread(profile.write, profiler.directory, format)
+        headers = {"Content-Disposition": f'attachment; filename="{os.path.basename(path)}"'}
+        if format == FORMAT_SPEEDSCOPE:
+            return JSONResponse(profile.to_speedscope(), headers=headers)
+        return PlainTextResponse(profile.to_collapsed(), headers=headers)
+
+    @app.get("/admin/profiles")
+    async def admin_profiles(x_admin_token: Optional[str] = Header(None)):
+        """保存済みプロファイルの一覧"""
+        authorize(x_admin_token)
+        profiler.flush_requests(force=True)
+        return {"directory": profiler.directory, "sample_rate": profiler.sample_rate, "files": profiler.list_files()}
+
+    @app.get("/admin/profiles/{name}")
+    async def admin_profile_file(name: str, x_admin_token: Optional[str] = Header(None)):
+        """保存済みプロファイルのダウンロード"""
+        authorize(x_admin_token)
+        if name != os.path.basename(name) or not name.endswith(tuple(FILE_EXTENSIONS.values())):
+            raise HTTPException(status_code=400, detail="ファイル名が不正です")
+        path = os.path.join(profiler.directory, name)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="プロファイルが見つかりません")
+        return FileResponse(path, filename=name)
+
+
+def install_profiler(app: FastAPI) -> Optional[SamplingProfiler]:
+    """環境変数で有効化されていればミドルウェアと管理エンドポイントを登録する"""
+    profiler = SamplingProfiler.from_env()
+    if not profiler:
+        return None
+    if profiler.sample_rate > 0:
+        app.add_middleware(ProfilingMiddleware, profiler=profiler)
+    if profiler.admin_token:
+        _install_admin_endpoints(app, profiler)
+    logger.info(f"サンプリングプロファイラを有効化: {profiler.directory} (sample_rate={profiler.sample_rate})")
+    return profiler
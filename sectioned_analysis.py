@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+セクション分割の演技分析 - 5項目を並行に生成して順番どおりに合成する
+
+/analyze_routine の5項目（内訳・グループ要求・連続技・高得点化提案・リスク分析）のうち、
+規則チェックと連続技行列で決まる3項目はローカルで組み立て、LLM を使わない。
+残りの2項目は項目ごとに小さなコンテキストと出力上限で同時に問い合わせるため、
+全体の待ち時間は最も遅い項目の時間に近づく。完了した項目から順に受け取ることもできる。
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from dscore import RoutineSkill
+from skill_catalog import GROUP_ROMAN
+from token_budget import MIN_OUTPUT_TOKENS
+
+SOURCE_LOCAL = "local"
+SOURCE_LLM = "llm"
+SOURCE_FALLBACK = "fallback"
+
+# Dスコアに含まれているが規則上は無効な技の説明（違反コード → 説明）
+OVERSTATED_REASONS = {
+    "group_cap_exceeded": "同一グループ5技目以降",
+    "repeated_skill": "繰り返した技",
+}
+
+
+@dataclass
+class SectionContext:
+    """各項目の組み立てに使う、計算済みの材料"""
+    apparatus: str
+    apparatus_name: str
+    skills: List[RoutineSkill]
+    diagnostics: Dict
+    connections: Dict
+    simulation_summary: str = ""
+    alternatives: str = ""
+    message: str = ""
+
+
+@dataclass
+class Section:
+    key: str
+    title: str
+    render: Optional[Callable[[SectionContext], str]] = None  # ローカルで組み立てる項目
+    prompt: Optional[Callable[[SectionContext], str]] = None  # LLM に問い合わせる項目
+    fallback: Optional[Callable[[SectionContext], str]] = None  # LLM を使えないときの代替
+    max_tokens: int = 0
+    knowledge_query: str = ""
+
+
+@dataclass
+class SectionResult:
+    index: int
+    key: str
+    title: str
+    text: str
+    source: str
+    elapsed_ms: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "index": self.index,
+            "key": self.key,
+            "title": self.title,
+            "text": self.text,
+            "source": self.source,
+            "elapsed_ms": self.elapsed_ms,
+        }
+
+
+def _render_breakdown(ctx: SectionContext) -> str:
+    d = ctx.diagnostics
+    b = d["breakdown"]
+    counted = [ctx.skills[i] for i in d["counted_skills"]]
+    lines = [
+        f"Dスコア {d['d_score']}点 = 難度点 {b['difficulty']} + グループボーナス {b['group_bonus']}"
+        f" + 連続技ボーナス {b['connection_bonus']} − ND減点 {b['neutral_deductions']}",
+        f"難度点の対象（{len(counted)}技）: " + "、".join(f"{s.name}({s.value_letter or s.value})" for s in counted),
+    ]
+    if d["total_point_cost"]:
+        lines.append(f"規則上失っている点数の合計: {d['total_point_cost']}点（詳細はグループ要求の項目）")
+    if d.get("d_score_overstated_by"):
+        reasons = "・".join(OVERSTATED_REASONS[v["code"]] for v in d["violations"] if v.get("overstated_by") and v["code"] in OVERSTATED_REASONS)
+        lines.append(f"規則上価値点にならない技（{reasons}）も数えているため、規則上のDスコアは{d['d_score_overstated_by']}点低くなります")
+    return "\n".join(lines)
+
+
+def _render_groups(ctx: SectionContext) -> str:
+    d = ctx.diagnostics
+    per_group: Dict[int, List[RoutineSkill]] = {}
+    for i in d["counted_skills"]:
+        per_group.setdefault(ctx.skills[i].group, []).append(ctx.skills[i])
+    lines = [f"充足グループ: {d['fulfilled_groups']}/{d['required_groups']}"]
+    for group in sorted(per_group):
+        best = max(per_group[group], key=lambda s: s.value)
+        lines.append(f"- グループ{GROUP_ROMAN.get(group, group)}: {len(per_group[group])}技（最高 {best.name} {best.value_letter or best.value}）")
+    for v in d["violations"]:
+        cost = f"（−{v['point_cost']:.1f}点）" if v["point_cost"] else ""
+        lines.append(f"⚠️ {v['message']}{cost}")
+    if not d["violations"]:
+        lines.append("規則違反はありません。")
+    return "\n".join(lines)
+
+
+def _render_connections(ctx: SectionContext) -> str:
+    c = ctx.connections
+    actual = ctx.diagnostics["breakdown"]["connection_bonus"]
+    lines = [f"現在の連続技ボーナス: {actual}点（上限0.4点）"]
+    eligible = [p for p in c["pairs"] if p["bonus"] > 0]
+    if eligible:
+        lines.append("ボーナス対象になる隣接ペア:")
+        lines += [f"- {p['position'] + 1}→{p['position'] + 2}: {p['from']} → {p['to']}（+{p['bonus']}）" for p in eligible]
+    else:
+        lines.append("現在の並びでボーナス対象になる隣接ペアはありません。")
+    optimized = c.get("optimized")
+    if optimized and optimized["gain"] > 0:
+        order = " → ".join(str(i + 1) for i in optimized["order"])
+        lines.append(f"並び替え提案: {order}（連続実施で +{optimized['gain']}点）")
+    return "\n".join(lines)
+
+
+def _improvement_prompt(ctx: SectionContext) -> str:
+    return f"""【種目】{ctx.apparatus_name}
+【規則チェック】
+{_render_groups(ctx)}
+
+{ctx.alternatives or '代替技候補: なし'}
+
+上記だけを根拠に「さらなる高得点化の具体的提案」を優先度順に3つまで、各2行以内で書いてください。
+点数の差分は候補に書かれた値をそのまま使い、新たに計算しないでください。
+{ctx.message}"""
+
+
+def _improvement_fallback(ctx: SectionContext) -> str:
+    return ctx.alternatives or "技カタログに代替技の候補がありません。"
+
+
+def _risk_prompt(ctx: SectionContext) -> str:
+    return f"""【種目】{ctx.apparatus_name}
+【Dスコア・シミュレーション（難度から推定した成功率）】
+{ctx.simulation_summary or 'データなし'}
+
+上記を根拠に「リスク分析と代替案」を、失敗時の影響が大きい技から順に3点まで、各2行以内で書いてください。"""
+
+
+def _risk_fallback(ctx: SectionContext) -> str:
+    return ctx.simulation_summary or "シミュレーション結果がありません。"
+
+
+SECTIONS: List[Section] = [
+    Section("breakdown", "1. 現在の点数の内訳", render=_render_breakdown),
+    Section("groups", "2. グループ要求の充足状況", render=_render_groups),
+    Section("connections", "3. 連続技ボーナス", render=_render_connections),
+    Section("improvements", "4. さらなる高得点化の提案", prompt=_improvement_prompt, fallback=_improvement_fallback,
+            max_tokens=450, knowledge_query="難度 グループ 改善"),
+    Section("risk", "5. リスク分析と代替案", prompt=_risk_prompt, fallback=_risk_fallback, max_tokens=350),
+]
+
+# generate(section, message, max_tokens) -> 生成文（LLM を使えない場合は None）
+Generator = Callable[[Section, str, int], Awaitable[Optional[str]]]
+
+
+async def _run_section(index: int, section: Section, ctx: SectionContext, generate: Generator,
+                       token_limit: Optional[int]) -> SectionResult:
+    started = time.perf_counter()
+    if section.render:
+        text, source = section.render(ctx), SOURCE_LOCAL
+    else:
+        max_tokens = section.max_tokens
+        if token_limit is not None:
+            max_tokens = min(max_tokens, max(token_limit, MIN_OUTPUT_TOKENS))
+        text = await generate(section, section.prompt(ctx), max_tokens)
+        source = SOURCE_LLM
+        if text is None:
+            text, source = section.fallback(ctx), SOURCE_FALLBACK
+    return SectionResult(index, section.key, section.title, text, source, round((time.perf_counter() - started) * 1000, 1))
+
+
+async def iter_sections(ctx: SectionContext, generate: Generator, token_limit: Optional[int] = None,
+                        sections: List[Section] = SECTIONS) -> AsyncIterator[SectionResult]:
+    """全項目を同時に開始し、完了した順に返す"""
+    tasks = [asyncio.create_task(_run_section(i, s, ctx, generate, token_limit)) for i, s in enumerate(sections)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def generate_sections(ctx: SectionContext, generate: Generator, token_limit: Optional[int] = None) -> List[SectionResult]:
+    """全項目を同時に生成し、項目順に並べて返す"""
+    results = [result async for result in iter_sections(ctx, generate, token_limit)]
+    return sorted(results, key=lambda r: r.index)
+
+
+def compose_sections(results: List[SectionResult]) -> str:
+    return "\n\n".join(f"## {r.title}\n{r.text}" for r in sorted(results, key=lambda r: r.index))
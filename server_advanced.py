@@ -1,21 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
 import json
-from typing import Dict, List, Optional
-import openai
-from openai import OpenAI
-
-app = FastAPI()
-
-# OpenAI APIキーの設定
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    print("警告: OPENAI_API_KEYが設定されていません。デモモードで動作します。")
-    openai_client = None
-else:
-    openai_client = OpenAI(api_key=openai_api_key)
+from typing import Dict, List, Optional, Set, Tuple
+
+from answer_store import AnswerStore, corpus_version
+from compact_corpus import resolve_corpus_file
+from corpus_partitions import PartitionedCorpus
+from fact_lookup import FactLookup
+from intent_matcher import MessageMatch, match_message
+from lifecycle import Lifecycle, create_openai_client, warm_openai_connection
+from local_answerer import LocalAnswerer
+from request_capture import annotate, install_request_capture
+from response_encoding import install_response_encoding
+from sampling_profiler import install_profiler
+from skill_linker import TABLES_FILE, SkillLinker, SkillMention
+from term_dictionary import TermDictionary
+from token_budget import TokenLedger, choose_max_tokens, classify_question, client_id_for, record_usage, start_usage
+
+# 読み込み・クライアント生成は lifespan で行う（/ready で完了を確認できる）
+LIFECYCLE = Lifecycle()
+app = FastAPI(lifespan=LIFECYCLE.lifespan)
+
+openai_client = None
+
+@LIFECYCLE.step("openai_client")
+def init_openai_client():
+    global openai_client
+    openai_client = create_openai_client()
+    if openai_client is None:
+        print("警告: OPENAI_API_KEYが設定されていません。デモモードで動作します。")
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,6 +39,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+install_response_encoding(app)
+install_request_capture(app)
+install_profiler(app)
+LIFECYCLE.install(app)
 
 class ChatMessage(BaseModel):
     message: str
@@ -46,7 +65,8 @@ def load_markdown_files():
     for file_path in md_files:
         try:
             if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
+                # compact_corpus.py で生成したコンパクト版があれば優先する
+                with open(resolve_corpus_file(file_path), 'r', encoding='utf-8') as f:
                     content = f.read()
                     knowledge_base[os.path.basename(file_path)] = content
                     print(f"✅ Loaded: {file_path}")
@@ -57,46 +77,106 @@ def load_markdown_files():
     
     return knowledge_base
 
-# グローバル変数
-KNOWLEDGE_BASE = load_markdown_files()
+# グローバル変数（起動ステップで設定）
+KNOWLEDGE_BASE: Dict[str, str] = {}
+CORPUS_PARTITIONS = PartitionedCorpus()
+SKILL_LINKER: Optional[SkillLinker] = None
+
+# 事前生成回答（precompute_answers.py で作成）
+CORPUS_VERSION = ""
+ANSWER_STORE = AnswerStore()
+
+@LIFECYCLE.step("knowledge_base")
+def init_knowledge_base():
+    global CORPUS_VERSION
+    KNOWLEDGE_BASE.update(load_markdown_files())
+    for file_name, content in KNOWLEDGE_BASE.items():
+        CORPUS_PARTITIONS.add(file_name, content)
+    CORPUS_VERSION = corpus_version(KNOWLEDGE_BASE)
+
+@LIFECYCLE.step("skill_linker")
+def init_skill_linker():
+    global SKILL_LINKER
+    SKILL_LINKER = SkillLinker.from_data()
+
+# 難度表から直接答えられる質問（D難度の価値点・グループの技一覧など）
+FACT_LOOKUP = FactLookup()
+
+@LIFECYCLE.step("fact_lookup")
+def init_fact_lookup():
+    global FACT_LOOKUP
+    FACT_LOOKUP = FactLookup.from_data()
+
+# 英語の質問を日本語の用語で検索するための対訳辞書（term_dictionary.py で生成）
+TERM_DICTIONARY = TermDictionary()
+
+@LIFECYCLE.step("term_dictionary")
+def init_term_dictionary():
+    global TERM_DICTIONARY
+    TERM_DICTIONARY = TermDictionary.from_file()
+
+# APIキーなし・上流障害時の抽出型回答
+LOCAL_ANSWERER: Optional[LocalAnswerer] = None
+
+@LIFECYCLE.step("local_answerer")
+def init_local_answerer():
+    global LOCAL_ANSWERER
+    LOCAL_ANSWERER = LocalAnswerer.from_data(linker=SKILL_LINKER, terms=TERM_DICTIONARY)
+
+@LIFECYCLE.step("answer_store")
+def init_answer_store():
+    ANSWER_STORE.load()
+
+@LIFECYCLE.warmup("openai_connection")
+def warm_openai():
+    warm_openai_connection(openai_client)
+
+# クライアントごとのトークン利用量
+TOKEN_LEDGER = TokenLedger.from_env()
 
 # キーワードベースの検索
-def search_knowledge(query: str) -> str:
+def search_knowledge(query: str, query_match: Optional[MessageMatch] = None, exclude_files: Optional[Set[str]] = None) -> str:
     query_lower = query.lower()
     relevant_info = []
     
-    # キーワードとファイルのマッピング
-    keyword_to_file = {
-        "連続技": ["d_score_master_knowledge.md"],
-        "組合せ": ["d_score_master_knowledge.md"],
-        "cv": ["d_score_master_knowledge.md"],
-        "nd": ["d_score_master_knowledge.md", "comprehensive_rulebook_analysis.md"],
-        "減点": ["comprehensive_rulebook_analysis.md"],
-        "ルール": ["comprehensive_rulebook_analysis.md", "rulebook_ja_summary.md"],
-        "難度": ["skills_difficulty_tables.md", "difficulty_calculation_system.md"],
-        "器具": ["apparatus_details.md"],
-        "種目": ["apparatus_details.md"],
-        "実装": ["ai_implementation_guide.md"]
-    }
+    # 関連ファイルを特定（共通キーワード表を1回の走査で照合）
+    if query_match is None:
+        query_match = match_message(query)
     
-    # 関連ファイルを検索
-    relevant_files = set()
-    for keyword, files in keyword_to_file.items():
-        if keyword in query_lower:
-            relevant_files.update(files)
+    # 種目が1つに特定できれば、その種目と共通の段落だけを検索する
+    apparatus = query_match.apparatus[0] if len(query_match.apparatus) == 1 else None
     
     # 関連情報を抽出
-    for file_name in relevant_files:
-        if file_name in KNOWLEDGE_BASE:
-            content = KNOWLEDGE_BASE[file_name]
+    for file_name in query_match.files:
+        if file_name in KNOWLEDGE_BASE and not (exclude_files and file_name in exclude_files):
             # 簡単な段落抽出（改良の余地あり）
-            paragraphs = content.split('\n\n')
-            for para in paragraphs:
+            for para in CORPUS_PARTITIONS.paragraphs(file_name, apparatus):
                 if any(keyword in para.lower() for keyword in query_lower.split()):
                     relevant_info.append(para[:500])  # 最初の500文字
     
     return '\n\n'.join(relevant_info[:3])  # 最大3段落
 
+def build_knowledge_context(message: str) -> Tuple[str, MessageMatch, List[SkillMention]]:
+    """質問から LLM に渡す知識コンテキストを組み立てる（/chat/message と事前生成で共有）"""
+    # 英語の用語・技名には日本語の表記を付け足して検索する（LLM へはもとの質問を渡す）
+    search_query = TERM_DICTIONARY.expand(message)
+    
+    # メッセージを1回だけ照合し、検索と応答選択で共有する
+    message_match = match_message(search_query)
+    
+    # 技名をカタログにリンクし、その技の正確な事実だけをコンテキストに入れる
+    skill_mentions = SKILL_LINKER.link(search_query, message_match.apparatus)
+    skill_facts = SKILL_LINKER.format_facts(skill_mentions)
+    
+    # 知識ベースから関連情報を検索（技が特定できた場合は難度表の段落検索を省く）
+    knowledge_context = search_knowledge(
+        search_query, message_match,
+        exclude_files={TABLES_FILE} if skill_mentions else None
+    )
+    if skill_facts:
+        knowledge_context = f"{skill_facts}\n\n{knowledge_context}".strip()
+    return knowledge_context, message_match, skill_mentions
+
 @app.get("/")
 async def root():
     return {"message": "Advanced Gymnastics AI Server", "status": "running", "knowledge_files": len(KNOWLEDGE_BASE)}
@@ -105,32 +185,47 @@ async def root():
 async def health_check():
     return {"status": "healthy", "loaded_files": list(KNOWLEDGE_BASE.keys())}
 
-async def get_ai_response(message: str, knowledge_context: str, context_data: dict = None) -> str:
+@app.get("/usage")
+async def usage(request: Request):
+    """呼び出し元クライアントのトークン利用量と残り予算"""
+    return TOKEN_LEDGER.snapshot(client_id_for(request))
+
+async def get_ai_response(message: str, knowledge_context: str, context_data: dict = None, max_tokens: Optional[int] = None) -> str:
     """OpenAI APIを使用してAI応答を生成"""
     if not openai_client:
         # デモモード：基本的なルールベース応答
         return generate_demo_response(message, knowledge_context, context_data)
     
     try:
-        # 演技構成データがある場合のコンテキスト情報を構築
-        context_info = ""
-        if context_data:
-            user_profile = context_data.get('user_profile', {})
-            current_routine = context_data.get('current_routine', {})
-            calculation_result = context_data.get('calculation_result', {})
-            
-            if current_routine and current_routine.get('skills'):
-                context_info += f"""
+        return request_completion(message, knowledge_context, context_data, max_tokens)
+    except Exception as e:
+        print(f"OpenAI API エラー: {e}")
+        return generate_demo_response(message, knowledge_context)
+
+def request_completion(message: str, knowledge_context: str, context_data: dict = None, max_tokens: Optional[int] = None) -> str:
+    """OpenAI API に問い合わせて応答本文を返す（失敗時は例外をそのまま送出する）"""
+    if max_tokens is None:
+        max_tokens = choose_max_tokens(classify_question(message, match_message(message), bool(context_data)))
+    
+    # 演技構成データがある場合のコンテキスト情報を構築
+    context_info = ""
+    if context_data:
+        user_profile = context_data.get('user_profile', {})
+        current_routine = context_data.get('current_routine', {})
+        calculation_result = context_data.get('calculation_result', {})
+        
+        if current_routine and current_routine.get('skills'):
+            context_info += f"""
 【現在の演技構成情報】
 種目: {current_routine.get('apparatus', 'N/A')}
 技数: {current_routine.get('total_skills', 0)}
 技構成:"""
-                for i, skill in enumerate(current_routine['skills'], 1):
-                    context_info += f"""
+            for i, skill in enumerate(current_routine['skills'], 1):
+                context_info += f"""
   {i}. {skill.get('name', 'N/A')} - {skill.get('difficulty_letter', 'N/A')}難度 ({skill.get('difficulty_value', 0)}点) - グループ{skill.get('group', 'N/A')}"""
-                
-                if calculation_result:
-                    context_info += f"""
+            
+            if calculation_result:
+                context_info += f"""
 
 【計算結果】
 - 総D-Score: {calculation_result.get('total_d_score', 0)}点
@@ -140,13 +235,13 @@ async def get_ai_response(message: str, knowledge_context: str, context_data: di
 - ND減点: {calculation_result.get('neutral_deductions', 0)}点
 - 充足グループ: {calculation_result.get('fulfilled_groups', [])}
 - 必要グループ: {calculation_result.get('required_groups', [])}"""
-                    
-                    if calculation_result.get('deduction_breakdown'):
-                        context_info += f"""
+                
+                if calculation_result.get('deduction_breakdown'):
+                    context_info += f"""
 - 減点詳細: {calculation_result['deduction_breakdown']}"""
 
-        # 体操競技専門AIコーチとしてのシステムプロンプト
-        system_prompt = f"""あなたは世界トップクラスの体操競技専門AIコーチです。
+    # 体操競技専門AIコーチとしてのシステムプロンプト
+    system_prompt = f"""あなたは世界トップクラスの体操競技専門AIコーチです。
 
 【あなたの専門性】
 - FIG公式採点規則のエキスパート
@@ -178,29 +273,30 @@ async def get_ai_response(message: str, knowledge_context: str, context_data: di
 - 分からない場合は正直に「確認が必要」と回答
 - ユーザーの技術レベルに合わせて説明の詳しさを調整"""
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message}
-            ],
-            max_tokens=800,
-            temperature=0.7,
-            presence_penalty=0.1,
-            frequency_penalty=0.1
-        )
-        
-        return response.choices[0].message.content
-        
-    except Exception as e:
-        print(f"OpenAI API エラー: {e}")
-        return generate_demo_response(message, knowledge_context)
+    response = openai_client.chat.completions.create(
+        model="gpt-4-turbo-preview",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": message}
+        ],
+        max_tokens=max_tokens,
+        temperature=0.7,
+        presence_penalty=0.1,
+        frequency_penalty=0.1
+    )
+    record_usage(response, max_tokens)
+    
+    return response.choices[0].message.content
 
 def generate_demo_response(message: str, knowledge_context: str, context_data: dict = None) -> str:
-    """デモモード用の応答生成"""
-    message_lower = message.lower()
+    """デモモード用の応答生成（知識ベースから回答を組み立てられない場合は定型文）"""
+    local_answer = LOCAL_ANSWERER.answer(message) if LOCAL_ANSWERER else None
+    if local_answer:
+        return local_answer.text
     
-    if "床" in message_lower or "fx" in message_lower:
+    message_match = match_message(message)
+    
+    if "FX" in message_match.apparatus:
         return f"""床運動について、体操AIコーチがお答えします。
 
 {knowledge_context}
@@ -213,7 +309,7 @@ def generate_demo_response(message: str, knowledge_context: str, context_data: d
 
 具体的にどのような情報をお求めでしょうか？技の詳細、演技構成、採点について詳しく説明できます。"""
     
-    elif "鉄棒" in message_lower or "hb" in message_lower:
+    elif "HB" in message_match.apparatus:
         return f"""鉄棒について、体操AIコーチがお答えします。
 
 {knowledge_context}
@@ -226,7 +322,7 @@ def generate_demo_response(message: str, knowledge_context: str, context_data: d
 
 どの技術について詳しく知りたいですか？カッシーナ、コールマン、コバチ等の具体的な技について説明できます。"""
     
-    elif "つり輪" in message_lower or "sr" in message_lower:
+    elif "SR" in message_match.apparatus:
         return f"""つり輪について、体操AIコーチがお答えします。
 
 {knowledge_context}
@@ -239,7 +335,7 @@ def generate_demo_response(message: str, knowledge_context: str, context_data: d
 
 具体的な技の習得方法や演技構成についてアドバイスいたします。どの技術について詳しく聞きたいですか？"""
     
-    elif "連続技" in message_lower or "接続" in message_lower:
+    elif "connection" in message_match.intents:
         return f"""連続技について、体操AIコーチが詳しく説明します。
 
 {knowledge_context}
@@ -271,30 +367,70 @@ def generate_demo_response(message: str, knowledge_context: str, context_data: d
 具体的にどのような情報をお求めでしょうか？"""
 
 @app.post("/chat/message")
-async def chat(data: ChatMessage):
+async def chat(data: ChatMessage, request: Request):
     message = data.message
     context_data = data.context
+    client_id = client_id_for(request)
+    usage = start_usage()
     
-    # 知識ベースから関連情報を検索
-    knowledge_context = search_knowledge(message)
+    # 頻出質問は事前生成回答を直接返す（演技構成コンテキスト付きの質問は対象外）
+    if not context_data:
+        precomputed = ANSWER_STORE.lookup(message, CORPUS_VERSION)
+        annotate(precomputed="hit" if precomputed else "miss")
+        if precomputed:
+            annotate(tier="precomputed")
+            return {
+                "response": precomputed,
+                "conversation_id": data.conversation_id or "adv_001",
+                **TOKEN_LEDGER.record(client_id, usage)
+            }
+        
+        # 難度表だけで答えられる質問は LLM を呼ばずに出典付きで返す
+        fact = FACT_LOOKUP.answer(message)
+        if fact:
+            annotate(tier="fact", fact_kind=fact.kind)
+            return {
+                "response": fact.text,
+                "conversation_id": data.conversation_id or "adv_001",
+                "sources": fact.sources,
+                **TOKEN_LEDGER.record(client_id, usage)
+            }
     
-    # OpenAI APIを使用して応答を生成
-    if openai_client:
+    knowledge_context, message_match, skill_mentions = build_knowledge_context(message)
+    annotate(linked_skills=len(skill_mentions), context_chars=len(knowledge_context))
+    
+    # OpenAI APIを使用して応答を生成（予算を使い切ったクライアントはデモ応答）
+    if openai_client and not TOKEN_LEDGER.exhausted(client_id):
+        max_tokens = choose_max_tokens(
+            classify_question(message, message_match, bool(context_data)),
+            TOKEN_LEDGER.remaining(client_id)
+        )
+        annotate(max_tokens=max_tokens)
         try:
-            response_text = await get_ai_response(message, knowledge_context, context_data)
+            response_text = await get_ai_response(message, knowledge_context, context_data, max_tokens)
+            annotate(tier="openai")
             return {
                 "response": response_text,
                 "conversation_id": data.conversation_id or "adv_001",
-                "usage_count": 1,
-                "remaining_count": -1
+                **TOKEN_LEDGER.record(client_id, usage)
             }
         except Exception as e:
             print(f"OpenAI API呼び出しエラー: {e}")
             # フォールバックとしてデモモードを使用
     
-    # デモモード：基本的な回答パターン
+    # 知識ベースから抽出型の回答を組み立てる
+    local_answer = LOCAL_ANSWERER.answer(message) if LOCAL_ANSWERER else None
+    if local_answer:
+        annotate(tier="local", local_ms=local_answer.elapsed_ms)
+        return {
+            "response": local_answer.text,
+            "conversation_id": data.conversation_id or "adv_001",
+            **TOKEN_LEDGER.record(client_id, usage)
+        }
+    
+    # デモモード：基本的な回答パターン（キーは intent_matcher の意図・種目）
     response_patterns = {
-        "連続技": f"""連続技について説明します。
+        "connection": f"""連続技について説明します。
 
 {knowledge_context}
 
@@ -304,7 +440,7 @@ FIG公式ルール：
 - D難度以上 + D難度以上 = +0.2点
 - D難度以上 + B/C難度 = +0.1点""",
         
-        "nd減点": f"""ND（ニュートラルディダクション）減点について：
+        "nd_deduction": f"""ND（ニュートラルディダクション）減点について：
 
 {knowledge_context}
 
@@ -314,7 +450,7 @@ FIG公式ルール：
 - 服装違反: 0.3点
 - コーチの違反: 0.5点""",
         
-        "つり輪": """つり輪の詳細情報：
+        "SR": """つり輪の詳細情報：
 
 【D難度技（0.4点）】
 - 中水平（2秒静止）
@@ -334,7 +470,7 @@ FIG公式ルール：
 - 肩の高さまでの振動は減点なし
 - 力技と振動技のバランスが重要""",
         
-        "演技構成分析": """演技構成分析について説明します。
+        "routine_analysis": """演技構成分析について説明します。
 
 分析のポイント：
 1. 技の難度配分（A〜J）
@@ -350,13 +486,14 @@ FIG公式ルール：
     }
     
     # メッセージに応じた回答を生成
-    for keyword, response_template in response_patterns.items():
-        if keyword in message:
+    annotate(tier="demo")
+    matched_labels = message_match.intents.union(message_match.apparatus)
+    for label, response_template in response_patterns.items():
+        if label in matched_labels:
             return {
                 "response": response_template,
                 "conversation_id": data.conversation_id or "adv_001",
-                "usage_count": 1,
-                "remaining_count": -1
+                **TOKEN_LEDGER.record(client_id, usage)
             }
     
     # デフォルト回答（知識ベースを使用）
@@ -381,8 +518,7 @@ FIG公式ルール：
     return {
         "response": response,
         "conversation_id": data.conversation_id or "adv_001",
-        "usage_count": 1,
-        "remaining_count": -1
+        **TOKEN_LEDGER.record(client_id, usage)
     }
 
 if __name__ == "__main__":
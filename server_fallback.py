@@ -3,16 +3,27 @@
 最強OpenAI統合サーバー - フォールバック機能付き
 """
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 import os
-from openai import OpenAI
 import json
 import logging
 from typing import Optional, Dict, Any
 import asyncio
 
-app = FastAPI(title="Gymnastics AI - 最強統合版", version="3.1.0")
+from intent_matcher import match_message
+from lifecycle import Lifecycle, create_openai_client, warm_openai_connection
+from local_answerer import LocalAnswerer
+from request_capture import annotate, install_request_capture
+from response_encoding import install_response_encoding
+from sampling_profiler import install_profiler
+from skill_linker import SkillLinker
+from term_dictionary import TermDictionary
+from token_budget import TokenLedger, TokenUsage, choose_max_tokens, classify_question, client_id_for
+
+# クライアント生成は lifespan で行う（/ready で完了を確認できる）
+LIFECYCLE = Lifecycle()
+app = FastAPI(title="Gymnastics AI - 最強統合版", version="3.1.0", lifespan=LIFECYCLE.lifespan)
 
 # CORS設定
 app.add_middleware(
@@ -22,23 +33,45 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+install_response_encoding(app)
+install_request_capture(app)
+install_profiler(app)
+LIFECYCLE.install(app)
 
 # ロギング設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# OpenAI設定
+# OpenAI設定（キーがない場合は openai を読み込まずフォールバックモード）
 openai_client = None
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-if OPENAI_API_KEY:
+@LIFECYCLE.step("openai_client")
+def init_openai_client():
+    global openai_client
     try:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
-        logger.info("🔥 OpenAI最強AI統合完了！")
+        openai_client = create_openai_client()
     except Exception as e:
         logger.error(f"OpenAI初期化エラー: {e}")
-else:
-    logger.warning("OpenAI APIキーが見つかりません。フォールバックモードで起動します。")
+        return
+    if openai_client:
+        logger.info("🔥 OpenAI最強AI統合完了！")
+    else:
+        logger.warning("OpenAI APIキーが見つかりません。フォールバックモードで起動します。")
+
+@LIFECYCLE.warmup("openai_connection")
+def warm_openai():
+    warm_openai_connection(openai_client)
+
+# APIキーなし・上流障害時の抽出型回答（技データの事実を含む）
+LOCAL_ANSWERER: Optional[LocalAnswerer] = None
+
+@LIFECYCLE.step("local_answerer")
+def init_local_answerer():
+    global LOCAL_ANSWERER
+    LOCAL_ANSWERER = LocalAnswerer.from_data(linker=SkillLinker.from_data(), terms=TermDictionary.from_file())
+
+# クライアントごとのトークン利用量と残り予算（TOKEN_BUDGET_PER_CLIENT で上限を設定）
+TOKEN_LEDGER = TokenLedger.from_env()
 
 # システムプロンプト
 SYSTEM_PROMPT = """あなたは世界最高レベルの体操競技専門AIアシスタントです。
@@ -57,10 +90,10 @@ SYSTEM_PROMPT = """あなたは世界最高レベルの体操競技専門AIア
 
 def get_fallback_response(message: str) -> str:
     """フォールバック回答システム"""
-    message_lower = message.lower()
+    intents = match_message(message).intents
     
     # 体操の基本的な質問
-    if any(word in message_lower for word in ["体操って", "体操とは", "体操について", "gymnastics"]):
+    if "about_gymnastics" in intents:
         return """🏅 **体操競技について**
 
 体操競技は、人間の身体能力を最大限に引き出す美しく技術的なスポーツです。正確性、力強さ、優美さ、そして芸術性を兼ね備えた総合的な競技として、オリンピックの花形種目の一つとなっています。
@@ -80,7 +113,7 @@ def get_fallback_response(message: str) -> str:
 体操は身体能力だけでなく、表現力や芸術性も求められる素晴らしいスポーツです！"""
     
     # あいさつ
-    if any(word in message_lower for word in ["こんにちは", "はじめまして", "よろしく", "hello"]):
+    if "greeting" in intents:
         return """こんにちは！体操競技専門AIコーチです🤸‍♂️
 
 私は体操競技について詳しくお答えできます：
@@ -91,6 +124,11 @@ def get_fallback_response(message: str) -> str:
 
 何について質問したいですか？"""
     
+    # 知識ベースから抽出型の回答を組み立てる
+    local_answer = LOCAL_ANSWERER.answer(message) if LOCAL_ANSWERER else None
+    if local_answer:
+        return local_answer.text
+    
     # 一般的な体操質問
     return f"""体操競技について「{message}」のご質問ですね。
 
@@ -126,9 +164,15 @@ async def health():
         "version": "3.1.0"
     }
 
+@app.get("/usage")
+async def usage(request: Request):
+    """呼び出し元クライアントのトークン利用量と残り予算"""
+    return TOKEN_LEDGER.snapshot(client_id_for(request))
+
 @app.post("/chat/message")
-async def chat(data: dict):
+async def chat(data: dict, request: Request):
     """最強AI統合チャットエンドポイント"""
+    client_id = client_id_for(request)
     try:
         message = data.get("message", "")
         if not message.strip():
@@ -136,27 +180,35 @@ async def chat(data: dict):
         
         logger.info(f"処理中: {message[:50]}...")
         
-        # OpenAI利用可能な場合
-        if openai_client:
+        # OpenAI利用可能な場合（予算を使い切ったクライアントはフォールバック回答）
+        if openai_client and not TOKEN_LEDGER.exhausted(client_id):
             try:
+                max_tokens = choose_max_tokens(
+                    classify_question(message, match_message(message)),
+                    TOKEN_LEDGER.remaining(client_id)
+                )
                 response = openai_client.chat.completions.create(
                     model="gpt-4o-mini",
                     messages=[
                         {"role": "system", "content": SYSTEM_PROMPT},
                         {"role": "user", "content": message}
                     ],
-                    max_tokens=1500,
+                    max_tokens=max_tokens,
                     temperature=0.7
                 )
                 
                 ai_response = response.choices[0].message.content
+                usage = TokenUsage()
+                usage.add_response(response, max_tokens)
                 logger.info("✅ OpenAI回答生成完了")
+                annotate(tier="openai")
                 
                 return {
                     "response": ai_response,
                     "conversation_id": "openai_strongest_001",
                     "model": "gpt-4o-mini",
-                    "status": "strongest_ai"
+                    "status": "strongest_ai",
+                    **TOKEN_LEDGER.record(client_id, usage)
                 }
             except Exception as e:
                 logger.error(f"OpenAI APIエラー: {e}")
@@ -165,12 +217,14 @@ async def chat(data: dict):
         # フォールバック回答
         fallback_response = get_fallback_response(message)
         logger.info("✅ フォールバック回答生成完了")
+        annotate(tier="fallback")
         
         return {
             "response": fallback_response,
             "conversation_id": "fallback_expert_001",
             "model": "expert_fallback",
-            "status": "expert_fallback"
+            "status": "expert_fallback",
+            **TOKEN_LEDGER.record(client_id, TokenUsage())
         }
         
     except Exception as e:
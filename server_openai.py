@@ -3,16 +3,27 @@
 最強OpenAI統合サーバー - 直接実行版
 """
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 import os
-from openai import OpenAI
 import json
 import logging
 from typing import Optional, Dict, Any
 import asyncio
 
-app = FastAPI(title="Gymnastics AI - 最強OpenAI統合版", version="3.0.0")
+from intent_matcher import match_message
+from lifecycle import Lifecycle, create_openai_client, warm_openai_connection
+from local_answerer import LocalAnswerer
+from request_capture import annotate, install_request_capture
+from response_encoding import install_response_encoding
+from sampling_profiler import install_profiler
+from skill_linker import SkillLinker
+from term_dictionary import TermDictionary
+from token_budget import TokenLedger, TokenUsage, choose_max_tokens, classify_question, client_id_for
+
+# クライアント生成は lifespan で行う（/ready で完了を確認できる）
+LIFECYCLE = Lifecycle()
+app = FastAPI(title="Gymnastics AI - 最強OpenAI統合版", version="3.0.0", lifespan=LIFECYCLE.lifespan)
 
 # CORS設定
 app.add_middleware(
@@ -22,6 +33,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+install_response_encoding(app)
+install_request_capture(app)
+install_profiler(app)
+LIFECYCLE.install(app)
 
 # ロギング設定
 logging.basicConfig(level=logging.INFO)
@@ -29,13 +44,30 @@ logger = logging.getLogger(__name__)
 
 # OpenAI設定 - APIキーは環境変数から取得
 openai_client = None
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-if OPENAI_API_KEY:
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
-    logger.info("🔥 OpenAI最強AI統合完了！")
-else:
-    logger.error("❌ OpenAI API キーが見つかりません")
+@LIFECYCLE.step("openai_client")
+def init_openai_client():
+    global openai_client
+    openai_client = create_openai_client()
+    if openai_client:
+        logger.info("🔥 OpenAI最強AI統合完了！")
+    else:
+        logger.error("❌ OpenAI API キーが見つかりません")
+
+@LIFECYCLE.warmup("openai_connection")
+def warm_openai():
+    warm_openai_connection(openai_client)
+
+# APIキーなし・上流障害時の抽出型回答（技データの事実を含む）
+LOCAL_ANSWERER: Optional[LocalAnswerer] = None
+
+@LIFECYCLE.step("local_answerer")
+def init_local_answerer():
+    global LOCAL_ANSWERER
+    LOCAL_ANSWERER = LocalAnswerer.from_data(linker=SkillLinker.from_data(), terms=TermDictionary.from_file())
+
+# クライアントごとのトークン利用量と残り予算（TOKEN_BUDGET_PER_CLIENT で上限を設定）
+TOKEN_LEDGER = TokenLedger.from_env()
 
 # 最強AI統合システムプロンプト
 SYSTEM_PROMPT = """あなたは世界最高レベルの体操競技専門AIアシスタントです。以下の特徴を持ちます：
@@ -77,15 +109,39 @@ async def health():
         "version": "3.0.0"
     }
 
+@app.get("/usage")
+async def usage(request: Request):
+    """呼び出し元クライアントのトークン利用量と残り予算"""
+    return TOKEN_LEDGER.snapshot(client_id_for(request))
+
+def local_response(message: str, client_id: str) -> Optional[Dict[str, Any]]:
+    """OpenAI が使えない場合の抽出型回答（組み立てられなければ None）"""
+    local_answer = LOCAL_ANSWERER.answer(message) if LOCAL_ANSWERER else None
+    if not local_answer:
+        return None
+    annotate(tier="local", local_ms=local_answer.elapsed_ms)
+    return {
+        "response": local_answer.text,
+        "conversation_id": "local_extractive_001",
+        "model": "local_extractive",
+        "status": "local_fallback",
+        **TOKEN_LEDGER.record(client_id, TokenUsage())
+    }
+
 @app.post("/chat/message")
-async def chat(data: dict):
+async def chat(data: dict, request: Request):
     """最強AI統合チャットエンドポイント"""
+    message = data.get("message", "")
+    client_id = client_id_for(request)
     try:
-        message = data.get("message", "")
         if not message.strip():
             return {"response": "質問を入力してください。", "conversation_id": "error_empty"}
         
-        if not openai_client:
+        # APIキーがない、または予算を使い切ったクライアントは抽出型回答
+        if not openai_client or TOKEN_LEDGER.exhausted(client_id):
+            fallback = local_response(message, client_id)
+            if fallback:
+                return fallback
             return {
                 "response": "申し訳ございませんが、現在OpenAI APIが利用できません。後ほど再度お試しください。",
                 "conversation_id": "error_no_api"
@@ -93,30 +149,42 @@ async def chat(data: dict):
         
         logger.info(f"🔥 最強AIで処理中: {message[:50]}...")
         
-        # OpenAI GPT-4で最強の回答を生成
+        # OpenAI GPT-4で最強の回答を生成（出力上限は質問の種類で決める）
+        max_tokens = choose_max_tokens(
+            classify_question(message, match_message(message)),
+            TOKEN_LEDGER.remaining(client_id)
+        )
         response = openai_client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": message}
             ],
-            max_tokens=1500,
+            max_tokens=max_tokens,
             temperature=0.7
         )
         
         ai_response = response.choices[0].message.content
+        usage = TokenUsage()
+        usage.add_response(response, max_tokens)
         
         logger.info("✅ OpenAI最強AI回答生成完了")
+        annotate(tier="openai")
         
         return {
             "response": ai_response,
             "conversation_id": "openai_strongest_001",
             "model": "gpt-4o-mini",
-            "status": "strongest_ai"
+            "status": "strongest_ai",
+            **TOKEN_LEDGER.record(client_id, usage)
         }
         
     except Exception as e:
         logger.error(f"最強AIエラー: {e}")
+        # 上流障害時は知識ベースからの抽出型回答で応答する
+        fallback = local_response(message, client_id)
+        if fallback:
+            return fallback
         return {
             "response": f"申し訳ございません。最強AIでエラーが発生しました: {str(e)}",
             "conversation_id": "error_strongest",
@@ -1,21 +1,50 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import asyncio
 import os
 import json
-from typing import Dict, List, Optional
-import openai
-from openai import OpenAI
-
-app = FastAPI()
-
-# OpenAI APIキーの設定
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    print("警告: OPENAI_API_KEYが設定されていません。デモモードで動作します。")
-    openai_client = None
-else:
-    openai_client = OpenAI(api_key=openai_api_key)
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from analysis_jobs import JOB_DONE, JOB_ERROR, AnalysisJob, AnalysisJobManager, routine_hash
+from analysis_store import AnalysisStore, analysis_key
+from answer_store import corpus_version
+from compact_corpus import resolve_corpus_file
+from connection_matrix import get_connection_matrix
+from corpus_partitions import PartitionedCorpus
+from fact_lookup import FactLookup
+from dscore import APPARATUS_RULES, routine_skills_from_payload
+from dscore_simulation import DEFAULT_TRIALS, format_simulation_summary
+from intent_matcher import match_message
+from lifecycle import Lifecycle, create_openai_client, warm_openai_connection
+from local_answerer import LocalAnswerer
+from request_capture import annotate, install_request_capture
+from response_encoding import install_response_encoding
+from routine_diagnostics import diagnose_routine, format_diagnostics
+from routine_sessions import RoutineSessionStore, apply_edit, connections_from_groups
+from sampling_profiler import install_profiler
+from sectioned_analysis import SOURCE_FALLBACK, Section, SectionContext, compose_sections, generate_sections, iter_sections
+from skill_alternatives import AlternativeIndex
+from skill_linker import TABLES_FILE, SkillLinker
+from speculation import SpeculativeCache
+from task_pool import EXECUTOR_PROCESS, TaskPool, TaskQueueFull, TaskTimeout, analyze_routine_connections, simulate_routine
+from term_dictionary import TermDictionary
+from token_budget import LEDGER_FIELDS, TokenLedger, TokenUsage, choose_max_tokens, classify_question, client_id_for, record_usage, start_usage
+
+# 読み込み・クライアント生成は lifespan で行う（/ready で完了を確認できる）
+LIFECYCLE = Lifecycle()
+app = FastAPI(lifespan=LIFECYCLE.lifespan)
+
+openai_client = None
+
+@LIFECYCLE.step("openai_client")
+def init_openai_client():
+    global openai_client
+    openai_client = create_openai_client()
+    if openai_client is None:
+        print("警告: OPENAI_API_KEYが設定されていません。デモモードで動作します。")
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,6 +53,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+install_response_encoding(app)
+install_request_capture(app)
+install_profiler(app)
+LIFECYCLE.install(app)
 
 class ChatMessage(BaseModel):
     message: str
@@ -37,9 +70,46 @@ class RoutineAnalysisRequest(BaseModel):
     group_bonus: float
     connection_bonus: float
     message: Optional[str] = None
+    sectioned: bool = False  # 5項目を並行に生成する（ローカルで決まる項目は LLM を使わない）
+
+class RoutineDiagnosticsRequest(BaseModel):
+    routine_data: List[Dict]
+    apparatus: str
+
+class ConnectionAnalysisRequest(BaseModel):
+    routine_data: List[Dict]
+    apparatus: str
+    optimize: bool = True
+    fixed_positions: Optional[List[int]] = None  # 省略時は最後の技（終末技）を固定
+
+class SimulationRequest(BaseModel):
+    routine_data: List[Dict]
+    apparatus: str
+    success_probabilities: Optional[List[float]] = None  # 省略時は難度から推定
+    connections: Optional[List[bool]] = None  # 省略時は隣接する全ペアを連続実施とみなす
+    downgrade_share: float = 0.3
+    trials: int = DEFAULT_TRIALS
+    seed: Optional[int] = None
+
+class RoutineSessionRequest(BaseModel):
+    routine_data: List[Dict]
+    apparatus: str
+    connection_groups: Optional[List[int]] = None  # アプリの連続技グループID（0は単独）
+
+class RoutineEditRequest(BaseModel):
+    op: str  # insert / replace / move / delete / connect
+    index: int = 0
+    target: Optional[int] = None  # move の移動先
+    skill: Optional[Dict] = None  # insert / replace の技（routine_data と同じ形式）
+    connected: bool = False  # insert は直前の技との連続、connect は次の技との連続
+    version: Optional[int] = None  # 指定時、セッションの版と一致しなければ 409
 
 # 知識ベースを読み込み
 KNOWLEDGE_BASE = {}
+# 知識ベースの内容から決まるバージョン（分析ストアのキーに含める）
+CORPUS_VERSION = ""
+# 種目別に分割した段落（種目を指定した検索はその種目と共通の段落だけを見る）
+CORPUS_PARTITIONS = PartitionedCorpus()
 DATA_FILES = [
     'data/rulebook_ja_full.txt',
     'data/rulebook_ja_summary.md',
@@ -50,53 +120,164 @@ DATA_FILES = [
 ]
 
 # ファイルを読み込み
-for file_path in DATA_FILES:
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            file_name = os.path.basename(file_path)
-            KNOWLEDGE_BASE[file_name] = content
-            print(f"読み込み完了: {file_name} ({len(content)} 文字)")
-    else:
-        print(f"ファイルが見つかりません: {file_path}")
-
-print(f"知識ベース読み込み完了: {len(KNOWLEDGE_BASE)} ファイル")
-
-# 検索用マッピング
-SEARCH_MAPPING = {
-    "床": ["rulebook_ja_full.txt", "skills_difficulty_tables.md"],
-    "あん馬": ["rulebook_ja_full.txt", "skills_difficulty_tables.md"],
-    "つり輪": ["rulebook_ja_full.txt", "skills_difficulty_tables.md"],
-    "跳馬": ["rulebook_ja_full.txt", "skills_difficulty_tables.md"], 
-    "平行棒": ["rulebook_ja_full.txt", "skills_difficulty_tables.md"],
-    "鉄棒": ["rulebook_ja_full.txt", "skills_difficulty_tables.md"],
-    "連続技": ["comprehensive_rulebook_analysis.md"],
-    "接続": ["comprehensive_rulebook_analysis.md"],
-    "難度": ["skills_difficulty_tables.md"],
-    "グループ": ["comprehensive_rulebook_analysis.md"],
-    "器具": ["apparatus_details.md"],
-    "種目": ["apparatus_details.md"],
-    "実装": ["ai_implementation_guide.md"]
-}
-
-def search_knowledge(query: str) -> str:
-    """知識ベースから関連情報を検索"""
+@LIFECYCLE.step("knowledge_base")
+def load_knowledge_base():
+    global CORPUS_VERSION
+    for file_path in DATA_FILES:
+        if os.path.exists(file_path):
+            # compact_corpus.py で生成したコンパクト版があれば優先する
+            with open(resolve_corpus_file(file_path), 'r', encoding='utf-8') as f:
+                content = f.read()
+                file_name = os.path.basename(file_path)
+                KNOWLEDGE_BASE[file_name] = content
+                CORPUS_PARTITIONS.add(file_name, content)
+                print(f"読み込み完了: {file_name} ({len(content)} 文字)")
+        else:
+            print(f"ファイルが見つかりません: {file_path}")
+    
+    CORPUS_VERSION = corpus_version(KNOWLEDGE_BASE)
+    print(f"知識ベース読み込み完了: {len(KNOWLEDGE_BASE)} ファイル (corpus_version={CORPUS_VERSION})")
+
+# 技名リンク用のトライグラム索引
+SKILL_LINKER: Optional[SkillLinker] = None
+
+@LIFECYCLE.step("skill_linker")
+def build_skill_linker():
+    global SKILL_LINKER
+    SKILL_LINKER = SkillLinker.from_data()
+
+# 難度表から直接答えられる質問（D難度の価値点・グループの技一覧など）
+FACT_LOOKUP = FactLookup()
+
+@LIFECYCLE.step("fact_lookup")
+def load_fact_lookup():
+    global FACT_LOOKUP
+    FACT_LOOKUP = FactLookup.from_data()
+
+# 英語の質問を日本語の用語で検索するための対訳辞書（term_dictionary.py で生成）
+TERM_DICTIONARY = TermDictionary()
+
+@LIFECYCLE.step("term_dictionary")
+def load_term_dictionary():
+    global TERM_DICTIONARY
+    TERM_DICTIONARY = TermDictionary.from_file()
+
+# APIキーなし・上流障害時の抽出型回答
+LOCAL_ANSWERER: Optional[LocalAnswerer] = None
+
+@LIFECYCLE.step("local_answerer")
+def build_local_answerer():
+    global LOCAL_ANSWERER
+    LOCAL_ANSWERER = LocalAnswerer.from_data(linker=SKILL_LINKER, terms=TERM_DICTIONARY)
+
+# 代替技インデックス（skill_alternatives.py で事前生成）
+SKILL_ALTERNATIVES = AlternativeIndex()
+
+@LIFECYCLE.step("skill_alternatives")
+def load_skill_alternatives():
+    global SKILL_ALTERNATIVES
+    SKILL_ALTERNATIVES = AlternativeIndex.from_file()
+
+# ウォームアップ: 連続技ボーナス行列の構築と上流への接続確立
+@LIFECYCLE.warmup("connection_matrix")
+def warm_connection_matrix():
+    get_connection_matrix("FX")
+
+@LIFECYCLE.warmup("openai_connection")
+def warm_openai():
+    warm_openai_connection(openai_client)
+
+# CPU を占有する計算（シミュレーション・並び順最適化）はワーカープロセスで実行する
+TASK_POOL = TaskPool.from_env()
+TASK_POOL.register("simulate", EXECUTOR_PROCESS, concurrency=int(os.environ.get("SIMULATE_CONCURRENCY", 2)), max_queue=32, timeout=10.0)
+TASK_POOL.register("connections", EXECUTOR_PROCESS, concurrency=int(os.environ.get("CONNECTIONS_CONCURRENCY", 2)), max_queue=64, timeout=5.0)
+
+@LIFECYCLE.warmup("task_pool")
+async def warm_task_pool():
+    await TASK_POOL.start()
+
+@LIFECYCLE.shutdown("task_pool")
+def close_task_pool():
+    TASK_POOL.shutdown()
+
+async def run_cpu_task(name: str, func, *args):
+    """プールで実行する（待ち行列が満杯なら 503、時間切れなら 504）"""
+    try:
+        return await TASK_POOL.run(name, func, *args)
+    except TaskQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except TaskTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+# 演技分析の非同期ジョブ（同一構成は重複実行しない）
+ANALYSIS_JOBS = AnalysisJobManager(
+    worker_count=int(os.environ.get("ANALYSIS_JOB_WORKERS", 4)),
+    ttl_seconds=float(os.environ.get("ANALYSIS_JOB_TTL", 3600))
+)
+
+# 上流で生成した演技分析の永続ストア（同じホストのワーカーで共有）
+OPENAI_MODEL = "gpt-4-turbo-preview"
+# 分析・ワンクリック説明のプロンプトを変えたら上げる（古い保存結果を使わないように）
+ANALYSIS_PROMPT_VERSION = "1"
+ANALYSIS_STORE = AnalysisStore.from_env()
+
+@LIFECYCLE.step("analysis_store")
+def open_analysis_store():
+    ANALYSIS_STORE.open()
+
+def stored_analysis_key(kind: str, request: RoutineAnalysisRequest, **extra) -> str:
+    return analysis_key(
+        kind,
+        request.apparatus,
+        request.routine_data,
+        OPENAI_MODEL,
+        ANALYSIS_PROMPT_VERSION,
+        CORPUS_VERSION,
+        total_score=request.total_score,
+        difficulty_score=request.difficulty_score,
+        group_bonus=request.group_bonus,
+        connection_bonus=request.connection_bonus,
+        **extra
+    )
+
+async def load_stored_analysis(key: str) -> Optional[Dict]:
+    try:
+        return await asyncio.to_thread(ANALYSIS_STORE.get, key)
+    except Exception as e:
+        print(f"分析ストア読み込みエラー: {e}")
+        return None
+
+async def save_stored_analysis(key: str, kind: str, result: Dict, usage: TokenUsage) -> None:
+    """上流で生成できた結果だけを保存する（デモ応答・代替文を含む結果は保存しない）"""
+    if usage.calls == 0 or any(section.get("source") == SOURCE_FALLBACK for section in result.get("sections", [])):
+        return
+    try:
+        await asyncio.to_thread(ANALYSIS_STORE.put, key, kind, result)
+    except Exception as e:
+        print(f"分析ストア保存エラー: {e}")
+
+# クライアントごとのトークン利用量
+TOKEN_LEDGER = TokenLedger.from_env()
+
+# 分析完了後に先回りして計算する後続分析（低優先度・1時間あたりの実行予算付き）
+SPECULATION = SpeculativeCache.from_env()
+
+# 演技構成の編集セッション
+ROUTINE_SESSIONS = RoutineSessionStore(ttl_seconds=float(os.environ.get("ROUTINE_SESSION_TTL", 1800)))
+
+def search_knowledge(query: str, exclude_files: Optional[Set[str]] = None, apparatus: Optional[str] = None) -> str:
+    """知識ベースから関連情報を検索（apparatus を指定するとその種目と共通の段落だけを見る）"""
     query_lower = query.lower()
     relevant_info = []
     
-    # マッピングに基づいて関連ファイルを特定
-    relevant_files = set()
-    for keyword, files in SEARCH_MAPPING.items():
-        if keyword in query_lower:
-            relevant_files.update(files)
+    # 共通キーワード表（intent_matcher）で関連ファイルを特定
+    relevant_files = match_message(query).files
     
     # 関連ファイルから情報を抽出
     for file_name in relevant_files:
-        if file_name in KNOWLEDGE_BASE:
-            content = KNOWLEDGE_BASE[file_name]
+        if file_name in KNOWLEDGE_BASE and not (exclude_files and file_name in exclude_files):
             # 簡単な段落抽出（改良の余地あり）
-            paragraphs = content.split('\n\n')
-            for para in paragraphs:
+            for para in CORPUS_PARTITIONS.paragraphs(file_name, apparatus):
                 if any(keyword in para.lower() for keyword in query_lower.split()):
                     relevant_info.append(para[:500])  # 最初の500文字
     
@@ -143,9 +324,12 @@ def create_expert_system_prompt(apparatus: str, routine_data: Optional[List[Dict
 - なぜその点数になるのか詳細説明
 - どう改善すればより高得点が狙えるか
 - リスクとメリットの分析
-- 代替技の提案"""
+- 代替技の提案（下記の候補から選び、Dの差分は再計算せずそのまま使う）"""
         
         base_prompt += routine_info
+        alternatives = SKILL_ALTERNATIVES.format_for_prompt(apparatus, routine_data)
+        if alternatives:
+            base_prompt += f"\n\n{alternatives}"
     
     return base_prompt
 
@@ -161,18 +345,28 @@ def get_apparatus_name(apparatus_code: str) -> str:
     }
     return apparatus_names.get(apparatus_code, apparatus_code)
 
-async def get_ai_response(message: str, knowledge_context: str, routine_data: Optional[List[Dict]] = None, apparatus: str = "FX") -> str:
+async def get_ai_response(message: str, knowledge_context: str, routine_data: Optional[List[Dict]] = None, apparatus: str = "FX", max_tokens: Optional[int] = None) -> str:
     """OpenAI APIを使用して世界最高レベルのAI応答を生成"""
     if not openai_client:
         # デモモード：基本的なルールベース応答
         return generate_demo_response(message, knowledge_context)
     
     try:
-        # 最強の体操競技専門AIコーチシステムプロンプトを使用
-        system_prompt = create_expert_system_prompt(apparatus, routine_data)
-        
-        # 知識ベースを含む完全なプロンプト
-        full_system_prompt = f"""{system_prompt}
+        return await request_completion(message, knowledge_context, routine_data, apparatus, max_tokens)
+    except Exception as e:
+        print(f"OpenAI API エラー: {e}")
+        return generate_demo_response(message, knowledge_context)
+
+async def request_completion(message: str, knowledge_context: str, routine_data: Optional[List[Dict]] = None, apparatus: str = "FX", max_tokens: Optional[int] = None) -> str:
+    """OpenAI API に問い合わせて応答本文を返す（失敗時は例外をそのまま送出する）"""
+    if max_tokens is None:
+        max_tokens = choose_max_tokens(classify_question(message, match_message(message), bool(routine_data)))
+    
+    # 最強の体操競技専門AIコーチシステムプロンプトを使用
+    system_prompt = create_expert_system_prompt(apparatus, routine_data)
+    
+    # 知識ベースを含む完全なプロンプト
+    full_system_prompt = f"""{system_prompt}
 
 【利用可能な知識ベース】
 {knowledge_context}
@@ -184,29 +378,32 @@ async def get_ai_response(message: str, knowledge_context: str, routine_data: Op
 - FIG規則を正確に引用し、最新ルールに準拠
 - ユーザーの技術レベルに関係なく、理解しやすい説明を心がける"""
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[
-                {"role": "system", "content": full_system_prompt},
-                {"role": "user", "content": message}
-            ],
-            max_tokens=1200,  # より詳細な回答のため増量
-            temperature=0.3,  # より正確な回答のため低め
-            presence_penalty=0.2,
-            frequency_penalty=0.1
-        )
-        
-        return response.choices[0].message.content
-        
-    except Exception as e:
-        print(f"OpenAI API エラー: {e}")
-        return generate_demo_response(message, knowledge_context)
+    # 同期クライアントの呼び出しはスレッドで実行し、イベントループを止めない
+    response = await asyncio.to_thread(
+        openai_client.chat.completions.create,
+        model=OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": full_system_prompt},
+            {"role": "user", "content": message}
+        ],
+        max_tokens=max_tokens,
+        temperature=0.3,  # より正確な回答のため低め
+        presence_penalty=0.2,
+        frequency_penalty=0.1
+    )
+    
+    record_usage(response, max_tokens)
+    return response.choices[0].message.content
 
 def generate_demo_response(message: str, knowledge_context: str) -> str:
-    """デモモード用の応答生成"""
-    message_lower = message.lower()
+    """デモモード用の応答生成（知識ベースから回答を組み立てられない場合は定型文）"""
+    local_answer = LOCAL_ANSWERER.answer(message) if LOCAL_ANSWERER else None
+    if local_answer:
+        return local_answer.text
+    
+    message_match = match_message(message)
     
-    if "床" in message_lower or "fx" in message_lower:
+    if "FX" in message_match.apparatus:
         return f"""床運動について、体操AIコーチがお答えします。
 
 {knowledge_context}
@@ -219,7 +416,7 @@ def generate_demo_response(message: str, knowledge_context: str) -> str:
 
 具体的にどのような情報をお求めでしょうか？技の詳細、演技構成、採点について詳しく説明できます。"""
     
-    elif "鉄棒" in message_lower or "hb" in message_lower:
+    elif "HB" in message_match.apparatus:
         return f"""鉄棒について、体操AIコーチがお答えします。
 
 {knowledge_context}
@@ -232,7 +429,7 @@ def generate_demo_response(message: str, knowledge_context: str) -> str:
 
 どの技術について詳しく知りたいですか？カッシーナ、コールマン、コバチ等の具体的な技について説明できます。"""
     
-    elif "つり輪" in message_lower or "sr" in message_lower:
+    elif "SR" in message_match.apparatus:
         return f"""つり輪について、体操AIコーチがお答えします。
 
 {knowledge_context}
@@ -245,7 +442,7 @@ def generate_demo_response(message: str, knowledge_context: str) -> str:
 
 具体的な技の習得方法や演技構成についてアドバイスいたします。どの技術について詳しく聞きたいですか？"""
     
-    elif "あん馬" in message_lower or "ph" in message_lower:
+    elif "PH" in message_match.apparatus:
         return f"""あん馬について、体操AIコーチがお答えします。
 
 {knowledge_context}
@@ -258,7 +455,7 @@ def generate_demo_response(message: str, knowledge_context: str) -> str:
 
 旋回技術、移動技術、下馬技について詳しく説明できます。どの技術についてお聞きになりたいですか？"""
     
-    elif "平行棒" in message_lower or "pb" in message_lower:
+    elif "PB" in message_match.apparatus:
         return f"""平行棒について、体操AIコーチがお答えします。
 
 {knowledge_context}
@@ -271,7 +468,7 @@ def generate_demo_response(message: str, knowledge_context: str) -> str:
 
 支持系、懸垂系、終末技について詳しく説明できます。どの技術についてお聞きになりたいですか？"""
     
-    elif "跳馬" in message_lower or "vt" in message_lower:
+    elif "VT" in message_match.apparatus:
         return f"""跳馬について、体操AIコーチがお答えします。
 
 {knowledge_context}
@@ -284,7 +481,7 @@ def generate_demo_response(message: str, knowledge_context: str) -> str:
 
 具体的な技（ユルチェンコ、ツカハラ、前転跳び等）について詳しく説明できます。"""
     
-    elif "連続技" in message_lower or "接続" in message_lower:
+    elif "connection" in message_match.intents:
         return f"""連続技について、体操AIコーチが詳しく説明します。
 
 {knowledge_context}
@@ -323,41 +520,167 @@ async def root():
 async def health_check():
     return {"status": "healthy", "loaded_files": list(KNOWLEDGE_BASE.keys())}
 
+@app.get("/usage")
+async def usage(http_request: Request):
+    """呼び出し元クライアントのトークン利用量と残り予算"""
+    return TOKEN_LEDGER.snapshot(client_id_for(http_request))
+
 @app.post("/chat/message")
-async def chat(data: ChatMessage):
+async def chat(data: ChatMessage, http_request: Request):
     message = data.message.strip()
+    client_id = client_id_for(http_request)
+    usage = start_usage()
     
     if not message:
         raise HTTPException(status_code=400, detail="メッセージが空です")
     
+    # 難度表だけで答えられる質問は LLM を呼ばずに出典付きで返す
+    fact = FACT_LOOKUP.answer(message)
+    if fact:
+        annotate(tier="fact", fact_kind=fact.kind)
+        return {
+            "response": fact.text,
+            "conversation_id": data.conversation_id or "world_ai_001",
+            "sources": fact.sources,
+            **TOKEN_LEDGER.record(client_id, usage)
+        }
+    
     try:
-        # 知識ベースから関連情報を検索
-        knowledge_context = search_knowledge(message)
+        # 英語の用語・技名には日本語の表記を付け足して検索する（LLM へはもとの質問を渡す）
+        search_query = TERM_DICTIONARY.expand(message)
+        
+        # 技名をカタログにリンクし、その技の正確な事実だけをコンテキストに入れる
+        message_match = match_message(search_query)
+        skill_mentions = SKILL_LINKER.link(search_query, message_match.apparatus)
+        skill_facts = SKILL_LINKER.format_facts(skill_mentions)
+        
+        # 知識ベースから関連情報を検索（技が特定できた場合は難度表の段落検索を省く）
+        knowledge_context = search_knowledge(
+            search_query,
+            exclude_files={TABLES_FILE} if skill_mentions else None,
+            apparatus=message_match.apparatus[0] if len(message_match.apparatus) == 1 else None
+        )
+        if skill_facts:
+            knowledge_context = f"{skill_facts}\n\n{knowledge_context}".strip()
+        annotate(
+            tier="openai" if openai_client else "demo",
+            linked_skills=len(skill_mentions),
+            context_chars=len(knowledge_context)
+        )
         
-        # 世界クラスのAI応答を生成
-        ai_response = await get_ai_response(message, knowledge_context)
+        # 世界クラスのAI応答を生成（予算を使い切ったクライアントはデモ応答）
+        if TOKEN_LEDGER.exhausted(client_id):
+            ai_response = generate_demo_response(message, knowledge_context)
+        else:
+            ai_response = await get_ai_response(
+                message, knowledge_context,
+                max_tokens=choose_max_tokens(
+                    classify_question(message, message_match),
+                    TOKEN_LEDGER.remaining(client_id)
+                )
+            )
         
         return {
             "response": ai_response,
             "conversation_id": data.conversation_id or "world_ai_001",
-            "usage_count": 1,
-            "remaining_count": -1
+            **TOKEN_LEDGER.record(client_id, usage)
         }
         
     except Exception as e:
         print(f"チャット処理エラー: {e}")
         raise HTTPException(status_code=500, detail="サーバー内部エラーが発生しました")
 
-@app.post("/analyze_routine")
-async def analyze_routine_endpoint(request: RoutineAnalysisRequest):
-    """演技構成の詳細分析エンドポイント - 最強AIコーチの真骨頂"""
-    try:
-        # 演技構成データから知識ベースを構築
-        apparatus_name = get_apparatus_name(request.apparatus)
-        knowledge_context = search_knowledge(f"{apparatus_name} 演技構成 分析")
-        
-        # 詳細な演技分析プロンプトを構築
-        analysis_message = f"""演技構成の詳細分析をお願いします。
+async def prepare_routine_analysis(request: RoutineAnalysisRequest) -> Optional[SectionContext]:
+    """規則チェック・連続技・シミュレーション・代替技をまとめて計算する（未対応の種目は None）"""
+    if request.apparatus not in APPARATUS_RULES or not request.routine_data:
+        return None
+    skills = routine_skills_from_payload(request.apparatus, request.routine_data)
+    fixed_positions = [len(skills) - 1] if request.apparatus != "FX" else []
+    # 連続技の最適化とシミュレーションは別々のワーカーで同時に計算する
+    connections, simulation = await asyncio.gather(
+        run_cpu_task("connections", analyze_routine_connections, request.apparatus, request.routine_data, fixed_positions, True),
+        run_cpu_task("simulate", simulate_routine, request.apparatus, request.routine_data, {
+            "connections": [skill.connected_to_next for skill in skills],
+            "trials": 5000,
+        }),
+    )
+    return SectionContext(
+        apparatus=request.apparatus,
+        apparatus_name=get_apparatus_name(request.apparatus),
+        skills=skills,
+        diagnostics=diagnose_routine(request.apparatus, skills),
+        connections=connections,
+        simulation_summary=format_simulation_summary(simulation),
+        alternatives=SKILL_ALTERNATIVES.format_for_prompt(request.apparatus, request.routine_data),
+        message=request.message or ""
+    )
+
+def section_generator(client_id: str, apparatus: str):
+    """項目ごとの小さなプロンプトで上流に問い合わせる（使えない・失敗した場合は None を返してローカルの代替にする）"""
+    async def generate(section: Section, message: str, max_tokens: int) -> Optional[str]:
+        if not openai_client or TOKEN_LEDGER.exhausted(client_id):
+            return None
+        knowledge_context = search_knowledge(section.knowledge_query, apparatus=apparatus) if section.knowledge_query else ""
+        try:
+            return await request_completion(message, knowledge_context, None, apparatus, max_tokens=max_tokens)
+        except Exception as e:
+            print(f"OpenAI API エラー（{section.key}）: {e}")
+            return None
+    return generate
+
+def routine_analysis_result(request: RoutineAnalysisRequest, analysis: str, context: Optional[SectionContext]) -> Dict:
+    return {
+        "analysis": analysis,
+        "diagnostics": context.diagnostics if context else None,
+        "routine_summary": {
+            "skill_count": len(request.routine_data),
+            "apparatus": get_apparatus_name(request.apparatus),
+            "total_score": request.total_score,
+            "breakdown": {
+                "difficulty": request.difficulty_score,
+                "group_bonus": request.group_bonus,
+                "connection_bonus": request.connection_bonus
+            }
+        }
+    }
+
+async def run_routine_analysis(request: RoutineAnalysisRequest, client_id: str = "anonymous") -> Dict:
+    """演技構成の詳細分析を実行する（同期エンドポイントとジョブで共用）"""
+    usage = start_usage()
+    # 同じ条件で上流が生成した分析が保存されていれば、計算も上流への問い合わせもしない
+    store_key = stored_analysis_key("analyze_routine", request, message=request.message, sectioned=request.sectioned)
+    stored = await load_stored_analysis(store_key)
+    annotate(analysis_store="hit" if stored else "miss")
+    if stored:
+        await speculate_follow_ups(request, client_id)
+        return {**stored, "stored": True, **TOKEN_LEDGER.record(client_id, usage)}
+
+    context = await prepare_routine_analysis(request)
+
+    if request.sectioned and context:
+        # 5項目を並行に生成（ローカルで決まる項目は LLM を使わない）
+        sections = await generate_sections(context, section_generator(client_id, request.apparatus), TOKEN_LEDGER.remaining(client_id))
+        result = {
+            **routine_analysis_result(request, compose_sections(sections), context),
+            "sections": [section.to_dict() for section in sections]
+        }
+        await save_stored_analysis(store_key, "analyze_routine", result, usage)
+        await speculate_follow_ups(request, client_id)
+        return {**result, "stored": False, **TOKEN_LEDGER.record(client_id, usage)}
+
+    # 演技構成データから知識ベースを構築
+    apparatus_name = get_apparatus_name(request.apparatus)
+    knowledge_context = search_knowledge(f"{apparatus_name} 演技構成 分析", apparatus=request.apparatus)
+    
+    # 規則チェック（構成の一覧を兼ねる）とリスク分析の根拠となるシミュレーション結果（既定の成功確率）
+    routine_summary_text = format_routine_data(request.routine_data)
+    risk_summary = ""
+    if context:
+        routine_summary_text = format_diagnostics(context.skills, context.diagnostics)
+        risk_summary = context.simulation_summary
+    
+    # 詳細な演技分析プロンプトを構築
+    analysis_message = f"""演技構成の詳細分析をお願いします。
 
 【演技データ】
 種目: {apparatus_name} ({request.apparatus})
@@ -366,44 +689,134 @@ async def analyze_routine_endpoint(request: RoutineAnalysisRequest):
 グループボーナス: {request.group_bonus}点
 連続技ボーナス: {request.connection_bonus}点
 
-【技構成】
-{format_routine_data(request.routine_data)}
+【技構成と規則チェック（×は価値点対象外、−は失っている点数、過大+は規則上無効なのに数えている点数）】
+{routine_summary_text}
+
+【Dスコア・シミュレーション（難度から推定した成功率）】
+{risk_summary or 'データなし'}
 
 【分析希望項目】
 1. 現在の点数の詳細な内訳説明
-2. グループ要求の充足状況
+2. グループ要求の充足状況（規則チェックの結果を前提に、対処法を中心に）
 3. 連続技ボーナスの詳細
 4. さらなる高得点化の具体的提案
 5. リスク分析と代替案
 
 {request.message or '上記の演技構成について、詳細で実践的なアドバイスをください。'}"""
 
-        # 最強AIコーチによる分析
-        response = await get_ai_response(
-            analysis_message, 
-            knowledge_context, 
-            request.routine_data, 
-            request.apparatus
-        )
-        
-        return {
-            "analysis": response,
-            "routine_summary": {
-                "skill_count": len(request.routine_data),
-                "apparatus": apparatus_name,
-                "total_score": request.total_score,
-                "breakdown": {
-                    "difficulty": request.difficulty_score,
-                    "group_bonus": request.group_bonus,
-                    "connection_bonus": request.connection_bonus
-                }
-            }
-        }
+    # 最強AIコーチによる分析
+    response = await get_ai_response(
+        analysis_message, 
+        knowledge_context, 
+        request.routine_data, 
+        request.apparatus,
+        max_tokens=choose_max_tokens("analysis", TOKEN_LEDGER.remaining(client_id))
+    )
+    
+    result = routine_analysis_result(request, response, context)
+    await save_stored_analysis(store_key, "analyze_routine", result, usage)
+    await speculate_follow_ups(request, client_id)
+    return {**result, "stored": False, **TOKEN_LEDGER.record(client_id, usage)}
+
+@app.post("/analyze_routine")
+async def analyze_routine_endpoint(request: RoutineAnalysisRequest, http_request: Request):
+    """演技構成の詳細分析エンドポイント - 最強AIコーチの真骨頂"""
+    try:
+        return await run_routine_analysis(request, client_id_for(http_request))
         
     except Exception as e:
         print(f"演技分析エラー: {e}")
         raise HTTPException(status_code=500, detail=f"演技分析エラー: {str(e)}")
 
+@app.post("/analyze_routine/stream")
+async def stream_routine_analysis(request: RoutineAnalysisRequest, http_request: Request):
+    """項目別の演技分析を、完了した項目から Server-Sent Events で配信する"""
+    client_id = client_id_for(http_request)
+    context = await prepare_routine_analysis(request)
+    if context is None:
+        raise HTTPException(status_code=400, detail=f"未対応の種目または空の演技構成です: {request.apparatus}")
+
+    async def events():
+        usage = start_usage()
+        sections = []
+        async for section in iter_sections(context, section_generator(client_id, request.apparatus), TOKEN_LEDGER.remaining(client_id)):
+            sections.append(section)
+            yield f"event: section\ndata: {json.dumps(section.to_dict(), ensure_ascii=False)}\n\n"
+        result = {
+            **routine_analysis_result(request, compose_sections(sections), context),
+            **TOKEN_LEDGER.record(client_id, usage)
+        }
+        await speculate_follow_ups(request, client_id)
+        yield f"event: result\ndata: {json.dumps(result, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def analysis_job_key(request: RoutineAnalysisRequest) -> str:
+    """演技分析ジョブの重複排除キー"""
+    return routine_hash(
+        request.apparatus,
+        request.routine_data,
+        total_score=request.total_score,
+        difficulty_score=request.difficulty_score,
+        group_bonus=request.group_bonus,
+        connection_bonus=request.connection_bonus,
+        message=request.message,
+        sectioned=request.sectioned
+    )
+
+async def run_analysis_job(request: RoutineAnalysisRequest, client_id: str) -> Dict:
+    """ジョブとして分析する（利用量は登録したクライアントに計上し、共有する結果からは除く）"""
+    result = await run_routine_analysis(request, client_id)
+    return {key: value for key, value in result.items() if key not in LEDGER_FIELDS}
+
+def analysis_job_response(job: AnalysisJob, client_id: str) -> Dict:
+    """ジョブの状態（結果には問い合わせたクライアント自身の利用回数・残り予算を付ける）"""
+    data = job.to_dict()
+    if data.get("result") is not None:
+        data["result"] = {**data["result"], **TOKEN_LEDGER.counts(client_id)}
+    return data
+
+@app.post("/analyze_routine/jobs")
+async def submit_analysis_job(request: RoutineAnalysisRequest, http_request: Request):
+    """演技分析をジョブとして登録し、すぐにジョブIDを返す"""
+    client_id = client_id_for(http_request)
+    try:
+        job, deduplicated = ANALYSIS_JOBS.submit(
+            analysis_job_key(request),
+            lambda: run_analysis_job(request, client_id)
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {**analysis_job_response(job, client_id), "deduplicated": deduplicated}
+
+@app.get("/analyze_routine/jobs/{job_id}")
+async def get_analysis_job(job_id: str, http_request: Request, wait: float = 0.0):
+    """ジョブの状態と結果を返す（wait 秒まで完了を待つロングポーリング可）"""
+    job = ANALYSIS_JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません（期限切れの可能性があります）")
+    await ANALYSIS_JOBS.wait(job, min(wait, 30.0))
+    return analysis_job_response(job, client_id_for(http_request))
+
+@app.get("/analyze_routine/jobs/{job_id}/stream")
+async def stream_analysis_job(job_id: str, http_request: Request):
+    """ジョブの状態変化を Server-Sent Events で配信する"""
+    client_id = client_id_for(http_request)
+    job = ANALYSIS_JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません（期限切れの可能性があります）")
+
+    async def events():
+        yield f"event: status\ndata: {json.dumps({'job_id': job.id, 'status': job.status})}\n\n"
+        while job.status not in (JOB_DONE, JOB_ERROR):
+            await ANALYSIS_JOBS.wait(job, 15.0)
+            if job.status not in (JOB_DONE, JOB_ERROR):
+                # 接続維持用のコメント行
+                yield ": keep-alive\n\n"
+        yield f"event: result\ndata: {json.dumps(analysis_job_response(job, client_id), ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 def format_routine_data(routine_data: List[Dict]) -> str:
     """演技データを読みやすい形式でフォーマット"""
     formatted_skills = []
@@ -419,14 +832,28 @@ def format_routine_data(routine_data: List[Dict]) -> str:
     
     return '\n'.join(formatted_skills)
 
-@app.post("/quick_analysis")
-async def quick_analysis_endpoint(request: RoutineAnalysisRequest):
-    """ワンクリック分析 - 「なぜこの点数？」に即答"""
-    try:
-        apparatus_name = get_apparatus_name(request.apparatus)
-        
-        # ワンクリック質問用の簡潔なプロンプト
-        quick_message = f"""「なぜこの点数になったのか？」を詳しく説明してください。
+def quick_analysis_key(request: RoutineAnalysisRequest, client_id: str) -> str:
+    """ワンクリック分析の投機キャッシュのキー（質問文は使わないため含めない）
+
+    投機計算のトークンは起動したクライアントに計上するため、結果もそのクライアントにだけ返す。
+    """
+    return routine_hash(
+        request.apparatus,
+        request.routine_data,
+        total_score=request.total_score,
+        difficulty_score=request.difficulty_score,
+        group_bonus=request.group_bonus,
+        connection_bonus=request.connection_bonus,
+        client_id=client_id
+    )
+
+async def run_quick_analysis(request: RoutineAnalysisRequest, max_tokens: int) -> Tuple[Dict, TokenUsage]:
+    """「なぜこの点数？」の説明を生成する（エンドポイントと投機計算で共用）"""
+    usage = start_usage()
+    apparatus_name = get_apparatus_name(request.apparatus)
+    
+    # ワンクリック質問用の簡潔なプロンプト
+    quick_message = f"""「なぜこの点数になったのか？」を詳しく説明してください。
 
 【計算結果】
 総得点: {request.total_score}点
@@ -440,29 +867,187 @@ async def quick_analysis_endpoint(request: RoutineAnalysisRequest):
 この点数の根拠を、初心者にも分かりやすく、しかし詳細に説明してください。
 計算式も含めて具体的にお答えください。"""
 
-        knowledge_context = search_knowledge(f"{apparatus_name} 点数計算")
-        
-        response = await get_ai_response(
-            quick_message,
-            knowledge_context,
-            request.routine_data,
-            request.apparatus
-        )
+    knowledge_context = search_knowledge(f"{apparatus_name} 点数計算", apparatus=request.apparatus)
+    response = await get_ai_response(
+        quick_message,
+        knowledge_context,
+        request.routine_data,
+        request.apparatus,
+        max_tokens=max_tokens
+    )
+    
+    return {
+        "explanation": response,
+        "score_breakdown": {
+            "total": request.total_score,
+            "difficulty": request.difficulty_score,
+            "group_bonus": request.group_bonus,
+            "connection_bonus": request.connection_bonus
+        }
+    }, usage
+
+async def speculate_follow_ups(request: RoutineAnalysisRequest, client_id: str) -> None:
+    """分析完了後、次に押される「なぜこの点数？」を先に計算しておく（保存済みなら計算しない）"""
+    if TOKEN_LEDGER.exhausted(client_id):
+        return
+    try:
+        if await asyncio.to_thread(ANALYSIS_STORE.contains, stored_analysis_key("quick_analysis", request)):
+            return
+    except Exception as e:
+        print(f"分析ストア読み込みエラー: {e}")
+        return
+    max_tokens = choose_max_tokens("explanation", TOKEN_LEDGER.remaining(client_id))
+    SPECULATION.schedule(quick_analysis_key(request, client_id), lambda: run_quick_analysis(request, max_tokens))
+
+@app.post("/quick_analysis")
+async def quick_analysis_endpoint(request: RoutineAnalysisRequest, http_request: Request):
+    """ワンクリック分析 - 「なぜこの点数？」に即答"""
+    try:
+        client_id = client_id_for(http_request)
+        store_key = stored_analysis_key("quick_analysis", request)
+        stored = await load_stored_analysis(store_key)
+        annotate(analysis_store="hit" if stored else "miss")
+        if stored:
+            return {**stored, "speculative": False, "stored": True, **TOKEN_LEDGER.record(client_id, TokenUsage())}
+
+        # 直前の /analyze_routine で投機計算済みならそれを返す（計算中なら完了を待つ）
+        speculated = await SPECULATION.take(quick_analysis_key(request, client_id))
+        if speculated:
+            result, usage = speculated
+        else:
+            result, usage = await run_quick_analysis(
+                request,
+                choose_max_tokens("explanation", TOKEN_LEDGER.remaining(client_id))
+            )
+        annotate(speculative=speculated is not None)
+        await save_stored_analysis(store_key, "quick_analysis", result, usage)
         
         return {
-            "explanation": response,
-            "score_breakdown": {
-                "total": request.total_score,
-                "difficulty": request.difficulty_score,
-                "group_bonus": request.group_bonus,
-                "connection_bonus": request.connection_bonus
-            }
+            **result,
+            "speculative": speculated is not None,
+            "stored": False,
+            **TOKEN_LEDGER.record(client_id, usage)
         }
         
     except Exception as e:
         print(f"クイック分析エラー: {e}")
         raise HTTPException(status_code=500, detail=f"クイック分析エラー: {str(e)}")
 
+@app.get("/speculation/stats")
+async def speculation_stats():
+    """投機計算のヒット率・無駄になった計算量"""
+    return SPECULATION.stats()
+
+@app.get("/analysis_store/stats")
+async def analysis_store_stats():
+    """分析ストアのヒット数・保存件数・サイズ（ヒット数などはこのワーカーの値）"""
+    return await asyncio.to_thread(ANALYSIS_STORE.stats)
+
+@app.post("/routine/diagnostics")
+async def routine_diagnostics_endpoint(request: RoutineDiagnosticsRequest):
+    """グループ要求・技数・終末技などの規則違反と、失っている点数"""
+    if request.apparatus not in APPARATUS_RULES:
+        raise HTTPException(status_code=400, detail=f"未対応の種目です: {request.apparatus}")
+    return diagnose_routine(
+        request.apparatus,
+        routine_skills_from_payload(request.apparatus, request.routine_data)
+    )
+
+@app.post("/routine/connections")
+async def routine_connections_endpoint(request: ConnectionAnalysisRequest):
+    """連続技ボーナスの一括採点と、ボーナス最大化の並び替え提案"""
+    if request.apparatus not in APPARATUS_RULES:
+        raise HTTPException(status_code=400, detail=f"未対応の種目です: {request.apparatus}")
+    started = time.perf_counter()
+    fixed_positions = request.fixed_positions
+    if fixed_positions is None:
+        fixed_positions = [len(request.routine_data) - 1] if request.routine_data and request.apparatus != "FX" else []
+    result = await run_cpu_task("connections", analyze_routine_connections, request.apparatus, request.routine_data, fixed_positions, request.optimize)
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+@app.post("/simulate")
+async def simulate_endpoint(request: SimulationRequest):
+    """技ごとの成功確率からDスコア分布をモンテカルロ法で推定する"""
+    if request.apparatus not in APPARATUS_RULES:
+        raise HTTPException(status_code=400, detail=f"未対応の種目です: {request.apparatus}")
+    try:
+        return await run_cpu_task("simulate", simulate_routine, request.apparatus, request.routine_data, {
+            "success_probabilities": request.success_probabilities,
+            "connections": request.connections,
+            "downgrade_share": request.downgrade_share,
+            "trials": request.trials,
+            "seed": request.seed
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/metrics/tasks")
+async def task_metrics():
+    """処理の種類ごとの待ち行列の長さ・実行中の数・所要時間"""
+    return TASK_POOL.stats()
+
+@app.get("/metrics/jobs")
+async def job_metrics():
+    """演技分析ジョブの状態ごとの件数・待ち行列の長さ・重複排除した件数"""
+    return ANALYSIS_JOBS.stats()
+
+@app.post("/routine/sessions")
+async def create_routine_session(request: RoutineSessionRequest):
+    """演技構成をサーバー側に保持し、以降は編集操作だけで再採点する"""
+    skills = routine_skills_from_payload(request.apparatus, request.routine_data)
+    connections = connections_from_groups(request.connection_groups or [], len(skills))
+    try:
+        session = ROUTINE_SESSIONS.create(request.apparatus, skills, connections)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return session.to_dict()
+
+@app.get("/routine/sessions/{session_id}")
+async def get_routine_session(session_id: str):
+    session = ROUTINE_SESSIONS.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="セッションが見つかりません")
+    return session.to_dict()
+
+@app.post("/routine/sessions/{session_id}/edits")
+async def edit_routine_session(session_id: str, request: RoutineEditRequest):
+    """編集操作を1件適用し、採点結果の変化した項目のみを返す"""
+    session = ROUTINE_SESSIONS.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="セッションが見つかりません")
+    if request.version is not None and request.version != session.version:
+        raise HTTPException(status_code=409, detail=f"セッションの版が一致しません（現在: {session.version}）")
+    started = time.perf_counter()
+    skill = routine_skills_from_payload(session.apparatus, [request.skill])[0] if request.skill else None
+    try:
+        apply_edit(session, request.op, request.index, request.target, skill, request.connected)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    changed = session.rescore()
+    return {
+        "session_id": session.id,
+        "version": session.version,
+        "changed": changed,
+        "elapsed_us": round((time.perf_counter() - started) * 1e6, 1)
+    }
+
+@app.delete("/routine/sessions/{session_id}")
+async def delete_routine_session(session_id: str):
+    if not ROUTINE_SESSIONS.delete(session_id):
+        raise HTTPException(status_code=404, detail="セッションが見つかりません")
+    return {"deleted": session_id}
+
+@app.get("/skills/{skill_id}/alternatives")
+async def skill_alternatives_endpoint(skill_id: str):
+    """同じグループで難度を上げる／下げる代替技の候補"""
+    entry = SKILL_ALTERNATIVES.lookup(skill_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"技が見つかりません: {skill_id}")
+    return entry
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8080))
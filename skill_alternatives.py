@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+代替技インデックス - 技ごとの「難度を上げる／下げる」入れ替え候補
+
+技カタログ（skills_ja.csv）から、同じ種目・同じグループで難度の異なる技を
+近い難度から順に並べた索引をオフラインで作り、data/skill_alternatives.json に保存する。
+各候補には入れ替えによる難度点・グループボーナス（その技がグループ最高難度の場合）の差と、
+連続技ボーナスの対象となる相手技の数の変化を記録する。
+演技構成に対しては calculate_d_score で入れ替え後のDスコアを計算し直し、正確な差分を返す。
+
+使い方:
+    python skill_alternatives.py            # data/skill_alternatives.json を再生成
+    python skill_alternatives.py --dry-run  # 件数だけ表示
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+from connection_matrix import get_connection_matrix
+from dscore import APPARATUS_RULES, RoutineSkill, calculate_d_score, group_bonus_for, routine_skills_from_payload
+from skill_catalog import APPARATUS_NAMES, DATA_DIR, Skill, load_skills_ja
+
+ALTERNATIVES_FILE = os.path.join(DATA_DIR, "skill_alternatives.json")
+CATALOG_FILE = os.path.join(DATA_DIR, "skills_ja.csv")
+INDEX_VERSION = 1
+
+# 1技あたりに保存する候補数
+MAX_UPGRADES = 3
+MAX_DOWNGRADES = 2
+# プロンプトに載せる候補数（技ごと）
+PROMPT_UPGRADES = 2
+PROMPT_DOWNGRADES = 1
+
+
+def _catalog_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def connection_partner_counts(catalog: Sequence[Skill]) -> Dict[str, int]:
+    """技ごとに、前後どちらかにつないで連続技ボーナスが付く相手技の数"""
+    counts: Dict[str, int] = {}
+    for apparatus in APPARATUS_NAMES:
+        cm = get_connection_matrix(apparatus)
+        eligible = (cm.skill_matrix > 0).sum(axis=1) + (cm.skill_matrix > 0).sum(axis=0)
+        for skill, count in zip(cm.skills, eligible):
+            counts[skill.id] = int(count)
+    return counts
+
+
+def _alternative(skill: Skill, candidate: Skill, partners: Dict[str, int]) -> Dict:
+    return {
+        "id": candidate.id,
+        "value_delta": round(candidate.value - skill.value, 2),
+        "group_bonus_delta": round(
+            group_bonus_for(skill.apparatus, skill.group, candidate.value)
+            - group_bonus_for(skill.apparatus, skill.group, skill.value), 2
+        ),
+        "connection_partners_delta": partners.get(candidate.id, 0) - partners.get(skill.id, 0),
+    }
+
+
+def build_index(catalog: Sequence[Skill]) -> Dict:
+    """同じ種目・グループの技を難度の近い順（同難度なら連続技の相手が多い順）に並べる"""
+    partners = connection_partner_counts(catalog)
+    by_group: Dict[tuple, List[Skill]] = {}
+    for skill in catalog:
+        if skill.group and skill.value > 0:
+            by_group.setdefault((skill.apparatus, skill.group), []).append(skill)
+
+    skills: Dict[str, Dict] = {}
+    for skill in catalog:
+        peers = [c for c in by_group.get((skill.apparatus, skill.group), []) if c.name != skill.name]
+        rank = lambda c: (abs(c.value - skill.value), -partners.get(c.id, 0), c.id)
+        upgrades = sorted((c for c in peers if c.value > skill.value), key=rank)[:MAX_UPGRADES]
+        downgrades = sorted((c for c in peers if c.value < skill.value), key=rank)[:MAX_DOWNGRADES]
+        skills[skill.id] = {
+            "name": skill.name,
+            "apparatus": skill.apparatus,
+            "group": skill.group,
+            "value_letter": skill.value_letter,
+            "value": skill.value,
+            "connection_partners": partners.get(skill.id, 0),
+            "upgrades": [_alternative(skill, c, partners) for c in upgrades],
+            "downgrades": [_alternative(skill, c, partners) for c in downgrades],
+        }
+    return {"version": INDEX_VERSION, "skills": skills}
+
+
+class AlternativeIndex:
+    """代替技インデックスの参照と、演技構成に対する入れ替え効果の計算"""
+
+    def __init__(self, index: Optional[Dict] = None):
+        self.skills: Dict[str, Dict] = (index or {}).get("skills", {})
+        self._by_name: Dict[tuple, str] = {(e["apparatus"], e["name"]): skill_id for skill_id, e in self.skills.items()}
+
+    @classmethod
+    def from_file(cls, path: str = ALTERNATIVES_FILE, catalog_path: str = CATALOG_FILE) -> "AlternativeIndex":
+        """生成元の技カタログのハッシュが現在の内容と一致する場合のみ読み込む（古い索引は使わない）"""
+        if not os.path.exists(path):
+            print(f"代替技インデックスが見つかりません: {path}（python skill_alternatives.py で生成できます）")
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if os.path.exists(catalog_path) and index.get("source_sha256") != _catalog_sha256(catalog_path):
+            print(f"代替技インデックスが技カタログより古いため使いません: {path}（python skill_alternatives.py で再生成してください）")
+            return cls()
+        return cls(index)
+
+    def __len__(self) -> int:
+        return len(self.skills)
+
+    def find_id(self, apparatus: str, name: str) -> Optional[str]:
+        return self._by_name.get((apparatus, name.strip()))
+
+    def lookup(self, skill_id: str) -> Optional[Dict]:
+        """技IDの代替候補（候補の技名・難度を展開したもの）"""
+        entry = self.skills.get(skill_id)
+        if entry is None:
+            return None
+
+        def expand(alternative: Dict) -> Dict:
+            target = self.skills[alternative["id"]]
+            return {
+                **alternative,
+                "name": target["name"],
+                "value_letter": target["value_letter"],
+                "value": target["value"],
+                "d_score_delta_if_highest": round(alternative["value_delta"] + alternative["group_bonus_delta"], 2),
+            }
+
+        return {
+            "id": skill_id,
+            **{k: v for k, v in entry.items() if k not in ("upgrades", "downgrades")},
+            "upgrades": [expand(a) for a in entry["upgrades"]],
+            "downgrades": [expand(a) for a in entry["downgrades"]],
+        }
+
+    def routine_alternatives(self, apparatus: str, routine_data: Sequence[Dict]) -> List[Dict]:
+        """演技構成の各技について、入れ替えた場合のDスコア・連続技ボーナスの差を計算し直す"""
+        if apparatus not in APPARATUS_RULES or not routine_data:
+            return []
+        skills = routine_skills_from_payload(apparatus, routine_data)
+        baseline = calculate_d_score(apparatus, skills)
+        in_routine = {skill.name for skill in skills}
+        suggestions = []
+        for position, (item, skill) in enumerate(zip(routine_data, skills)):
+            skill_id = item.get("id") if item.get("id") in self.skills else self.find_id(apparatus, skill.name)
+            entry = self.skills.get(skill_id) if skill_id else None
+            if entry is None:
+                continue
+            swaps = []
+            for direction, limit in (("upgrades", PROMPT_UPGRADES), ("downgrades", PROMPT_DOWNGRADES)):
+                candidates = [a for a in entry[direction] if self.skills[a["id"]]["name"] not in in_routine]
+                for alternative in candidates[:limit]:
+                    target = self.skills[alternative["id"]]
+                    swapped = list(skills)
+                    swapped[position] = RoutineSkill(
+                        name=target["name"],
+                        group=target["group"],
+                        value=target["value"],
+                        value_letter=target["value_letter"],
+                        connected_to_next=skill.connected_to_next,
+                    )
+                    result = calculate_d_score(apparatus, swapped)
+                    swaps.append({
+                        "id": alternative["id"],
+                        "name": target["name"],
+                        "value_letter": target["value_letter"],
+                        "direction": "up" if direction == "upgrades" else "down",
+                        "d_score_delta": round(result["total_d_score"] - baseline["total_d_score"], 2),
+                        "connection_bonus_delta": round(result["connection_bonus"] - baseline["connection_bonus"], 2),
+                        "connection_partners_delta": alternative["connection_partners_delta"],
+                    })
+            if swaps:
+                suggestions.append({"position": position, "id": skill_id, "name": skill.name, "alternatives": swaps})
+        return suggestions
+
+    def format_for_prompt(self, apparatus: str, routine_data: Sequence[Dict]) -> str:
+        """分析プロンプト用の簡潔な代替技候補（1技1行）"""
+        lines = []
+        for suggestion in self.routine_alternatives(apparatus, routine_data):
+            swaps = []
+            for swap in suggestion["alternatives"]:
+                note = f"D{swap['d_score_delta']:+.2f}"
+                if swap["connection_bonus_delta"]:
+                    note += f"/連続{swap['connection_bonus_delta']:+.1f}"
+                swaps.append(f"{'↑' if swap['direction'] == 'up' else '↓'}{swap['name']}({swap['value_letter']},{note})")
+            lines.append(f"{suggestion['position'] + 1}. {suggestion['name']} → {' '.join(swaps)}")
+        if not lines:
+            return ""
+        return "【代替技候補（技カタログより・Dは本構成での再計算値）】\n" + "\n".join(lines)
+
+
+def write_index(index: Dict, path: str = ALTERNATIVES_FILE) -> None:
+    index = {**index, "source_sha256": _catalog_sha256(CATALOG_FILE), "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    print(f"✅ 書き出し: {path} ({len(index['skills'])} 技, {os.path.getsize(path) // 1024} KB)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="技カタログから代替技インデックスを作る")
+    parser.add_argument("--output", default=ALTERNATIVES_FILE, help="出力先")
+    parser.add_argument("--dry-run", action="store_true", help="書き出さずに件数だけ表示する")
+    args = parser.parse_args()
+
+    index = build_index(load_skills_ja(CATALOG_FILE))
+    with_alternatives = sum(1 for e in index["skills"].values() if e["upgrades"] or e["downgrades"])
+    print(f"技: {len(index['skills'])} / 代替候補あり: {with_alternatives}")
+    if not args.dry_run:
+        write_index(index, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+技カタログ読み込み - skills_ja.csv と skills_*.json を共通形式で扱う
+
+アプリ側（lib/d_score_calculator.dart の Skill.fromMap）と同じ規則で
+グループ（ローマ数字）と難度レター（跳馬は得点そのもの）を数値化する。
+"""
+
+import csv
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+DATA_DIR = "data"
+
+# 難度レター → 価値点（跳馬以外）
+LETTER_VALUES: Dict[str, float] = {
+    "A": 0.1, "B": 0.2, "C": 0.3, "D": 0.4, "E": 0.5,
+    "F": 0.6, "G": 0.7, "H": 0.8, "I": 0.9, "J": 1.0,
+}
+
+ROMAN_GROUPS: Dict[str, int] = {
+    "Ⅰ": 1, "I": 1,
+    "Ⅱ": 2, "II": 2,
+    "Ⅲ": 3, "III": 3,
+    "Ⅳ": 4, "IV": 4,
+    "Ⅴ": 5, "V": 5,
+}
+
+GROUP_ROMAN: Dict[int, str] = {1: "Ⅰ", 2: "Ⅱ", 3: "Ⅲ", 4: "Ⅳ", 5: "Ⅴ"}
+
+APPARATUS_NAMES: Dict[str, str] = {
+    "FX": "床運動",
+    "PH": "あん馬",
+    "SR": "つり輪",
+    "VT": "跳馬",
+    "PB": "平行棒",
+    "HB": "鉄棒",
+}
+
+# 英語カタログ（種目コード → ファイル名）
+EN_CATALOG_FILES: Dict[str, str] = {
+    "FX": "skills_fx.json",
+    "PH": "skills_ph.json",
+    "SR": "skills_sr.json",
+    "PB": "skills_pb.json",
+}
+
+
+@dataclass(frozen=True)
+class Skill:
+    """カタログ上の1技"""
+    id: str
+    apparatus: str
+    name: str
+    group: int
+    value_letter: str
+    value: float
+    lang: str
+    source: str
+
+
+def parse_group(group: Optional[str]) -> int:
+    """"Ⅱ" / "Group II" / "2" をグループ番号に変換（不明なら0）"""
+    if group is None:
+        return 0
+    text = str(group).strip()
+    if text.lower().startswith("group"):
+        text = text[5:].strip()
+    if text.isdigit():
+        return int(text)
+    return ROMAN_GROUPS.get(text, 0)
+
+
+def parse_value(apparatus: str, value_letter: Optional[str]) -> float:
+    """難度レターを価値点に変換（跳馬はレター欄の得点をそのまま使う）"""
+    letter = (value_letter or "").strip().upper()
+    if apparatus == "VT":
+        try:
+            return float(letter)
+        except ValueError:
+            return 0.0
+    return LETTER_VALUES.get(letter, 0.0)
+
+
+def load_skills_ja(path: str = os.path.join(DATA_DIR, "skills_ja.csv")) -> List[Skill]:
+    """日本語技カタログ（skills_ja.csv）を読み込む"""
+    skills: List[Skill] = []
+    if not os.path.exists(path):
+        return skills
+    counters: Dict[str, int] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            apparatus = (row.get("apparatus") or "").strip()
+            if apparatus not in APPARATUS_NAMES:
+                continue
+            counters[apparatus] = counters.get(apparatus, 0) + 1
+            letter = (row.get("value_letter") or "").strip()
+            skills.append(Skill(
+                id=f"{apparatus}_{counters[apparatus]:03d}",
+                apparatus=apparatus,
+                name=(row.get("name") or "").strip(),
+                group=parse_group(row.get("group")),
+                value_letter=letter,
+                value=parse_value(apparatus, letter),
+                lang="ja",
+                source=os.path.basename(path),
+            ))
+    return skills
+
+
+def load_skills_en(data_dir: str = DATA_DIR) -> List[Skill]:
+    """英語技カタログ（skills_*.json）を読み込む"""
+    skills: List[Skill] = []
+    for apparatus, file_name in EN_CATALOG_FILES.items():
+        path = os.path.join(data_dir, file_name)
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        for entry in entries:
+            letter = str(entry.get("value_letter", "")).strip()
+            skills.append(Skill(
+                id=f"{apparatus}_en_{entry.get('id', '')}",
+                apparatus=apparatus,
+                name=str(entry.get("name", "")).strip(),
+                group=parse_group(entry.get("group")),
+                value_letter=letter,
+                value=float(entry.get("value") or parse_value(apparatus, letter)),
+                lang="en",
+                source=file_name,
+            ))
+    return skills
+
+
+def load_catalog(data_dir: str = DATA_DIR) -> List[Skill]:
+    """日英すべての技カタログを読み込む"""
+    return load_skills_ja(os.path.join(data_dir, "skills_ja.csv")) + load_skills_en(data_dir)
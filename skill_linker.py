@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+技名エンティティリンク - 正規化トライグラム索引 + 別名表
+
+チャットメッセージ中の技名（「コールマン」「Handspring salto fwd. tuck」等）を
+技カタログの項目と skills_difficulty_tables.md の該当箇所に結び付け、
+その技の正確な事実だけをプロンプトへ渡す。
+"""
+
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from skill_catalog import APPARATUS_NAMES, DATA_DIR, GROUP_ROMAN, Skill, load_catalog
+
+TABLES_FILE = "skills_difficulty_tables.md"
+
+# 1つの言及が指す技がこれより多い場合は曖昧として採用しない
+MAX_AMBIGUOUS_SKILLS = 3
+
+# 英字表記の通称 → カタログ上の日本語通称
+ROMAJI_ALIASES: Dict[str, str] = {
+    "kovacs": "コバチ",
+    "kolman": "コールマン",
+    "cassina": "カッシーナ",
+    "tkatchev": "トカチェフ",
+    "yamawaki": "ヤマワキ",
+    "endo": "エンドー",
+    "stalder": "シュタルダー",
+    "tsukahara": "ツカハラ",
+    "yurchenko": "ユルチェンコ",
+    "healy": "ヒーリー",
+    "diamidov": "ディアミドフ",
+    "honma": "ホンマ",
+    "azarian": "アザリアン",
+    "behle": "ベーレ",
+    "gaylord": "ゲイロード",
+    "gienger": "ギンガー",
+    "jaeger": "イエーガー",
+    "liukin": "リューキン",
+    "nagornyy": "ナゴルニー",
+    "bretschneider": "ブレットシュナイダー",
+    "miyachi": "ミヤチ",
+}
+
+_NICKNAME_PATTERN = re.compile(r"^[（(]([^）)]*)[）)]")
+_TABLE_ROW_PATTERN = re.compile(r"^\|\s*(.+?)\s*\|\s*([A-J]|\d+(?:\.\d+)?)\s*\|\s*$")
+
+
+def normalize(text: str) -> str:
+    """全角半角・大小文字・記号・空白の差を吸収する"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if ch.isalnum())
+
+
+def _normalize_with_breaks(text: str) -> Tuple[str, Set[int]]:
+    """normalize() の結果と、元の文で空白・記号をはさんでいた位置（語の切れ目）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    chars: List[str] = []
+    breaks = {0}
+    for ch in text:
+        if ch.isalnum():
+            chars.append(ch)
+        else:
+            breaks.add(len(chars))
+    breaks.add(len(chars))
+    return "".join(chars), breaks
+
+
+def _is_katakana(ch: str) -> bool:
+    return "ァ" <= ch <= "ヺ" or ch == "ー"
+
+
+def _inside_katakana_word(text: str, start: int, end: int) -> bool:
+    """カタカナの別名が、より長いカタカナ語の一部に一致していないか（「グループ」中の「ループ」等）"""
+    if not all(_is_katakana(ch) for ch in text[start:end]):
+        return False
+    return (start > 0 and _is_katakana(text[start - 1])) or (end < len(text) and _is_katakana(text[end]))
+
+
+def _is_ascii_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+def _inside_ascii_word(text: str, breaks: Set[int], start: int, end: int) -> bool:
+    """英字の別名が、空白を除く前の英単語の途中に一致していないか（「tendon」中の「endo」等）"""
+    if _is_ascii_word_char(text[start]) and start not in breaks and _is_ascii_word_char(text[start - 1]):
+        return True
+    return _is_ascii_word_char(text[end - 1]) and end not in breaks and end < len(text) and _is_ascii_word_char(text[end])
+
+
+def _inside_word(text: str, breaks: Set[int], start: int, end: int) -> bool:
+    return _inside_katakana_word(text, start, end) or _inside_ascii_word(text, breaks, start, end)
+
+
+def _trigrams(text: str) -> Iterable[str]:
+    return (text[i:i + 3] for i in range(len(text) - 2))
+
+
+def extract_aliases(name: str) -> List[str]:
+    """技名から別名（先頭の括弧内通称と、通称を除いた本体名）を取り出す"""
+    aliases = [name]
+    rest = name
+    while True:
+        m = _NICKNAME_PATTERN.match(rest)
+        if not m:
+            break
+        inner = m.group(1).split("：")[-1].split(":")[-1]
+        aliases.extend(part for part in re.split(r"[、,/／]", inner) if part.strip())
+        rest = rest[m.end():]
+    if rest != name and rest.strip():
+        aliases.append(rest)
+    return aliases
+
+
+def load_table_references(path: str) -> Dict[Tuple[str, str], Tuple[str, int]]:
+    """難度表の (種目, 技名) → (見出し, 行番号) を作る"""
+    references: Dict[Tuple[str, str], Tuple[str, int]] = {}
+    if not os.path.exists(path):
+        return references
+    apparatus, apparatus_heading, group_heading = "", "", ""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.rstrip("\n")
+            if line.startswith("## "):
+                apparatus_heading = line[3:].strip()
+                apparatus = apparatus_heading[:2]
+                group_heading = ""
+            elif line.startswith("### "):
+                group_heading = line[4:].strip()
+            else:
+                m = _TABLE_ROW_PATTERN.match(line)
+                if m and apparatus in APPARATUS_NAMES and m.group(1) != "技名":
+                    heading = f"{apparatus_heading} / {group_heading}" if group_heading else apparatus_heading
+                    references.setdefault((apparatus, m.group(1)), (heading, line_no))
+    return references
+
+
+@dataclass
+class SkillMention:
+    """メッセージ中の技名言及"""
+    surface: str
+    start: int
+    end: int
+    skills: List[Skill]
+
+
+class SkillLinker:
+    """技名の正規化トライグラム索引"""
+
+    def __init__(self, skills: List[Skill], references: Optional[Dict[Tuple[str, str], Tuple[str, int]]] = None):
+        self.skills = skills
+        self.references = references or {}
+
+        # 正規化別名 → 技インデックス
+        alias_skills: Dict[str, List[int]] = defaultdict(list)
+        for idx, skill in enumerate(skills):
+            for alias in extract_aliases(skill.name):
+                key = normalize(alias)
+                if len(key) >= 2 and idx not in alias_skills[key]:
+                    alias_skills[key].append(idx)
+        for romaji, katakana in ROMAJI_ALIASES.items():
+            targets = alias_skills.get(normalize(katakana))
+            if targets:
+                alias_skills[romaji] = list(targets)
+
+        self._aliases: List[str] = list(alias_skills)
+        self._alias_skills: List[List[int]] = [alias_skills[a] for a in self._aliases]
+
+        # 各別名は最も出現頻度の低いトライグラム（アンカー）1つだけに登録する
+        frequency: Dict[str, int] = defaultdict(int)
+        for alias in self._aliases:
+            for tri in set(_trigrams(alias)):
+                frequency[tri] += 1
+        self._anchor_index: Dict[str, List[int]] = defaultdict(list)
+        self._short_aliases: Dict[str, int] = {}
+        for alias_idx, alias in enumerate(self._aliases):
+            if len(alias) < 3:
+                self._short_aliases[alias] = alias_idx
+                continue
+            anchor = min(set(_trigrams(alias)), key=lambda tri: (frequency[tri], tri))
+            self._anchor_index[anchor].append(alias_idx)
+
+    @classmethod
+    def from_data(cls, data_dir: str = DATA_DIR) -> "SkillLinker":
+        return cls(load_catalog(data_dir), load_table_references(os.path.join(data_dir, TABLES_FILE)))
+
+    def link(self, message: str, apparatus: Optional[List[str]] = None) -> List[SkillMention]:
+        """メッセージ中の技名言及を返す（長い一致を優先、重複区間は除外）"""
+        text, breaks = _normalize_with_breaks(message)
+        candidates: List[Tuple[int, int, int]] = []
+        seen = set()
+        for tri in set(_trigrams(text)):
+            for alias_idx in self._anchor_index.get(tri, ()):
+                if alias_idx in seen:
+                    continue
+                seen.add(alias_idx)
+                # 語の途中に一致した箇所は飛ばし、語として現れる最初の箇所を採る
+                alias = self._aliases[alias_idx]
+                start = text.find(alias)
+                while start >= 0 and _inside_word(text, breaks, start, start + len(alias)):
+                    start = text.find(alias, start + 1)
+                if start >= 0:
+                    candidates.append((start, start + len(alias), alias_idx))
+        for i in range(len(text) - 1):
+            alias_idx = self._short_aliases.get(text[i:i + 2])
+            if alias_idx is not None and not _inside_word(text, breaks, i, i + 2):
+                candidates.append((i, i + 2, alias_idx))
+
+        mentions: List[SkillMention] = []
+        taken: List[Tuple[int, int]] = []
+        for start, end, alias_idx in sorted(candidates, key=lambda c: (c[0] - c[1], c[0])):
+            if any(start < t_end and t_start < end for t_start, t_end in taken):
+                continue
+            skills = [self.skills[i] for i in self._alias_skills[alias_idx]]
+            if apparatus:
+                scoped = [s for s in skills if s.apparatus in apparatus]
+                skills = scoped or skills
+            if len(skills) > MAX_AMBIGUOUS_SKILLS:
+                continue
+            taken.append((start, end))
+            mentions.append(SkillMention(self._aliases[alias_idx], start, end, skills))
+        mentions.sort(key=lambda m: m.start)
+        return mentions
+
+    def format_facts(self, mentions: List[SkillMention]) -> str:
+        """リンクされた技の事実と出典をプロンプト用に整形"""
+        if not mentions:
+            return ""
+        lines = ["【言及された技（技カタログより）】"]
+        emitted = set()
+        for mention in mentions:
+            for skill in mention.skills:
+                if skill.id in emitted:
+                    continue
+                emitted.add(skill.id)
+                if skill.apparatus == "VT":
+                    value_text = f"{skill.value_letter}点"
+                else:
+                    value_text = f"{skill.value_letter}難度（{skill.value:.1f}点）"
+                line = (f"- {skill.name}：{APPARATUS_NAMES.get(skill.apparatus, skill.apparatus)} "
+                        f"グループ{GROUP_ROMAN.get(skill.group, skill.group)} {value_text}")
+                reference = self.references.get((skill.apparatus, skill.name))
+                if reference:
+                    line += f"［出典: {TABLES_FILE}「{reference[0]}」{reference[1]}行目］"
+                else:
+                    line += f"［出典: {skill.source}］"
+                lines.append(line)
+        return "\n".join(lines)
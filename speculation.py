@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+投機的な先行計算 - 次に来る可能性が高い分析をバックグラウンドで用意する
+
+/analyze_routine の直後、アプリはほぼ必ず同じ演技構成で「なぜこの点数？」（/quick_analysis）を呼ぶ。
+分析の完了時に後続の分析を低優先度（同時実行数を絞り、少し遅らせて開始）で計算し、
+ルーチンハッシュをキーにしたキャッシュへ入れておく。2回目のタップは計算済みの結果を返すか、
+計算中ならその完了を待つ。使われずに期限切れとなった計算は無駄として数える。
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+SPECULATION_HIT = "hit"
+SPECULATION_JOINED = "joined"
+SPECULATION_MISS = "miss"
+
+
+@dataclass
+class SpeculativeEntry:
+    key: str
+    task: asyncio.Task
+    created_at: float = field(default_factory=time.time)
+    used: bool = False
+
+
+class SpeculativeCache:
+    """投機計算の結果キャッシュ（上限・TTL・1時間あたりの実行予算付き）"""
+
+    def __init__(self, concurrency: int = 1, start_delay: float = 0.2, ttl_seconds: float = 600.0,
+                 max_entries: int = 256, budget_per_hour: int = 200):
+        self.start_delay = start_delay
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.budget_per_hour = budget_per_hour
+        self._concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._entries: "OrderedDict[str, SpeculativeEntry]" = OrderedDict()
+        self._budget_window_start = time.time()
+        self._budget_used = 0
+        self.counters: Dict[str, int] = {
+            "scheduled": 0, "completed": 0, "failed": 0, "skipped_budget": 0,
+            SPECULATION_HIT: 0, SPECULATION_JOINED: 0, SPECULATION_MISS: 0, "wasted": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "SpeculativeCache":
+        return cls(
+            concurrency=int(os.environ.get("SPECULATION_CONCURRENCY", 1)),
+            ttl_seconds=float(os.environ.get("SPECULATION_TTL", 600)),
+            budget_per_hour=int(os.environ.get("SPECULATION_BUDGET_PER_HOUR", 200)),
+        )
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        if not entry.used:
+            self.counters["wasted"] += 1
+            if not entry.task.done():
+                entry.task.cancel()
+
+    def _purge(self) -> None:
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if now - e.created_at > self.ttl_seconds]:
+            self._discard(key)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+
+    def _take_budget(self) -> bool:
+        now = time.time()
+        if now - self._budget_window_start > 3600:
+            self._budget_window_start = now
+            self._budget_used = 0
+        if self._budget_used >= self.budget_per_hour:
+            return False
+        self._budget_used += 1
+        return True
+
+    def schedule(self, key: str, runner: Callable[[], Awaitable[Any]]) -> bool:
+        """後続の計算を予約する（既に予約済み・予算切れの場合は False）"""
+        self._purge()
+        if key in self._entries:
+            return False
+        if not self._take_budget():
+            self.counters["skipped_budget"] += 1
+            return False
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        self._entries[key] = SpeculativeEntry(key, asyncio.create_task(self._run(runner)))
+        self.counters["scheduled"] += 1
+        self._purge()
+        return True
+
+    async def _run(self, runner: Callable[[], Awaitable[Any]]) -> Any:
+        # 本来のレスポンス送信を優先させるため、少し遅らせてから低い同時実行数で計算する
+        await asyncio.sleep(self.start_delay)
+        async with self._semaphore:
+            try:
+                result = await runner()
+            except Exception:
+                self.counters["failed"] += 1
+                raise
+        self.counters["completed"] += 1
+        return result
+
+    async def take(self, key: str) -> Optional[Any]:
+        """投機結果を取り出す（計算中なら完了を待つ）。なければ None"""
+        self._purge()
+        entry = self._entries.get(key)
+        if entry is None or (entry.task.done() and (entry.task.cancelled() or entry.task.exception())):
+            self.counters[SPECULATION_MISS] += 1
+            return None
+        outcome = SPECULATION_HIT if entry.task.done() else SPECULATION_JOINED
+        try:
+            result = await asyncio.shield(entry.task)
+        except Exception:
+            self.counters[SPECULATION_MISS] += 1
+            return None
+        # 1回使ったら取り除く（同じ結果の利用量を二重に計上しない）
+        entry.used = True
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        self.counters[outcome] += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        self._purge()
+        served = self.counters[SPECULATION_HIT] + self.counters[SPECULATION_JOINED]
+        lookups = served + self.counters[SPECULATION_MISS]
+        finished = served + self.counters["wasted"]
+        return {
+            **self.counters,
+            "hit_rate": round(served / lookups, 3) if lookups else None,
+            "waste_rate": round(self.counters["wasted"] / finished, 3) if finished else None,
+            "in_flight": sum(1 for e in self._entries.values() if not e.task.done()),
+            "cached": len(self._entries),
+            "budget_remaining": max(0, self.budget_per_hour - self._budget_used),
+        }
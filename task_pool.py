@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+CPU処理用のプロセスプールとI/O用のスレッドプール
+
+Dスコアのシミュレーションや連続技の並び順最適化は数十ミリ秒 CPU を占有し、
+イベントループ上で実行すると /health やストリーミング応答まで止まる。
+処理の種類ごとに同時実行数・待ち行列の上限・タイムアウトを決めてプールへ送り、
+待ち行列の長さなどを指標として公開する。
+
+ワーカープロセスは起動時に技カタログと連続技ボーナス行列を読み込んでおくため、
+タスクには演技構成（routine_data）だけを渡せばよい。
+
+    TASK_POOL_PROCESSES  プロセス数（既定 2、0 ならスレッドで実行）
+    TASK_POOL_THREADS    I/O 用スレッド数（既定 8）
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from connection_matrix import analyze_connections, get_connection_matrix
+from dscore import routine_skills_from_payload
+from dscore_simulation import simulate_d_scores
+
+EXECUTOR_PROCESS = "process"
+EXECUTOR_THREAD = "thread"
+# 既定のワーカープロセス数（サーバーのワーカーごとに起動するため小さく固定し、必要な環境で TASK_POOL_PROCESSES を上げる）
+DEFAULT_PROCESSES = 2
+
+
+class TaskQueueFull(RuntimeError):
+    """待ち行列が上限に達している"""
+
+
+class TaskTimeout(RuntimeError):
+    """制限時間内に終わらなかった"""
+
+
+@dataclass
+class TaskType:
+    """処理の種類ごとの実行設定と指標"""
+    name: str
+    executor: str = EXECUTOR_PROCESS
+    concurrency: int = 2
+    max_queue: int = 32
+    timeout: float = 10.0
+    queued: int = 0
+    running: int = 0
+    counters: Dict[str, int] = field(default_factory=lambda: {
+        "completed": 0, "failed": 0, "timed_out": 0, "cancelled": 0, "rejected": 0,
+    })
+    total_ms: float = 0.0
+    _semaphore: Optional[asyncio.Semaphore] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        completed = self.counters["completed"]
+        return {
+            "executor": self.executor,
+            "concurrency": self.concurrency,
+            "queue_depth": self.queued,
+            "running": self.running,
+            "max_queue": self.max_queue,
+            **self.counters,
+            "avg_ms": round(self.total_ms / completed, 2) if completed else None,
+        }
+
+
+# --- ワーカープロセスで実行する関数（読み込み済みの行列を使う） ---
+
+def preload_worker() -> None:
+    """ワーカー起動時に技カタログと連続技ボーナス行列を読み込む"""
+    get_connection_matrix("FX")
+
+
+def simulate_routine(apparatus: str, routine_data: Sequence[Dict], options: Dict[str, Any]) -> Dict:
+    return simulate_d_scores(apparatus, routine_skills_from_payload(apparatus, routine_data), **options)
+
+
+def analyze_routine_connections(apparatus: str, routine_data: Sequence[Dict], fixed_positions: Sequence[int], optimize: bool) -> Dict:
+    return analyze_connections(apparatus, routine_skills_from_payload(apparatus, routine_data), fixed_positions, optimize)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class TaskPool:
+    """処理の種類ごとの待ち行列を持つ実行プール"""
+
+    def __init__(self, processes: int = 0, threads: int = 8):
+        self.processes = processes
+        self.threads = threads
+        self.types: Dict[str, TaskType] = {}
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "TaskPool":
+        return cls(
+            processes=int(os.environ.get("TASK_POOL_PROCESSES", DEFAULT_PROCESSES)),
+            threads=int(os.environ.get("TASK_POOL_THREADS", 8)),
+        )
+
+    def register(self, name: str, executor: str = EXECUTOR_PROCESS, concurrency: int = 2,
+                 max_queue: int = 32, timeout: float = 10.0) -> None:
+        self.types[name] = TaskType(name, executor, concurrency, max_queue, timeout)
+
+    def _executor(self, kind: str) -> Executor:
+        if kind == EXECUTOR_PROCESS and self.processes > 0:
+            if self._process_pool is None:
+                # 親プロセスはイベントループやスレッドを持つため fork せずに起動する
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=preload_worker,
+                )
+            return self._process_pool
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="task-pool")
+        return self._thread_pool
+
+    async def start(self) -> List[int]:
+        """ワーカーを起動してデータの読み込みまで済ませる（起動時のウォームアップ用）"""
+        if self.processes <= 0:
+            return []
+        loop = asyncio.get_running_loop()
+        executor = self._executor(EXECUTOR_PROCESS)
+        pids = await asyncio.gather(*(loop.run_in_executor(executor, _ping) for _ in range(self.processes)))
+        return sorted(set(pids))
+
+    async def run(self, name: str, func: Callable[..., Any], *args: Any) -> Any:
+        """種類 name の待ち行列に入れて実行する（満杯なら TaskQueueFull、時間切れなら TaskTimeout）"""
+        task_type = self.types[name]
+        if task_type.queued + task_type.running >= task_type.max_queue:
+            task_type.counters["rejected"] += 1
+            raise TaskQueueFull(f"{name} の待ち行列が満杯です（{task_type.max_queue}件）")
+        if task_type._semaphore is None:
+            task_type._semaphore = asyncio.Semaphore(task_type.concurrency)
+
+        task_type.queued += 1
+        try:
+            await task_type._semaphore.acquire()
+        except asyncio.CancelledError:
+            task_type.counters["cancelled"] += 1
+            raise
+        finally:
+            task_type.queued -= 1
+
+        task_type.running += 1
+        started = time.perf_counter()
+        future = self._executor(task_type.executor).submit(func, *args)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), task_type.timeout)
+        except asyncio.TimeoutError:
+            # 実行が始まっていない場合だけ取り消せる（実行中のプロセスは完了まで走る）
+            future.cancel()
+            task_type.counters["timed_out"] += 1
+            raise TaskTimeout(f"{name} が {task_type.timeout:g} 秒以内に終わりませんでした")
+        except asyncio.CancelledError:
+            future.cancel()
+            task_type.counters["cancelled"] += 1
+            raise
+        except Exception:
+            task_type.counters["failed"] += 1
+            raise
+        finally:
+            task_type.running -= 1
+            task_type._semaphore.release()
+        task_type.counters["completed"] += 1
+        task_type.total_ms += (time.perf_counter() - started) * 1000
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processes": self.processes,
+            "threads": self.threads,
+            "queue_depth": sum(t.queued for t in self.types.values()),
+            "types": {name: t.to_dict() for name, t in self.types.items()},
+        }
+
+    def shutdown(self) -> None:
+        for executor in (self._process_pool, self._thread_pool):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._process_pool = None
+        self._thread_pool = None
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+日英対訳用語辞書 - 英語の質問を翻訳 API なしで日本語の知識ベースに届ける
+
+種目名・グループ名・規則用語・技名の構成語（宙返り・後方・屈身・ひねりなど）・人名の技の対訳表と、
+英語の技カタログ（skills_*.json）の技名を skills_ja.csv の技名に対応付けた結果を
+オフラインで data/term_dictionary.json にまとめる。
+技名の対応付けは、英語の技名を構成語ごとに日本語へ置き換え、その語をすべて含む日本語の技を探す
+（英語カタログのファイルと種目が一致しないものがあるため、種目は日本語側の技から決める）。
+
+配信時は辞書の英語表記を1つのオートマトン（intent_matcher.KeywordAutomaton）にまとめ、
+質問を1回走査して見つかった語の日本語表記で検索する（数マイクロ秒〜数十マイクロ秒）。
+
+使い方:
+    python term_dictionary.py            # data/term_dictionary.json を再生成
+    python term_dictionary.py --dry-run  # 対応付けの件数と例を表示
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from intent_matcher import KeywordAutomaton
+from skill_catalog import APPARATUS_NAMES, DATA_DIR, EN_CATALOG_FILES, GROUP_ROMAN, Skill, load_skills_en, load_skills_ja
+
+DICTIONARY_FILE = os.path.join(DATA_DIR, "term_dictionary.json")
+DICTIONARY_VERSION = 1
+
+# 種目（英語表記 → 種目コード）
+APPARATUS_TERMS: Dict[str, str] = {
+    "floor exercise": "FX", "floor": "FX",
+    "pommel horse": "PH", "pommels": "PH",
+    "still rings": "SR", "rings": "SR",
+    "vault": "VT", "vaulting": "VT",
+    "parallel bars": "PB",
+    "horizontal bar": "HB", "high bar": "HB",
+}
+# 知識ベースでの種目の別表記
+APPARATUS_ALIASES: Dict[str, Tuple[str, ...]] = {"FX": ("ゆか",)}
+
+# 規則・採点の用語
+RULE_TERMS: Dict[str, Tuple[str, ...]] = {
+    "code of points": ("採点規則",),
+    "rule": ("ルール", "規則"),
+    "rules": ("ルール", "規則"),
+    "d score": ("Dスコア", "難度点"),
+    "difficulty score": ("Dスコア", "難度点"),
+    "e score": ("Eスコア", "実施点"),
+    "execution score": ("Eスコア", "実施点"),
+    "final score": ("決定点",),
+    "difficulty value": ("難度価値点",),
+    "difficulty": ("難度",),
+    "value": ("価値点",),
+    "group requirement": ("グループ要求",),
+    "group requirements": ("グループ要求",),
+    "element group": ("グループ",),
+    "group bonus": ("グループボーナス", "グループ価値点"),
+    "connection bonus": ("連続技ボーナス",),
+    "connection value": ("連続技ボーナス",),
+    "connection": ("連続技",),
+    "connections": ("連続技",),
+    "combination": ("組合せ",),
+    "deduction": ("減点",),
+    "deductions": ("減点",),
+    "penalty": ("減点",),
+    "execution deduction": ("実施減点",),
+    "neutral deduction": ("ND減点", "ニュートラルディダクション"),
+    "neutral deductions": ("ND減点", "ニュートラルディダクション"),
+    "fall": ("落下",),
+    "falls": ("落下",),
+    "resume": ("復帰",),
+    "time limit": ("時間制限",),
+    "landing": ("着地",),
+    "strength": ("力技",),
+    "strength hold": ("力技", "静止時間"),
+    "hold": ("静止",),
+    "held": ("静止",),
+    "seconds": ("秒間",),
+    "skill": ("技",),
+    "skills": ("技",),
+    "element": ("技",),
+    "elements": ("技",),
+    "routine": ("演技",),
+    "judge": ("審判",),
+    "judges": ("審判",),
+    "dismount": ("終末技", "下り"),
+    "apparatus": ("種目",),
+}
+
+# 技名の構成語（英語カタログの略記を含む）
+SKILL_TERMS: Dict[str, Tuple[str, ...]] = {
+    "salto": ("宙返り",),
+    "double salto": ("2回宙返り",), "dbl salto": ("2回宙返り",),
+    "triple salto": ("3回宙返り",),
+    "backward": ("後方",), "backwards": ("後方",), "bwd": ("後方",),
+    "forward": ("前方",), "fwd": ("前方",),
+    "sideward": ("側方",),
+    "tuck": ("かかえ込み",), "tucked": ("かかえ込み",),
+    "pike": ("屈身",), "piked": ("屈身",),
+    "straight": ("伸身",), "stretched": ("伸身",), "str": ("伸身",),
+    "straddle": ("開脚",), "straddled": ("開脚",),
+    "twist": ("ひねり",),
+    "handspring": ("前転とび",),
+    "handstand": ("倒立",), "hdst": ("倒立",),
+    "support": ("支持",),
+    "hang": ("懸垂",),
+    "cross": ("十字",),
+    "inverted cross": ("十字倒立",),
+    "swallow": ("中水平支持", "中水平"),
+    "support scale": ("上水平支持", "水平支持"),
+    "planche": ("上水平",),
+    "kip": ("け上がり",),
+    "back kip": ("後方け上がり",),
+    "uprise": ("振り上がり",),
+    "uprise fwd": ("前振り上がり",), "uprise forward": ("前振り上がり",), "forward uprise": ("前振り上がり",),
+    "uprise bwd": ("後ろ振り上がり",), "uprise backward": ("後ろ振り上がり",), "back uprise": ("後ろ振り上がり",),
+    "spindle": ("シュピンデル",),
+    "flair": ("開脚旋回",), "flairs": ("開脚旋回",),
+    "circle": ("旋回",), "circles": ("旋回",),
+    "travel": ("移動",),
+    "russian": ("ロシアン",),
+    "wende": ("転向",), "wendeswing": ("転向",), "wendeswings": ("転向",),
+    "jump": ("とび",),
+    "roll": ("転",),
+    "swing": ("振",),
+}
+
+# 技名の中だけで使う1文字の略記（質問の照合には使わない）
+SKILL_ABBREVIATIONS: Dict[str, Tuple[str, ...]] = {"t": ("かかえ込み",), "p": ("屈身",)}
+
+# 人名の付いた技（英語表記 → カタカナ）
+EPONYMS: Dict[str, str] = {
+    "eichorn": "アイヒホルン", "keikha": "ケイハ", "keiha": "ケイハ", "honma": "ホンマ",
+    "kolyvanov": "コリバノフ", "tong fei": "トンフェイ", "wu guonian": "ウ・グォニアン",
+    "wu guyonian": "ウ・グォニアン", "urzica": "ウルジカ", "sivado": "シバド", "magyar": "マジャール",
+    "maygar": "マジャール", "driggs": "ドリッグス", "guczoghy": "グチョギー", "o'neill": "オニール",
+    "stockli": "シュテクリ", "stoeckli": "シュテクリ", "berki": "ベルキ", "roth": "ロス",
+    "kovacs": "コバチ", "tkatchev": "トカチェフ", "tsukahara": "ツカハラ", "yurchenko": "ユルチェンコ",
+    "yamawaki": "ヤマワキ", "shirai": "シライ", "manna": "マンナ", "diamidov": "ディアミドフ",
+    "healy": "ヒーリー", "zanetti": "ザネッティ", "azarian": "アザリアン", "balandin": "バランディン",
+    "yamamuro": "ヤマムロ", "gienger": "ギンガー", "moy": "モイ", "behle": "ベーレ",
+    "li jonson": "リ・ジョンソン", "rudolph": "ルドルフ", "kasamatsu": "カサマツ",
+}
+
+# ひねり・転向の回数（分数 → 日本語の表記）
+_TWIST_WORDS = ("t", "twist", "twists", "turn", "turns")
+_HALF_TURNS = {"1/2": ("ひねり", "1/2ひねり"), "3/2": ("3/2ひねり", "1回半ひねり"),
+               "5/2": ("5/2ひねり", "2回半ひねり"), "7/2": ("7/2ひねり", "3回半ひねり")}
+# 種目の転向（ロシアンなど）の角度
+_TURN_DEGREES = {"180", "270", "360", "450", "540", "630", "720", "900", "1080"}
+
+# 対応付けの採用条件（英語側の構成語の一致率・一致した語の重み・日本語の技名のうち一致した語が占める割合）
+MIN_ALIGNMENT_RATIO = 0.8
+MIN_ALIGNMENT_WEIGHT = 2.0
+MIN_ALIGNMENT_COVERAGE = 0.6
+EPONYM_WEIGHT = 3.0
+
+_EN_TOKEN = re.compile(r"\d+/\d+|[a-z0-9]+")
+_JA_CHARS = re.compile(r"[\u3040-\u30ff\u4e00-\u9fff]")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+# 日本語の技名の先頭にある通称（「（ザバタ）」など）
+_JA_EPONYM_PREFIX = re.compile(r"^[（(][^）)]*[）)]")
+# 宙返り・ひねりの回数（「2回宙返り」「1回半ひねり」「2回(3/2)ひねり」「3/2ひねり」）
+_JA_COUNT_PREFIX = re.compile(r"(?:\d+回半?|\d+/\d+)(?:\(\d+(?:回半?|/\d+)\))?$")
+_JA_SALTO = re.compile(r"(?:(\d+)回)?宙返り")
+_JA_TWIST = re.compile(r"(?:(\d+)回(半)?|(\d+)/(\d+))?(?:\((?:(\d+)回(半)?|(\d+)/(\d+))\))?ひねり")
+_JA_OPTIONAL_TWIST = re.compile(r"\(ひねり\)")
+_JA_TWIST_ALTERNATIVE = re.compile(r"(\d+回半?|\d+/\d+)\((\d+回半?|\d+/\d+)\)ひねり")
+# 技名の末尾の注記（「(後ろとびひねりからも含む)」など。静止時間の「(2秒)」は技の一部として残す）
+_JA_NOTE_SUFFIX = re.compile(r"\((?![^()]*秒)[^()]*\)$")
+_EN_SALTO_COUNTS = {"double": 2, "dbl": 2, "triple": 3}
+
+
+def normalize_en(text: str) -> str:
+    """英語表記の照合キー（小文字・記号を空白に・前後に空白を付けて語の境界で照合できるようにする）"""
+    text = unicodedata.normalize("NFKC", text).lower().replace("⁄", "/")
+    text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    text = text.replace("'", "").replace("’", "")
+    return " " + " ".join(_EN_TOKEN.findall(text)) + " "
+
+
+def _normalize_ja(text: str) -> str:
+    """照合用の日本語の技名（「1回(1回半)ひねり」は「1回ひねり/1回半ひねり」に展開する）"""
+    text = "".join(unicodedata.normalize("NFKC", text).split())
+    return _JA_TWIST_ALTERNATIVE.sub(r"\1ひねり/\2ひねり", text)
+
+
+def _ja_core(normalized: str) -> str:
+    return _JA_EPONYM_PREFIX.sub("", normalized) or normalized
+
+
+def _related_terms() -> Dict[str, Tuple[str, ...]]:
+    """構成語 → それを含むより長い構成語（「十字」→「十字倒立」、「宙返り」→「2回宙返り」）"""
+    forms = {form for terms in SKILL_TERMS.values() for form in terms}
+    return {form: tuple(term for term in forms if form in term and term != form) for form in forms}
+
+
+_RELATED_TERMS = _related_terms()
+
+
+def _contains_form(normalized: str, form: str, rendered: Set[str]) -> bool:
+    """日本語の技名が構成語を含むか
+
+    英語の技名で説明されないより長い構成語の一部（「十字倒立」の「十字」、「中水平支持」の「水平支持」）と、
+    回数の付いた表記の一部（「2回宙返り」の「宙返り」、「1回ひねり」の「ひねり」）には一致させない。
+    """
+    related = [term for term in _RELATED_TERMS.get(form, ())
+               if term not in rendered and term.replace(form, "", 1) not in rendered]
+    start = normalized.find(form)
+    while start >= 0:
+        end = start + len(form)
+        if form[0].isdigit():
+            counted = start > 0 and normalized[start - 1].isdigit()
+        else:
+            counted = bool(_JA_COUNT_PREFIX.search(normalized[:start]))
+        inside = any(
+            i + len(term) >= end
+            for term in related
+            for i in _occurrences(normalized, term, start - len(term) + len(form), start)
+        )
+        if not counted and not inside:
+            return True
+        start = normalized.find(form, start + 1)
+    return False
+
+
+def _occurrences(text: str, term: str, lo: int, hi: int) -> List[int]:
+    """text 中の term の出現位置のうち lo〜hi から始まるもの"""
+    found = []
+    i = text.find(term, max(lo, 0))
+    while 0 <= i <= hi:
+        found.append(i)
+        i = text.find(term, i + 1)
+    return found
+
+
+def _twist_turns(count: Optional[str], half: Optional[str], numerator: Optional[str], denominator: Optional[str]) -> Optional[float]:
+    if count:
+        return int(count) + (0.5 if half else 0.0)
+    if numerator and int(denominator):
+        return int(numerator) / int(denominator)
+    return None
+
+
+def ja_counts(normalized: str) -> Tuple[Set[float], Set[float], Set[float]]:
+    """日本語の技名の宙返りの回数・ひねりの回数（括弧内の別回数を含む）・省略できない「(ひねり)」以外のひねりの回数"""
+    core = _JA_NOTE_SUFFIX.sub("", _ja_core(normalized))
+    saltos = {float(m.group(1) or 1) for m in _JA_SALTO.finditer(core)}
+
+    def twists(text: str) -> Set[float]:
+        found: Set[float] = set()
+        for m in _JA_TWIST.finditer(text):
+            turns = [_twist_turns(*m.group(1, 2, 3, 4)), _twist_turns(*m.group(5, 6, 7, 8))]
+            # 回数のない「ひねり」は 1/2 ひねり
+            found.update([t for t in turns if t is not None] or [0.5])
+        return found
+
+    return saltos, twists(core), twists(_JA_OPTIONAL_TWIST.sub("", core))
+
+
+def en_counts(name: str) -> Tuple[Set[float], Set[float], bool]:
+    """英語の技名の宙返りの回数・ひねりの回数と、回数なしで twist と書かれているか"""
+    tokens = normalize_en(name).split()
+    saltos: Set[float] = set()
+    twists: Set[float] = set()
+    bare_twist = False
+    for i, token in enumerate(tokens):
+        if token in ("salto", "saltos"):
+            saltos.add(float(_EN_SALTO_COUNTS.get(tokens[i - 1], 1) if i else 1))
+        elif "/" in token:
+            numerator, denominator = token.split("/")
+            if int(denominator):
+                twists.add(int(numerator) / int(denominator))
+        elif token in ("twist", "twists"):
+            bare_twist = True
+    return saltos, twists, bare_twist
+
+
+def _counts_differ(en: Tuple[Set[float], Set[float], bool], ja: Tuple[Set[float], Set[float], Set[float]]) -> bool:
+    """宙返り・ひねりの回数が英語の技名と食い違うか（「1/2ひねり」の技に「1回ひねり」の技を対応付けない）"""
+    en_saltos, en_twists, bare_twist = en
+    ja_saltos, ja_twists, ja_required_twists = ja
+    if not en_saltos and not en_twists:
+        return False
+    if en_saltos and ja_saltos - en_saltos:
+        return True
+    if en_twists:
+        return bool(ja_twists) and not ja_twists & en_twists
+    return not bare_twist and bool(ja_required_twists)
+
+
+def _glossary() -> Dict[str, Tuple[str, ...]]:
+    """英語表記 → 日本語表記（種目・グループ・規則用語・技の構成語・人名）"""
+    terms: Dict[str, Tuple[str, ...]] = {}
+    for en, code in APPARATUS_TERMS.items():
+        terms[en] = (APPARATUS_NAMES[code],) + APPARATUS_ALIASES.get(code, ())
+    for number, roman in GROUP_ROMAN.items():
+        for en in (f"group {number}", f"group {roman}"):
+            terms[normalize_en(en).strip()] = (f"グループ{roman}",)
+    terms.update(RULE_TERMS)
+    terms.update(SKILL_TERMS)
+    terms.update({en: (ja,) for en, ja in EPONYMS.items()})
+    return {normalize_en(en).strip(): ja for en, ja in terms.items()}
+
+
+def render_skill(name: str) -> List[Tuple[Tuple[str, ...], float]]:
+    """英語の技名を日本語の構成語（表記の候補, 重み）の列にする"""
+    tokens = normalize_en(name).split()
+    phrases = {**SKILL_ABBREVIATIONS,
+               **{normalize_en(k).strip(): v for k, v in SKILL_TERMS.items()},
+               **{normalize_en(k).strip(): (v,) for k, v in EPONYMS.items()}}
+    eponyms = {normalize_en(k).strip() for k in EPONYMS}
+    longest = max(len(p.split()) for p in phrases)
+    rendered: List[Tuple[Tuple[str, ...], float]] = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if "/" in token:
+            numerator, denominator = token.split("/")
+            if i + 1 < len(tokens) and tokens[i + 1] in _TWIST_WORDS:
+                i += 1
+            if token in _HALF_TURNS:
+                rendered.append((_HALF_TURNS[token], 1.0))
+            elif denominator == "1":
+                rendered.append(((f"{numerator}回ひねり",), 1.0))
+            else:
+                rendered.append(((f"{token}ひねり",), 1.0))
+            i += 1
+            continue
+        if token in _TURN_DEGREES:
+            rendered.append(((token,), 1.0))
+            i += 1
+            continue
+        for size in range(min(longest, len(tokens) - i), 0, -1):
+            phrase = " ".join(tokens[i:i + size])
+            if phrase in phrases:
+                weight = EPONYM_WEIGHT if phrase in eponyms else 1.0
+                rendered.append((phrases[phrase], weight))
+                i += size
+                break
+        else:
+            i += 1
+    # 同じ語の重複（"tucked or tucked with ..."）は1回に数える
+    return list(dict.fromkeys(rendered))
+
+
+def align_skill(skill: Skill, candidates: Sequence[Tuple[Skill, str]]) -> Optional[Dict]:
+    """構成語の一致率が最も高い日本語の技（条件を満たさなければ None）"""
+    rendered = render_skill(skill.name)
+    total = sum(weight for _, weight in rendered)
+    if not total:
+        return None
+    counts = en_counts(skill.name)
+    rendered_forms = {form for forms, _ in rendered for form in forms}
+    best: Optional[Tuple[tuple, Skill, float]] = None
+    for candidate, normalized in candidates:
+        # 宙返り・ひねりの回数が違う技は、構成語が一致しても別の技
+        if _counts_differ(counts, ja_counts(normalized)):
+            continue
+        matched, matched_chars = 0.0, 0
+        for forms, weight in rendered:
+            form = next((f for f in forms if _contains_form(normalized, f, rendered_forms)), None)
+            if form:
+                matched += weight
+                matched_chars += len(form)
+        if matched < MIN_ALIGNMENT_WEIGHT or matched / total < MIN_ALIGNMENT_RATIO:
+            continue
+        # 日本語の技名に説明されない語が多いもの（より長い組み合わせ技など）は採らない
+        coverage = min(1.0, matched_chars / len(_JA_NOTE_SUFFIX.sub("", _ja_core(normalized)) or normalized))
+        if coverage < MIN_ALIGNMENT_COVERAGE:
+            continue
+        # 一致率 → 日本語側の説明率 → 種目・難度・グループの一致 の順に優先する
+        rank = (
+            -matched / total,
+            -coverage,
+            candidate.apparatus != skill.apparatus,
+            candidate.value_letter != skill.value_letter,
+            candidate.group != skill.group,
+            len(normalized),
+        )
+        if best is None or rank < best[0]:
+            best = (rank, candidate, matched / total)
+    if best is None:
+        return None
+    _, candidate, ratio = best
+    return {
+        "en": skill.name,
+        "ja": candidate.name,
+        "ja_id": candidate.id,
+        "apparatus": candidate.apparatus,
+        "group": candidate.group,
+        "source": skill.source,
+        "score": round(ratio, 3),
+    }
+
+
+def build_dictionary(en_skills: Sequence[Skill], ja_skills: Sequence[Skill]) -> Dict:
+    """対訳表と技名の対応付けをまとめる"""
+    candidates = [(skill, _normalize_ja(skill.name)) for skill in ja_skills]
+    skills = [aligned for aligned in (align_skill(skill, candidates) for skill in en_skills) if aligned]
+    return {"version": DICTIONARY_VERSION, "terms": _glossary(), "skills": skills}
+
+
+def _sources_sha256(data_dir: str) -> Dict[str, str]:
+    digests = {}
+    for file_name in ["skills_ja.csv"] + list(EN_CATALOG_FILES.values()):
+        path = os.path.join(data_dir, file_name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digests[file_name] = hashlib.sha256(f.read()).hexdigest()
+    return digests
+
+
+def write_dictionary(dictionary: Dict, path: str = DICTIONARY_FILE, data_dir: str = DATA_DIR) -> None:
+    dictionary = {**dictionary, "source_sha256": _sources_sha256(data_dir), "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dictionary, f, ensure_ascii=False, indent=1)
+    print(f"✅ 書き出し: {path} (用語 {len(dictionary['terms'])}, 技 {len(dictionary['skills'])})")
+
+
+class TermDictionary:
+    """英語表記の一括照合と、日本語表記によるクエリ拡張"""
+
+    def __init__(self, dictionary: Optional[Dict] = None):
+        dictionary = dictionary or {}
+        payloads: Dict[str, List[Tuple[str, str]]] = {}
+        for en, forms in dictionary.get("terms", {}).items():
+            for ja in forms:
+                payloads.setdefault(f" {en} ", []).append(("term", ja))
+        for entry in dictionary.get("skills", []):
+            payloads.setdefault(normalize_en(entry["en"]), []).append(("skill", entry["ja"]))
+        self.size = len(payloads)
+        self._automaton = KeywordAutomaton(payloads) if payloads else None
+
+    @classmethod
+    def from_file(cls, path: str = DICTIONARY_FILE, data_dir: str = DATA_DIR) -> "TermDictionary":
+        """生成元の技カタログのハッシュが現在の内容と一致する場合のみ読み込む（古い辞書は使わない）"""
+        if not os.path.exists(path):
+            print(f"対訳用語辞書が見つかりません: {path}（python term_dictionary.py で生成できます）")
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            dictionary = json.load(f)
+        if dictionary.get("source_sha256") != _sources_sha256(data_dir):
+            print(f"対訳用語辞書が技カタログより古いため使いません: {path}（python term_dictionary.py で再生成してください）")
+            return cls()
+        return cls(dictionary)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def translate(self, text: str) -> List[str]:
+        """文中の英語の用語・技名に対応する日本語表記（出現順・重複なし）"""
+        if self._automaton is None or not any("a" <= ch.lower() <= "z" for ch in text):
+            return []
+        found: List[str] = []
+        for _, keyword in self._automaton.iter_matches(normalize_en(text)):
+            for _, ja in self._automaton.payloads[keyword]:
+                if ja not in found:
+                    found.append(ja)
+        return found
+
+    def expand(self, text: str) -> str:
+        """検索用の質問 - 英語だけの質問は日本語表記と数字に置き換え、日本語まじりなら後ろに付け足す
+
+        英語の語を残すと英語の原文（ルールブックの技名一覧など）ばかりが上位に来るため、
+        訳語が見つかった英語の質問は日本語表記だけで検索する（数字は「5技」などの照合に残す）。
+        """
+        terms = self.translate(text)
+        if not terms:
+            return text
+        if _JA_CHARS.search(text):
+            return f"{text} {' '.join(terms)}"
+        return " ".join(terms + _NUMBER.findall(text))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="英語の技カタログと日本語の技カタログから対訳用語辞書を作る")
+    parser.add_argument("--output", default=DICTIONARY_FILE, help="出力先")
+    parser.add_argument("--dry-run", action="store_true", help="書き出さずに件数と例を表示する")
+    args = parser.parse_args()
+
+    en_skills = load_skills_en()
+    dictionary = build_dictionary(en_skills, load_skills_ja())
+    print(f"用語: {len(dictionary['terms'])} / 技: {len(dictionary['skills'])} / 英語カタログ {len(en_skills)} 技")
+    if args.dry_run:
+        for entry in dictionary["skills"]:
+            print(f"  {entry['score']:.2f} {entry['apparatus']} {entry['en']} → {entry['ja']}")
+        return
+    write_dictionary(dictionary, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+トークン計測と出力長の制御
+
+上流APIの usage（prompt_tokens / completion_tokens）をリクエスト単位で集計し、
+クライアント（X-Device-ID）ごとの利用量と残り予算を保持する。
+max_tokens は質問の種類と残り予算から決め、短い事実確認の質問に
+長い出力上限の生成待ちを払わせない。
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from intent_matcher import MessageMatch
+
+# 質問の種類ごとの出力上限
+QUESTION_CLASS_MAX_TOKENS: Dict[str, int] = {
+    "greeting": 200,
+    "factual": 350,
+    "explanation": 900,
+    "analysis": 1500,
+}
+MIN_OUTPUT_TOKENS = 150
+
+# クライアント数が上限を超えたときに減らす割合
+LEDGER_EVICT_TARGET_RATIO = 0.9
+
+# TokenLedger.record がレスポンスに加える、クライアントごとの項目
+LEDGER_FIELDS = ("usage_count", "remaining_count", "usage")
+
+# 事実確認の質問とみなす最大文字数
+FACTUAL_MAX_CHARS = 40
+# 説明を求める語（短くても explanation 扱いにする）
+EXPLANATION_MARKERS = ("なぜ", "どうして", "理由", "説明", "違い", "比較", "コツ", "方法", "練習", "改善", "詳しく", "why", "how", "explain")
+
+
+def classify_question(message: str, message_match: MessageMatch, has_routine: bool = False) -> str:
+    """質問の種類（greeting / factual / explanation / analysis）"""
+    lowered = message.lower()
+    if has_routine or "routine_analysis" in message_match.intents:
+        return "analysis"
+    if "greeting" in message_match.intents and len(message) <= FACTUAL_MAX_CHARS:
+        return "greeting"
+    if len(message) <= FACTUAL_MAX_CHARS and not any(marker in lowered for marker in EXPLANATION_MARKERS):
+        return "factual"
+    return "explanation"
+
+
+def choose_max_tokens(question_class: str, remaining: Optional[int] = None) -> int:
+    """質問の種類と残り予算から max_tokens を決める（remaining が None なら予算なし）"""
+    limit = QUESTION_CLASS_MAX_TOKENS.get(question_class, QUESTION_CLASS_MAX_TOKENS["explanation"])
+    if remaining is not None:
+        limit = min(limit, max(remaining, MIN_OUTPUT_TOKENS))
+    return limit
+
+
+@dataclass
+class TokenUsage:
+    """1リクエスト分の上流API利用量"""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    calls: int = 0
+    max_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add_response(self, response: Any, max_tokens: int = 0) -> None:
+        usage = getattr(response, "usage", None)
+        self.prompt_tokens += int(getattr(usage, "prompt_tokens", 0) or 0)
+        self.completion_tokens += int(getattr(usage, "completion_tokens", 0) or 0)
+        self.calls += 1
+        self.max_tokens = max(self.max_tokens, max_tokens)
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "calls": self.calls,
+            "max_tokens": self.max_tokens,
+        }
+
+
+_current_usage: ContextVar[Optional[TokenUsage]] = ContextVar("token_usage", default=None)
+
+
+def start_usage() -> TokenUsage:
+    """現在のリクエストの集計を開始する（以降の record_usage はここに加算される）"""
+    usage = TokenUsage()
+    _current_usage.set(usage)
+    return usage
+
+
+def record_usage(response: Any, max_tokens: int = 0) -> None:
+    """上流APIのレスポンスの usage を現在のリクエストに加算する"""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add_response(response, max_tokens)
+
+
+def client_id_for(request: Any) -> str:
+    """アプリが送る X-Device-ID をクライアントIDとして使う（なければ接続元アドレス）"""
+    device_id = request.headers.get("x-device-id")
+    if device_id:
+        return device_id
+    return request.client.host if request.client else "anonymous"
+
+
+class TokenLedger:
+    """クライアントごとのトークン利用量（一定期間ごとにリセット）
+
+    期間が終わったクライアントは新規と同じなので、保持数が max_clients を超えたら削除する。
+    それでも超える場合は、最後に利用されたのが古いクライアントから上限の9割まで削除する。
+    """
+
+    def __init__(self, budget_per_client: int = 0, window_seconds: float = 86400.0, max_clients: int = 100000):
+        self.budget_per_client = budget_per_client  # 0 は無制限
+        self.window_seconds = window_seconds
+        self.max_clients = max_clients
+        self.evicted = 0
+        self._clients: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "TokenLedger":
+        return cls(
+            budget_per_client=int(os.environ.get("TOKEN_BUDGET_PER_CLIENT", 0)),
+            window_seconds=float(os.environ.get("TOKEN_BUDGET_WINDOW", 86400)),
+            max_clients=int(os.environ.get("TOKEN_LEDGER_MAX_CLIENTS", 100000)),
+        )
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def _entry(self, client_id: str) -> Dict[str, Any]:
+        now = time.time()
+        entry = self._clients.get(client_id)
+        if entry is None or now - entry["window_start"] > self.window_seconds:
+            entry = {"window_start": now, "requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            self._clients[client_id] = entry
+        self._clients.move_to_end(client_id)
+        if len(self._clients) > self.max_clients:
+            self._evict(now)
+        return entry
+
+    def _evict(self, now: float) -> None:
+        expired = [key for key, entry in self._clients.items() if now - entry["window_start"] > self.window_seconds]
+        for key in expired:
+            del self._clients[key]
+        self.evicted += len(expired)
+        # 上限を超えるたびに全件を見直さないよう、上限の9割まで減らす
+        while len(self._clients) > int(self.max_clients * LEDGER_EVICT_TARGET_RATIO):
+            self._clients.popitem(last=False)
+            self.evicted += 1
+
+    def remaining(self, client_id: str) -> Optional[int]:
+        """残りトークン数（予算なしの場合は None）"""
+        if not self.budget_per_client:
+            return None
+        with self._lock:
+            entry = self._entry(client_id)
+            return max(0, self.budget_per_client - entry["prompt_tokens"] - entry["completion_tokens"])
+
+    def exhausted(self, client_id: str) -> bool:
+        remaining = self.remaining(client_id)
+        return remaining is not None and remaining <= 0
+
+    def record(self, client_id: str, usage: TokenUsage) -> Dict[str, Any]:
+        """利用量を加算し、レスポンスに含める項目を返す"""
+        with self._lock:
+            entry = self._entry(client_id)
+            entry["requests"] += 1
+            entry["prompt_tokens"] += usage.prompt_tokens
+            entry["completion_tokens"] += usage.completion_tokens
+            counts = self._counts(entry)
+        return {**counts, "usage": usage.to_dict()}
+
+    def counts(self, client_id: str) -> Dict[str, int]:
+        """加算せずに現在の usage_count / remaining_count を返す（共有された結果に付ける用）"""
+        with self._lock:
+            return self._counts(self._entry(client_id))
+
+    def _counts(self, entry: Dict[str, Any]) -> Dict[str, int]:
+        used = entry["prompt_tokens"] + entry["completion_tokens"]
+        return {
+            "usage_count": entry["requests"],
+            "remaining_count": max(0, self.budget_per_client - used) if self.budget_per_client else -1,
+        }
+
+    def snapshot(self, client_id: str) -> Dict[str, Any]:
+        with self._lock:
+            entry = dict(self._entry(client_id))
+        used = entry["prompt_tokens"] + entry["completion_tokens"]
+        return {
+            "client_id": client_id,
+            "requests": entry["requests"],
+            "prompt_tokens": entry["prompt_tokens"],
+            "completion_tokens": entry["completion_tokens"],
+            "total_tokens": used,
+            "budget": self.budget_per_client or None,
+            "remaining": max(0, self.budget_per_client - used) if self.budget_per_client else None,
+            "window_resets_at": entry["window_start"] + self.window_seconds,
+        }